@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Навантажувальне тестування StudyVault
+
+Усе працює на одній машині без мережі та без MongoDB: сервери
+запускаються проти колекції в пам'яті (FakeCollection).
+
+    # HTTP GET статики, POST /message та UDP потік з JSON звітом
+    python benchmark.py run --output bench.json
+
+    # Порівняння з попереднім запуском (код виходу 1 при регресії)
+    python benchmark.py run --baseline bench.json --max-regression 0.1
+
+    # Порівняння режимів Socket-сервера threaded та asyncio
+    python benchmark.py modes --count 50000 --latency-ms 2
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import resource
+import signal
+import socket
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from pymongo.results import InsertManyResult, InsertOneResult
+from bson import ObjectId
+
+from main import (
+    LOG, StudyVaultHTTPHandler, StudyVaultHTTPServer,
+    UDPMessageSender, build_route_table, create_socket_server,
+)
+
+
+# Маршрути статики, які браузер запитує при завантаженні сторінки
+STATIC_ROUTES = ['/', '/style.css', '/script.js', '/logo.png', '/message.html']
+HTTP_USERNAME = 'bench-http'
+UDP_USERNAME = 'bench-udp'
+
+
+def bench_username(prefix, i):
+    """Окремий username на повідомлення: ліміт на username і фільтр
+    повторів діють як у роботі, а не зрізають потік одного користувача"""
+    return f'{prefix}-{i}'
+
+
+class FakeCollection:
+    """Колекція MongoDB в пам'яті з імітацією мережевої затримки"""
+
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.documents = []
+        self.lock = threading.Lock()
+
+    def insert_one(self, document):
+        time.sleep(self.latency)
+        document.setdefault('_id', ObjectId())
+        with self.lock:
+            self.documents.append(document)
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered=True):
+        time.sleep(self.latency)
+        documents = list(documents)
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+        with self.lock:
+            self.documents.extend(documents)
+        return InsertManyResult([d['_id'] for d in documents], True)
+
+    def count(self):
+        with self.lock:
+            return len(self.documents)
+
+    def count_by_username(self):
+        counts = {}
+        with self.lock:
+            for document in self.documents:
+                # Лічильник за префіксом: bench-http-17 -> bench-http
+                username = document['username'].rsplit('-', 1)[0]
+                counts[username] = counts.get(username, 0) + 1
+        return counts
+
+
+def free_port(kind=socket.SOCK_DGRAM):
+    """Пошук вільного локального порту"""
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentiles(latencies):
+    """p50/p95/p99/max у мілісекундах"""
+    if not latencies:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+
+    ordered = sorted(latencies)
+
+    def pick(q):
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return round(ordered[index] * 1000, 3)
+
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95),
+            'p99_ms': pick(0.99), 'max_ms': round(ordered[-1] * 1000, 3)}
+
+
+def wait_for_persisted(collection, expected, idle_timeout=2.0):
+    """Очікування запису всіх повідомлень або зупинки прогресу"""
+    last_count = -1
+    last_change = time.perf_counter()
+    while True:
+        count = collection.count()
+        now = time.perf_counter()
+        if count >= expected:
+            return now
+        if count != last_count:
+            last_count = count
+            last_change = now
+        elif now - last_change > idle_timeout:
+            return last_change
+        time.sleep(0.01)
+
+
+def send_udp(port, count, rate, username):
+    """Відправка UDP потоку (rate - датаграм за секунду, 0 - без обмеження)"""
+    payloads = [json.dumps({
+        'username': bench_username(username, i),
+        'message': 'Тестове повідомлення StudyVault',
+        'timestamp': '2024-08-14T18:00:00'
+    }).encode('utf-8') for i in range(count)]
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    started = time.perf_counter()
+    for i, payload in enumerate(payloads):
+        client.sendto(payload, ('127.0.0.1', port))
+        # Обмеження швидкості відправки пачками по 100 датаграм
+        if rate and i % 100 == 99:
+            delay = started + (i + 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    client.close()
+    return started, time.perf_counter()
+
+
+# --- Порівняння режимів Socket-сервера -------------------------------------
+
+def spool_directory(writer):
+    """Тимчасовий каталог журналу, щоб не підхопити сегменти минулих запусків"""
+    return tempfile.mkdtemp(prefix='studyvault-spool-') if writer == 'disk' else ''
+
+
+def bench_udp_mode(mode, count, latency_ms, rate=0, writer='disk'):
+    """Заміряє пропускну здатність одного режиму Socket-сервера"""
+    collection = FakeCollection(latency_ms)
+    port = free_port()
+    spool_dir = spool_directory(writer)
+    server = create_socket_server('127.0.0.1', port, collection, mode=mode,
+                                  spool_dir=spool_dir)
+    thread = threading.Thread(target=server.start_server, daemon=True)
+    thread.start()
+    while not server.running:
+        time.sleep(0.01)
+
+    started, _ = send_udp(port, count, rate, UDP_USERNAME)
+    finished = wait_for_persisted(collection, count)
+    server.stop_server()
+    if spool_dir:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    persisted = collection.count()
+    elapsed = max(finished - started, 1e-9)
+    return {
+        'mode': mode,
+        'sent': count,
+        'persisted': persisted,
+        'loss_rate': round(1 - persisted / count, 4) if count else 0.0,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(persisted / elapsed, 1),
+    }
+
+
+def command_modes(args):
+    results = [bench_udp_mode(mode, args.count, args.latency_ms, args.rate,
+                              args.writer)
+               for mode in args.modes.split(',')]
+
+    print()
+    print(f"{'режим':<10} {'надіслано':>10} {'записано':>10} "
+          f"{'втрати':>8} {'повідомл./с':>12}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['sent']:>10} {r['persisted']:>10} "
+              f"{r['loss_rate']:>8.2%} {r['messages_per_second']:>12}")
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+# --- Процес із серверами ------------------------------------------------------
+
+def command_serve(args):
+    """Запуск HTTP та Socket серверів проти FakeCollection
+
+    Після SIGTERM дописує буфер у колекцію та друкує рядок
+    'BENCH-RESULT {...}' зі статистикою процесу.
+    """
+    collection = FakeCollection(args.latency_ms)
+    spool_dir = spool_directory(args.writer)
+    socket_server = create_socket_server(
+        '127.0.0.1', args.udp_port, collection, mode=args.mode,
+        spool_dir=spool_dir)
+    threading.Thread(target=socket_server.start_server, daemon=True).start()
+
+    StudyVaultHTTPHandler.udp_sender = UDPMessageSender(
+        '127.0.0.1', args.udp_port)
+    http_server = StudyVaultHTTPServer(
+        ('127.0.0.1', args.http_port), StudyVaultHTTPHandler,
+        routes=build_route_table(args.base_dir))
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+    peak_threads = threading.active_count()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    while not socket_server.running:
+        time.sleep(0.01)
+    # Маркери пишуться одним write(): stdout ділить з ними потік логу
+    sys.stdout.write('BENCH-READY\n')
+    sys.stdout.flush()
+
+    while not stop.wait(0.01):
+        peak_threads = max(peak_threads, threading.active_count())
+
+    http_server.shutdown()
+    http_server.server_close()
+    socket_server.stop_server()
+    if spool_dir:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    LOG.flush()
+    sys.stdout.write('BENCH-RESULT ' + json.dumps({
+        'persisted': collection.count_by_username(),
+        'peak_rss_mb': round(rss_kb / 1024, 1),
+        'peak_threads': peak_threads,
+    }) + '\n')
+    sys.stdout.flush()
+
+
+class ServerProcess:
+    """Дочірній процес із серверами (щоб навантаження не ділило з ним GIL)"""
+
+    def __init__(self, args):
+        self.http_port = free_port(socket.SOCK_STREAM)
+        self.udp_port = free_port()
+        self.result = None
+        self.ready = threading.Event()
+        command = [
+            sys.executable, os.path.abspath(__file__), 'serve',
+            '--http-port', str(self.http_port),
+            '--udp-port', str(self.udp_port),
+            '--mode', args.mode,
+            '--writer', args.writer,
+            '--latency-ms', str(args.latency_ms),
+            '--base-dir', args.base_dir,
+        ]
+        self.process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, cwd=args.base_dir)
+        # Вивід сервера читається постійно, щоб pipe не заблокував процес
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+        if not self.ready.wait(30):
+            self.process.kill()
+            raise RuntimeError("Сервери не запустились за 30 секунд")
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            if line.startswith('BENCH-READY'):
+                self.ready.set()
+            elif line.startswith('BENCH-RESULT '):
+                self.result = json.loads(line[len('BENCH-RESULT '):])
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait(60)
+        self.reader.join(5)
+        return self.result or {}
+
+
+# --- Сценарії навантаження ----------------------------------------------------
+
+def run_clients(clients, requests, worker):
+    """Запуск requests запитів у clients потоках; worker(conn, i) -> latency"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        local = []
+        local_errors = 0
+        conn = None
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            if conn is None:
+                conn = worker.connect()
+            try:
+                local.append(worker(conn, i))
+            except Exception:
+                local_errors += 1
+                conn.close()
+                conn = None
+        if conn is not None:
+            conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+
+    return {
+        'requests': requests,
+        'ok': len(latencies),
+        'errors': errors[0],
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        **percentiles(latencies),
+    }
+
+
+class HTTPGetWorker:
+    """GET запити статики через keep-alive з'єднання"""
+
+    def __init__(self, port):
+        self.port = port
+
+    def connect(self):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+
+    def __call__(self, conn, i):
+        started = time.perf_counter()
+        conn.request('GET', STATIC_ROUTES[i % len(STATIC_ROUTES)],
+                     headers={'Accept-Encoding': 'gzip'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(response.status)
+        return time.perf_counter() - started
+
+
+class HTTPPostWorker(HTTPGetWorker):
+    """POST /message з формою повідомлення"""
+
+    def __call__(self, conn, i):
+        body = f'username={bench_username(HTTP_USERNAME, i)}&message=bench+{i}'
+        started = time.perf_counter()
+        conn.request('POST', '/message', body=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 302:
+            raise RuntimeError(response.status)
+        return time.perf_counter() - started
+
+
+def command_run(args):
+    server = ServerProcess(args)
+    results = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': vars(args).copy(),
+        'scenarios': {},
+    }
+    results['config'].pop('func', None)
+    scenarios = results['scenarios']
+
+    try:
+        print("🌐 HTTP GET статики...")
+        scenarios['http_get'] = run_clients(
+            args.clients, args.get_requests, HTTPGetWorker(server.http_port))
+
+        print("📬 HTTP POST /message...")
+        scenarios['http_post'] = run_clients(
+            args.clients, args.post_requests, HTTPPostWorker(server.http_port))
+
+        print("📡 UDP потік...")
+        started, finished = send_udp(
+            server.udp_port, args.udp_datagrams, args.udp_rate, UDP_USERNAME)
+        scenarios['udp_flood'] = {
+            'sent': args.udp_datagrams,
+            'seconds': round(finished - started, 3),
+            'send_rate': round(args.udp_datagrams / max(finished - started, 1e-9), 1),
+        }
+        # Час на обробку хвоста черги перед зупинкою
+        time.sleep(args.drain_seconds)
+
+    finally:
+        process = server.stop()
+
+    persisted = process.get('persisted', {})
+    post_ok = scenarios.get('http_post', {}).get('ok', 0)
+    for name, sent, username in (('http_post', post_ok, HTTP_USERNAME),
+                                 ('udp_flood', args.udp_datagrams, UDP_USERNAME)):
+        if name in scenarios:
+            stored = persisted.get(username, 0)
+            scenarios[name]['persisted'] = stored
+            scenarios[name]['loss_rate'] = \
+                round(1 - stored / sent, 4) if sent else 0.0
+
+    results['server'] = {
+        'peak_rss_mb': process.get('peak_rss_mb'),
+        'peak_threads': process.get('peak_threads'),
+    }
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"✅ Результати збережено в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_runs(baseline, results, args.max_regression)
+        if regressions:
+            for line in regressions:
+                print(f"❌ Регресія: {line}")
+            return 1
+        print("✅ Регресій відносно базового запуску немає")
+    return 0
+
+
+def compare_runs(baseline, current, max_regression):
+    """Порівняння пропускної здатності, p99 та втрат з базовим запуском"""
+    regressions = []
+    for name, before in baseline.get('scenarios', {}).items():
+        after = current['scenarios'].get(name)
+        if not after:
+            continue
+
+        for key in ('requests_per_second', 'send_rate'):
+            if before.get(key) and after.get(key) is not None and \
+                    after[key] < before[key] * (1 - max_regression):
+                regressions.append(
+                    f"{name}.{key}: {before[key]} -> {after[key]}")
+
+        if before.get('p99_ms') and after.get('p99_ms') is not None and \
+                after['p99_ms'] > before['p99_ms'] * (1 + max_regression):
+            regressions.append(
+                f"{name}.p99_ms: {before['p99_ms']} -> {after['p99_ms']}")
+
+        if after.get('loss_rate', 0) > before.get('loss_rate', 0) + max_regression:
+            regressions.append(
+                f"{name}.loss_rate: {before.get('loss_rate')} -> {after['loss_rate']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='повний набір сценаріїв')
+    run.add_argument('--clients', type=int, default=8,
+                     help='паралельні HTTP клієнти')
+    run.add_argument('--get-requests', type=int, default=5000)
+    run.add_argument('--post-requests', type=int, default=2000)
+    run.add_argument('--udp-datagrams', type=int, default=20000)
+    run.add_argument('--udp-rate', type=int, default=0,
+                     help='датаграм за секунду (0 - без обмеження)')
+    run.add_argument('--mode', default='threaded',
+                     help='режим Socket-сервера: threaded або asyncio')
+    run.add_argument('--latency-ms', type=float, default=1.0,
+                     help='імітована затримка одного запиту до MongoDB')
+    run.add_argument('--drain-seconds', type=float, default=1.0)
+    run.add_argument('--base-dir',
+                     default=os.path.dirname(os.path.abspath(__file__)))
+    run.add_argument('--output', help='файл для JSON результатів')
+    run.add_argument('--baseline', help='JSON попереднього запуску')
+    run.add_argument('--max-regression', type=float, default=0.1,
+                     help='допустиме погіршення (частка)')
+    run.add_argument('--writer', choices=('disk', 'memory'), default='disk',
+                     help='журнал на диску або пакетний буфер у пам\'яті')
+    run.set_defaults(func=command_run)
+
+    modes = commands.add_parser('modes', help='threaded vs asyncio')
+    modes.add_argument('--count', type=int, default=20000,
+                       help='кількість датаграм на режим')
+    modes.add_argument('--latency-ms', type=float, default=1.0)
+    modes.add_argument('--rate', type=int, default=0,
+                       help='датаграм за секунду (0 - без обмеження)')
+    modes.add_argument('--modes', default='threaded,asyncio',
+                       help='режими через кому')
+    modes.add_argument('--writer', choices=('disk', 'memory'),
+                       default='disk',
+                       help='журнал на диску або пакетний буфер у пам\'яті')
+    modes.set_defaults(func=command_modes)
+
+    serve = commands.add_parser('serve', help='внутрішня команда для run')
+    serve.add_argument('--http-port', type=int, required=True)
+    serve.add_argument('--udp-port', type=int, required=True)
+    serve.add_argument('--mode', default='threaded')
+    serve.add_argument('--latency-ms', type=float, default=1.0)
+    serve.add_argument('--base-dir', default='.')
+    serve.add_argument('--writer', choices=('disk', 'memory'),
+                       default='disk',
+                       help='журнал на диску або пакетний буфер у пам\'яті')
+    serve.set_defaults(func=command_serve)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args) or 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Збірка статики StudyVault
+
+Генерує логотип та відсутні шаблони, копіює статичні файли під іменами
+з хешем вмісту (style.3f9a1c0b2d4e.css) і записує manifest.json з
+відповідністю 'style.css' -> '/assets/style.3f9a1c0b2d4e.css'. Посилання
+на ці файли в HTML шаблонах замінюються на хешовані адреси, а вбудовані
+<style> та <script> шаблонів виносяться в такі ж файли (index.css,
+index.js). Сервер віддає /assets/ з Cache-Control: immutable, тож
+сторінка з no-cache не тягне за собою стилі та скрипти щоразу.
+
+Pillow потрібна лише тут (requirements-build.txt), сервер її не імпортує.
+
+    python build_assets.py            # результат у dist/
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+from random import Random
+
+
+# Файли, що отримують хеш вмісту в імені
+HASHED_ASSETS = ('style.css', 'script.js', 'logo.png')
+# Шаблони, які генеруються, якщо їх немає у templates/
+GENERATED_TEMPLATES = ('message.html', 'error.html')
+LOGO_SEED = 2024
+HASH_LENGTH = 12
+# Вбудовані стилі та скрипти без атрибутів (не <script src=...>)
+INLINE_BLOCK_RE = re.compile(r'<(style|script)>(.*?)</\1>', re.DOTALL)
+
+
+def create_message_html(path):
+    """Створення message.html"""
+    message_html_content = """<!DOCTYPE html>
+<html lang="uk">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>📬 Надіслати повідомлення - StudyVault</title>
+    <link rel="stylesheet" href="style.css">
+</head>
+<body>
+    <header>
+        <div class="header-content">
+            <h1>📬 Надіслати повідомлення</h1>
+            <p>Поділіться своєю думкою з іншими студентами</p>
+        </div>
+    </header>
+
+    <div class="container">
+        <div class="section">
+            <h2>✍️ Написати повідомлення</h2>
+
+            <!-- Повідомлення про успіх/помилку -->
+            <div id="message-status"></div>
+
+            <form action="/message" method="POST" class="message-form">
+                <div class="form-group">
+                    <label for="username" class="form-label">Ваше ім'я</label>
+                    <input
+                        type="text"
+                        id="username"
+                        name="username"
+                        class="form-input"
+                        placeholder="Введіть ваше ім'я..."
+                        required
+                    />
+                </div>
+
+                <div class="form-group">
+                    <label for="message" class="form-label">Повідомлення</label>
+                    <textarea
+                        id="message"
+                        name="message"
+                        class="form-input message-textarea"
+                        placeholder="Напишіть ваше повідомлення..."
+                        rows="4"
+                        required
+                    ></textarea>
+                </div>
+
+                <button type="submit" class="message-btn">📤 Надіслати повідомлення</button>
+            </form>
+
+            <a href="/" class="btn-secondary" style="display: inline-block; margin-top: 1rem;">
+                🏠 На головну
+            </a>
+        </div>
+    </div>
+
+    <script>
+        // Показуємо повідомлення про результат
+        const urlParams = new URLSearchParams(window.location.search);
+        const messageStatus = document.getElementById('message-status');
+
+        if (urlParams.get('success') === '1') {
+            messageStatus.innerHTML = '<div class="alert alert-success">✅ Повідомлення успішно надіслано!</div>';
+        } else if (urlParams.get('error') === '1') {
+            messageStatus.innerHTML = '<div class="alert alert-error">❌ Помилка: заповніть всі поля!</div>';
+        } else if (urlParams.get('error') === '2') {
+            messageStatus.innerHTML = '<div class="alert alert-error">❌ Помилка: повідомлення задовге!</div>';
+        } else if (urlParams.get('error') === '3') {
+            messageStatus.innerHTML = '<div class="alert alert-error">❌ Помилка: не вдалося надіслати повідомлення, спробуйте ще раз</div>';
+        }
+
+        // Стилі для повідомлень
+        const style = document.createElement('style');
+        style.textContent = `
+            .alert {
+                padding: 1rem;
+                margin-bottom: 1rem;
+                border-radius: 8px;
+                font-weight: 600;
+            }
+            .alert-success {
+                background: #d4edda;
+                color: #155724;
+                border: 1px solid #c3e6cb;
+            }
+            .alert-error {
+                background: #f8d7da;
+                color: #721c24;
+                border: 1px solid #f5c6cb;
+            }
+        `;
+        document.head.appendChild(style);
+    </script>
+</body>
+</html>"""
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(message_html_content)
+    print(f"✅ Створено {path}")
+
+
+def create_error_html(path):
+    """Створення error.html для 404"""
+    error_html_content = """<!DOCTYPE html>
+<html lang="uk">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>❌ Помилка 404 - StudyVault</title>
+    <link rel="stylesheet" href="style.css">
+</head>
+<body>
+    <header>
+        <div class="header-content">
+            <h1>❌ Сторінка не знайдена</h1>
+            <p>Помилка 404 - Not Found</p>
+        </div>
+    </header>
+
+    <div class="container">
+        <div class="section" style="text-align: center;">
+            <h2>🔍 Сторінка не існує</h2>
+            <p style="font-size: 1.2rem; margin: 2rem 0;">
+                Вибачте, але запитувана сторінка не знайдена.
+            </p>
+
+            <div style="margin: 2rem 0;">
+                <a href="/" class="btn-primary" style="margin: 0.5rem;">🏠 На головну</a>
+                <a href="/message.html" class="btn-secondary" style="margin: 0.5rem;">📬 Повідомлення</a>
+            </div>
+
+            <div style="font-size: 3rem; margin: 2rem 0;">📚🔍❓</div>
+        </div>
+    </div>
+</body>
+</html>"""
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(error_html_content)
+    print(f"✅ Створено {path}")
+
+
+def create_logo_png(path, seed=LOGO_SEED):
+    """Створення логотипу logo.png"""
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+        # Фіксоване зерно: той самий логотип (і хеш у назві) при кожній збірці
+        random = Random(seed)
+
+        # Створюємо зображення 128x128
+        img = Image.new('RGB', (128, 128), color='#000011')
+        draw = ImageDraw.Draw(img)
+
+        # Градієнт фону від темно-синього до фіолетового
+        for y in range(128):
+            # Градієнт від темно-синього до фіолетового
+            progress = y / 128
+            r = int(17 + (102 - 17) * progress)      # 11 -> 66 (hex)
+            g = int(17 + (30 - 17) * progress)       # 11 -> 1e
+            b = int(34 + (138 - 34) * progress)      # 22 -> 8a
+
+            # Додаємо трохи варіації
+            r += random.randint(-5, 5)
+            g += random.randint(-3, 3)
+            b += random.randint(-8, 8)
+
+            # Обмеження кольорів
+            r = max(0, min(255, r))
+            g = max(0, min(255, g))
+            b = max(0, min(255, b))
+
+            draw.line([(0, y), (128, y)], fill=(r, g, b))
+
+        # Додаємо зірки на фон
+        for _ in range(25):
+            x = random.randint(5, 123)
+            y = random.randint(5, 123)
+            size = random.randint(1, 2)
+            brightness = random.randint(180, 255)
+            draw.ellipse([x-size, y-size, x+size, y+size],
+                         fill=(brightness, brightness, brightness))
+
+        # Додаємо хрестики зірок
+        for _ in range(8):
+            x = random.randint(10, 118)
+            y = random.randint(10, 118)
+            brightness = random.randint(200, 255)
+            draw.line([(x-3, y), (x+3, y)], fill=(brightness,
+                      brightness, brightness), width=1)
+            draw.line([(x, y-3), (x, y+3)], fill=(brightness,
+                      brightness, brightness), width=1)
+            draw.line([(x-2, y-2), (x+2, y+2)],
+                      fill=(brightness, brightness, brightness), width=1)
+            draw.line([(x-2, y+2), (x+2, y-2)],
+                      fill=(brightness, brightness, brightness), width=1)
+
+        center_x, center_y = 64, 64
+
+        # Сяйво навколо книги
+        for radius in range(35, 25, -2):
+            alpha = int(50 - (35-radius)*3)
+            if alpha > 0:
+                glow_color = (102, 126, 234)  # #667eea
+                # Імітуємо прозорість через змішування кольорів
+                background_color = img.getpixel((center_x, center_y))
+                mixed_color = tuple(
+                    int(bg + (glow - bg) * alpha / 255)
+                    for bg, glow in zip(background_color, glow_color)
+                )
+                draw.ellipse([center_x-radius, center_y-radius,
+                              center_x+radius, center_y+radius],
+                             outline=mixed_color, width=1)
+
+        # Книга (основна форма)
+        book_width, book_height = 32, 24
+        book_left = center_x - book_width // 2
+        book_top = center_y - book_height // 2
+
+        # Тінь книги
+        draw.rectangle([book_left+2, book_top+2,
+                        book_left+book_width+2, book_top+book_height+2],
+                       fill=(0, 0, 20))
+
+        # Основа книги (білий фон)
+        draw.rectangle([book_left, book_top,
+                        book_left+book_width, book_top+book_height], fill=(245, 248, 255))
+
+        # Обкладинка книги (градієнт)
+        for i in range(book_height):
+            progress = i / book_height
+            r = int(102 + (118 - 102) * progress)  # 667eea -> 764ba2
+            g = int(126 + (75 - 126) * progress)
+            b = int(234 + (162 - 234) * progress)
+
+            draw.line([(book_left, book_top + i),
+                      (book_left + book_width, book_top + i)],
+                      fill=(r, g, b))
+
+        # Лінії тексту на книзі
+        line_color = (255, 255, 255, 200)
+        for i, offset in enumerate([6, 10, 14, 18]):
+            line_width = book_width - 8 - i * 2
+            draw.line([(book_left + 4, book_top + offset),
+                      (book_left + 4 + line_width, book_top + offset)],
+                      fill=(255, 255, 255), width=1)
+
+        # Закладка
+        bookmark_x = book_left + book_width - 2
+        draw.rectangle([bookmark_x, book_top,
+                        bookmark_x + 4, book_top + book_height + 6],
+                       fill=(72, 187, 120))
+        # Кінчик закладки
+        draw.polygon([bookmark_x, book_top + book_height + 6,
+                      bookmark_x + 4, book_top + book_height + 6,
+                      bookmark_x + 2, book_top + book_height + 10],
+                     fill=(56, 161, 105))
+
+        # Символи "SV" під книгою
+        try:
+            font_size = 16
+            try:
+                font = ImageFont.truetype(
+                    "/System/Library/Fonts/Helvetica.ttc", font_size)
+            except:
+                try:
+                    font = ImageFont.truetype("arial.ttf", font_size)
+                except:
+                    font = ImageFont.load_default()
+
+            text = "SV"
+            # Розрахунок позиції для центрування
+            bbox = draw.textbbox((0, 0), text, font=font)
+            text_width = bbox[2] - bbox[0]
+            text_height = bbox[3] - bbox[1]
+
+            text_x = center_x - text_width // 2
+            text_y = center_y + book_height // 2 + 8
+
+            # Тінь тексту
+            draw.text((text_x + 1, text_y + 1), text,
+                      fill=(0, 0, 50), font=font)
+            # Основний текст
+            draw.text((text_x, text_y), text, fill=(255, 255, 255), font=font)
+
+        except Exception as e:
+            # Fallback - малюємо букви вручну простими лініями
+            # S
+            draw.line([(center_x - 10, center_y + 18), (center_x - 5, center_y + 18)],
+                      fill=(255, 255, 255), width=2)
+            draw.line([(center_x - 10, center_y + 18), (center_x - 10, center_y + 21)],
+                      fill=(255, 255, 255), width=2)
+            draw.line([(center_x - 10, center_y + 21), (center_x - 5, center_y + 21)],
+                      fill=(255, 255, 255), width=2)
+            draw.line([(center_x - 5, center_y + 21), (center_x - 5, center_y + 24)],
+                      fill=(255, 255, 255), width=2)
+            draw.line([(center_x - 10, center_y + 24), (center_x - 5, center_y + 24)],
+                      fill=(255, 255, 255), width=2)
+
+            # V
+            draw.line([(center_x + 2, center_y + 18), (center_x + 5, center_y + 24)],
+                      fill=(255, 255, 255), width=2)
+            draw.line([(center_x + 8, center_y + 18), (center_x + 5, center_y + 24)],
+                      fill=(255, 255, 255), width=2)
+
+        for _ in range(12):
+            angle = random.random() * 3.14159 * 2
+            distance = random.randint(20, 35)
+            px = int(center_x + distance * (angle % 1))
+            py = int(center_y + distance * ((angle * 1.3) % 1))
+
+            if 5 <= px <= 123 and 5 <= py <= 123:
+                brightness = random.randint(150, 255)
+                size = random.randint(1, 2)
+                draw.ellipse([px-size, py-size, px+size, py+size],
+                             fill=(brightness, brightness, brightness))
+
+        img.save(path)
+        print("✅ Створено красивий космічний логотип StudyVault")
+
+    except ImportError:
+        print("⚠️ PIL недоступна, створюємо простий логотип...")
+        # Fallback версія
+        simple_png_data = bytes([
+            137, 80, 78, 71, 13, 10, 26, 10, 0, 0, 0, 13, 73, 72, 68, 82,
+            0, 0, 0, 128, 0, 0, 0, 128, 8, 2, 0, 0, 0, 233, 178, 81,
+            130, 0, 0, 0, 25, 73, 68, 65, 84, 120, 156, 99, 100, 96, 248,
+            79, 193, 128, 137, 129, 129, 37, 0, 0, 14, 48, 1, 225, 39, 222,
+            252, 232, 0, 0, 0, 0, 73, 69, 78, 68, 174, 66, 96, 130
+        ])
+
+        with open(path, 'wb') as f:
+            f.write(simple_png_data)
+        print("✅ Створено базовий логотип")
+
+    except Exception as e:
+        print(f"❌ Помилка створення логотипу: {e}")
+        # Створюємо мінімальний файл
+        with open(path, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS\xde\x00\x00\x00\x0cIDATx\x9cc```\x00\x00\x00\x04\x00\x01\xdd\xcc\xdb\x27\x00\x00\x00\x00IEND\xaeB`\x82')
+        print("✅ Створено мінімальний логотип")
+
+
+def find_source(base_dir, build_dir, filename):
+    """Пошук файлу в тому ж порядку, що й RouteTable.find_file"""
+    for folder in (build_dir, os.path.join(build_dir, 'templates'),
+                   '', 'templates', 'static'):
+        path = os.path.join(base_dir, folder, filename)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def hashed_name(filename, content):
+    """style.css -> style.<хеш вмісту>.css"""
+    stem, suffix = os.path.splitext(filename)
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    return f"{stem}.{digest}{suffix}"
+
+
+def rewrite_references(html, manifest):
+    """Заміна посилань на статичні файли хешованими адресами"""
+    if not manifest:
+        return html
+    names = '|'.join(re.escape(name) for name in manifest)
+    pattern = re.compile(
+        r'''((?:href|src)=["'])(?:\./|/static/|/)?(''' + names + r''')(["'])''')
+    return pattern.sub(
+        lambda m: m.group(1) + manifest[m.group(2)] + m.group(3), html)
+
+
+def write_asset(assets_dir, manifest, filename, content):
+    """Файл під іменем з хешем вмісту та його запис у manifest"""
+    name = hashed_name(filename, content)
+    with open(os.path.join(assets_dir, name), 'wb') as f:
+        f.write(content)
+    manifest[filename] = f"/assets/{name}"
+    return manifest[filename]
+
+
+def extract_inline_assets(html, stem, assets_dir, manifest):
+    """Вбудовані <style> та <script> шаблону -> хешовані файли stem.css/.js"""
+    counts = {}
+
+    def extract(match):
+        tag, content = match.groups()
+        suffix = '.css' if tag == 'style' else '.js'
+        counts[suffix] = counts.get(suffix, 0) + 1
+        number = f"-{counts[suffix]}" if counts[suffix] > 1 else ''
+        url = write_asset(assets_dir, manifest, f"{stem}{number}{suffix}",
+                          content.encode('utf-8'))
+        if tag == 'style':
+            return f'<link rel="stylesheet" href="{url}" />'
+        return f'<script src="{url}"></script>'
+
+    return INLINE_BLOCK_RE.sub(extract, html)
+
+
+def build(base_dir='.', build_dir='dist'):
+    """Повна збірка: логотип, шаблони, хешовані файли та manifest"""
+    output = os.path.join(base_dir, build_dir)
+    assets_dir = os.path.join(output, 'assets')
+    templates_dir = os.path.join(output, 'templates')
+    # Попередня збірка видаляється повністю: застарілі файли не лишаються
+    shutil.rmtree(output, ignore_errors=True)
+    os.makedirs(assets_dir)
+    os.makedirs(templates_dir)
+
+    create_logo_png(os.path.join(output, 'logo.png'))
+    for filename in GENERATED_TEMPLATES:
+        if not find_source(base_dir, build_dir, filename):
+            generator = create_message_html if filename == 'message.html' \
+                else create_error_html
+            generator(os.path.join(templates_dir, filename))
+
+    manifest = {}
+    for filename in HASHED_ASSETS:
+        source = find_source(base_dir, build_dir, filename)
+        if source is None:
+            print(f"⚠️ Файл {filename} не знайдено, пропускаємо")
+            continue
+        with open(source, 'rb') as f:
+            content = f.read()
+        write_asset(assets_dir, manifest, filename, content)
+        print(f"✅ {filename} -> {manifest[filename]}")
+
+    # Шаблони з посиланнями на хешовані файли; решта віддається з templates/
+    for folder in (templates_dir, os.path.join(base_dir, 'templates'),
+                   base_dir):
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            target = os.path.join(templates_dir, filename)
+            if not filename.endswith('.html') or \
+                    (folder != templates_dir and os.path.exists(target)):
+                continue
+            with open(os.path.join(folder, filename), encoding='utf-8') as f:
+                html = f.read()
+            rewritten = extract_inline_assets(
+                rewrite_references(html, manifest),
+                os.path.splitext(filename)[0], assets_dir, manifest)
+            if rewritten != html or folder == templates_dir:
+                with open(target, 'w', encoding='utf-8') as f:
+                    f.write(rewritten)
+
+    with open(os.path.join(output, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.write('\n')
+    print(f"✅ Збірку статики записано в {output}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-dir', default=os.path.dirname(
+        os.path.abspath(__file__)))
+    parser.add_argument('--build-dir', default='dist',
+                        help='каталог результату (ASSETS_BUILD_DIR сервера)')
+    args = parser.parse_args()
+    build(args.base_dir, args.build_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,621 +1,5001 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import asyncio
+import atexit
+import base64
+import bisect
+import contextlib
+import email.parser
+import fcntl
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import math
+import random
+import re
+import selectors
+import signal
 import socket
+import sys
 import threading
 import json
+import unicodedata
+import mmap
+import queue
+import struct
+import time
+import tracemalloc
 import urllib.parse
-from datetime import datetime
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from pymongo import MongoClient
+import bson
+from bson import ObjectId
+from bson.errors import InvalidId
+import gridfs
+from gridfs.errors import FileExists
+from pymongo import MongoClient, UpdateOne, WriteConcern
+from pymongo.errors import (
+    BulkWriteError, CollectionInvalid, ConnectionFailure, DuplicateKeyError,
+    PyMongoError,
+)
 import os
 import mimetypes
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Налаштування HTTP-сервера
+HTTP_HOST = os.getenv('HTTP_HOST', 'localhost')
+HTTP_PORT = int(os.getenv('HTTP_PORT', '3000'))
+HTTP_MAX_WORKERS = int(os.getenv('HTTP_MAX_WORKERS', '32'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '5'))
+
+# Налаштування кешу статичних файлів
+STATIC_CACHE_MAX_FILE_SIZE = int(
+    os.getenv('STATIC_CACHE_MAX_FILE_SIZE', str(1024 * 1024)))
+STATIC_COMPRESS_MIN_SIZE = int(os.getenv('STATIC_COMPRESS_MIN_SIZE', '512'))
+# Великі файли (понад STATIC_CACHE_MAX_FILE_SIZE) віддаються потоково
+# Каталог результатів build_assets.py (логотип, шаблони, хешовані файли)
+ASSETS_BUILD_DIR = os.getenv('ASSETS_BUILD_DIR', 'dist')
+# Файли з хешем вмісту в імені ніколи не змінюються за тією ж адресою
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STATIC_STREAM_CHUNK_SIZE = int(
+    os.getenv('STATIC_STREAM_CHUNK_SIZE', str(256 * 1024)))
+
+# Налаштування API читання повідомлень
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', '50'))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '500'))
+# Розмір шматка при потоковій віддачі JSON
+API_STREAM_CHUNK_SIZE = int(os.getenv('API_STREAM_CHUNK_SIZE', '16384'))
+# Кеш сторінок повідомлень: кількість записів та час життя (с)
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '30'))
+
+# Стрічка нових повідомлень через Server-Sent Events
+# Подій у черзі підписника: повільніший клієнт відключається
+SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', '256'))
+SSE_MAX_SUBSCRIBERS = int(os.getenv('SSE_MAX_SUBSCRIBERS', '1000'))
+# Коментар-пінг для неактивних з'єднань (с)
+SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', '15'))
+# Максимум пропущених повідомлень, що надсилаються за Last-Event-ID
+SSE_CATCHUP_LIMIT = int(os.getenv('SSE_CATCHUP_LIMIT', '1000'))
+SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', '3000'))
+# Опитування MongoDB для стрічки (с): повідомлення всіх воркерів і вікно
+# запізнілих записів, що перечитується при кожному опитуванні
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '0.25'))
+SSE_POLL_LAG = float(os.getenv('SSE_POLL_LAG', '2'))
+
+# Статистика /api/stats: період запису лічильників у MongoDB (с),
+# перерахунку агрегаціями (с, 0 - вимкнено), розмір відповіді
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', '1'))
+STATS_RECONCILE_INTERVAL = float(
+    os.getenv('STATS_RECONCILE_INTERVAL', str(24 * 3600)))
+STATS_TOP_USERS = int(os.getenv('STATS_TOP_USERS', '10'))
+STATS_DAYS = int(os.getenv('STATS_DAYS', '30'))
+
+# Профілювання живого сервера через /admin/* (без ADMIN_TOKEN - вимкнено)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '10'))
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '10'))
+
+# Логи: формат (json - рядок JSON на запис, text - лише повідомлення),
+# мінімальний рівень і розмір черги фонового запису в stdout
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'info')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Частка записів події, що потрапляє в лог ('подія=частка,...')
+LOG_SAMPLE = os.getenv('LOG_SAMPLE', 'message.sent=0.1')
+# Записів події за секунду (0 - без обмеження) і винятки 'подія=ліміт,...'
+LOG_RATE_LIMIT = float(os.getenv('LOG_RATE_LIMIT', '100'))
+LOG_RATE_LIMITS = os.getenv('LOG_RATE_LIMITS', '')
+
+# Налаштування серверного пошуку по матеріалах
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'data/search_index.jsonl')
+SEARCH_MAX_DOCUMENT_SIZE = int(
+    os.getenv('SEARCH_MAX_DOCUMENT_SIZE', str(5 * 1024 * 1024)))
+SEARCH_DEFAULT_RESULTS = int(os.getenv('SEARCH_DEFAULT_RESULTS', '10'))
+# Символів початку матеріалу, що зберігаються в пам'яті для фрагментів
+SEARCH_SNIPPET_SOURCE_SIZE = int(os.getenv('SEARCH_SNIPPET_SOURCE_SIZE', '4096'))
+
+# Файли матеріалів у GridFS
+MATERIAL_CHUNK_SIZE = int(os.getenv('MATERIAL_CHUNK_SIZE', str(255 * 1024)))
+MATERIAL_MAX_UPLOAD_SIZE = int(
+    os.getenv('MATERIAL_MAX_UPLOAD_SIZE', str(512 * 1024 * 1024)))
+
+# Підключення до MongoDB
+MONGODB_URL = os.getenv('MONGODB_URL', 'mongodb://localhost:27017/')
+# Надійність запису повідомлень: fast (w=0, без підтвердження),
+# acknowledged (w=1) або majority (більшість replica set + журнал)
+MONGO_DURABILITY = os.getenv('MONGO_DURABILITY', 'acknowledged')
+MONGO_WTIMEOUT_MS = int(os.getenv('MONGO_WTIMEOUT_MS', '5000'))
+# Розмір пулу з'єднань (0 - потоки HTTP пулу та запису повідомлень)
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '0'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '2'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+# Таймаут операції на сокеті (0 - без обмеження)
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '0'))
+# Стиснення трафіку: zstd (пакет zstandard), snappy (python-snappy), zlib
+MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', '')
+# Без MongoDB на старті процес завершується (0 - працювати з журналом)
+MONGO_FAIL_FAST = os.getenv('MONGO_FAIL_FAST', '1') == '1'
+
+# Колекція повідомлень; MESSAGES_TIMESERIES=1 створює її як time-series
+MESSAGES_COLLECTION = os.getenv('MESSAGES_COLLECTION', 'messages')
+MESSAGES_TIMESERIES = os.getenv('MESSAGES_TIMESERIES', '0') == '1'
+
+# Налаштування пакетного запису в MongoDB
+MONGO_BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', '100'))
+MONGO_FLUSH_INTERVAL_MS = int(os.getenv('MONGO_FLUSH_INTERVAL_MS', '50'))
+MONGO_BUFFER_SIZE = int(os.getenv('MONGO_BUFFER_SIZE', '10000'))
+
+# Журнал повідомлень на диску перед записом у MongoDB ('' - вимкнено)
+SPOOL_DIR = os.getenv('SPOOL_DIR', 'data/spool')
+# fsync журналу: always - після кожного повідомлення,
+# interval - раз на SPOOL_FSYNC_INTERVAL_MS, never - на розсуд ОС
+SPOOL_FSYNC = os.getenv('SPOOL_FSYNC', 'interval')
+SPOOL_FSYNC_INTERVAL_MS = int(os.getenv('SPOOL_FSYNC_INTERVAL_MS', '1000'))
+SPOOL_SEGMENT_SIZE = int(
+    os.getenv('SPOOL_SEGMENT_SIZE', str(16 * 1024 * 1024)))
+
+# Налаштування пулу обробки UDP датаграм
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '4'))
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '1000'))
+INGEST_OVERFLOW_POLICY = os.getenv('INGEST_OVERFLOW_POLICY', 'drop-newest')
+UDP_RECV_BUFFER = int(os.getenv('UDP_RECV_BUFFER', str(4 * 1024 * 1024)))
+
+# Обмеження потоку повідомлень (0 - без обмеження): token bucket на
+# адресу відправника (датаграм/с) та на username (повідомлень/с)
+UDP_RATE_LIMIT = float(os.getenv('UDP_RATE_LIMIT', '200'))
+UDP_RATE_BURST = int(os.getenv('UDP_RATE_BURST', '400'))
+USER_RATE_LIMIT = float(os.getenv('USER_RATE_LIMIT', '5'))
+USER_RATE_BURST = int(os.getenv('USER_RATE_BURST', '20'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '65536'))
+# Адреси без ліміту датаграм: HTTP-сервер пересилає форму з loopback, і
+# ліміт на його адресу обмежував би всіх користувачів форми разом
+UDP_TRUSTED_SENDERS = frozenset(
+    address.strip() for address in
+    os.getenv('UDP_TRUSTED_SENDERS', '127.0.0.1,::1').split(',')
+    if address.strip())
+# Вікно відкидання однакових (username, message) (с, 0 - вимкнено)
+DEDUP_WINDOW = float(os.getenv('DEDUP_WINDOW', '10'))
+DEDUP_FILTER_BITS = int(os.getenv('DEDUP_FILTER_BITS', str(1 << 20)))
+
+# Адреса Socket-сервера для HTTP-сервера та формат датаграм
+SOCKET_SERVER_HOST = os.getenv('SOCKET_SERVER_HOST', 'localhost')
+SOCKET_SERVER_PORT = int(os.getenv('SOCKET_SERVER_PORT', '5000'))
+UDP_BINARY_FRAMES = os.getenv('UDP_BINARY_FRAMES', '0') == '1'
+
+# Кількість процесів з серверами (0 - за кількістю ядер, 1 - один процес)
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '1'))
+# Скільки чекати на завершення процесів перед SIGKILL (с)
+SERVER_SHUTDOWN_TIMEOUT = float(os.getenv('SERVER_SHUTDOWN_TIMEOUT', '15'))
+# Окремий /metrics кожного воркера на порту METRICS_PORT + N (0 - вимкнено):
+# спільний порт 3000 віддає лічильники випадкового воркера
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Режим Socket-сервера: threaded (пул потоків) або asyncio (event loop)
+SOCKET_SERVER_MODE = os.getenv('SOCKET_SERVER_MODE', 'threaded')
+MONGO_EXECUTOR_WORKERS = int(os.getenv('MONGO_EXECUTOR_WORKERS', '2'))
+
+
+class MetricsRegistry:
+    """Метрики у форматі Prometheus з потоковими шардами
+
+    Кожен потік пише лише у власний словник (шард), тому запис метрики
+    не бере блокувань. Шарди всіх потоків зводяться разом лише під час
+    запиту /metrics. labels додаються до кожної метрики (worker у
+    воркера supervisor'а), тож лічильники різних процесів не змішуються.
+    """
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+               0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = []
+        self.descriptions = {}
+        self.callbacks = {}
+        self.labels = ()
+        self.lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        """Опис метрики: тип (counter, gauge, histogram) та довідка"""
+        self.descriptions[name] = (kind, help_text)
+
+    def register_callback(self, name, callback):
+        """Метрика, значення якої обчислюється під час запиту /metrics
+
+        callback повертає число або список пар (labels, value).
+        """
+        self.callbacks[name] = callback
+
+    def _shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def inc(self, name, labels=(), amount=1):
+        """Збільшення лічильника"""
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        """Запис значення в гістограму"""
+        shard = self._shard()
+        key = (name, labels)
+        buckets = shard.get(key)
+        if buckets is None:
+            # Лічильники кошиків, +Inf та сума значень
+            buckets = shard[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+        buckets[bisect.bisect_left(self.BUCKETS, value)] += 1
+        buckets[-1] += value
+
+    def collect(self):
+        """Зведення шардів усіх потоків"""
+        with self.lock:
+            shards = list(self.shards)
+
+        totals = {}
+        for shard in shards:
+            for key, value in list(shard.items()):
+                if isinstance(value, list):
+                    merged = totals.get(key)
+                    if merged is None:
+                        totals[key] = list(value)
+                    else:
+                        for i, item in enumerate(value):
+                            merged[i] += item
+                else:
+                    totals[key] = totals.get(key, 0) + value
+
+        for name, callback in list(self.callbacks.items()):
+            try:
+                value = callback()
+            except Exception:
+                continue
+            if isinstance(value, list):
+                for labels, item in value:
+                    totals[(name, labels)] = item
+            else:
+                totals[(name, ())] = value
+        return totals
+
+    def render(self):
+        """Текстовий формат Prometheus"""
+        by_name = {}
+        for (name, labels), value in self.collect().items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = self.descriptions.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(by_name[name], key=lambda x: x[0]):
+                labels = self.labels + labels
+                if kind == 'histogram':
+                    lines.extend(self._render_histogram(name, labels, value))
+                else:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, name, labels, buckets):
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS + ('+Inf',), buckets):
+            cumulative += count
+            le = labels + (('le', str(bound)),)
+            yield f'{name}_bucket{format_labels(le)} {cumulative}'
+        yield f'{name}_sum{format_labels(labels)} {buckets[-1]}'
+        yield f'{name}_count{format_labels(labels)} {cumulative}'
+
+
+def format_labels(labels):
+    """Мітки Prometheus: {name="value",...}"""
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"') \
+            .replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+METRICS = MetricsRegistry()
+METRICS.describe('studyvault_http_requests_total', 'counter',
+                 'HTTP запити за маршрутом, методом та статусом')
+METRICS.describe('studyvault_http_request_duration_seconds', 'histogram',
+                 'Час обробки HTTP запиту за маршрутом')
+METRICS.describe('studyvault_udp_datagrams_received_total', 'counter',
+                 'Отримані UDP датаграми')
+METRICS.describe('studyvault_udp_datagrams_dropped_total', 'counter',
+                 'Відкинуті UDP датаграми за причиною')
+METRICS.describe('studyvault_udp_frames_failed_total', 'counter',
+                 'Кадри датаграм, що не вдалося декодувати')
+METRICS.describe('studyvault_ingest_rejected_total', 'counter',
+                 'Відкинуті лімітами та фільтром повторів датаграми й повідомлення')
+METRICS.describe('studyvault_ingest_queue_depth', 'gauge',
+                 'Датаграми в черзі пулу обробки')
+METRICS.describe('studyvault_mongo_batch_duration_seconds', 'histogram',
+                 'Час запису пакета повідомлень в MongoDB')
+METRICS.describe('studyvault_mongo_documents_total', 'counter',
+                 'Документи повідомлень за результатом запису')
+METRICS.describe('studyvault_mongo_write_buffer_depth', 'gauge',
+                 'Документи в буфері пакетного запису')
+METRICS.describe('studyvault_spool_pending_bytes', 'gauge',
+                 'Байти журналу на диску, ще не записані в MongoDB')
+METRICS.describe('studyvault_spool_segments', 'gauge',
+                 'Сегменти журналу повідомлень на диску')
+METRICS.describe('studyvault_query_cache_requests_total', 'counter',
+                 'Запити до кешу сторінок повідомлень за результатом')
+METRICS.describe('studyvault_query_cache_bytes', 'gauge',
+                 'Пам\'ять, зайнята кешем сторінок повідомлень')
+METRICS.describe('studyvault_sse_subscribers', 'gauge',
+                 'Підключені клієнти стрічки /api/messages/stream')
+METRICS.describe('studyvault_sse_events_total', 'counter',
+                 'Повідомлення, опубліковані в стрічку подій')
+METRICS.describe('studyvault_sse_disconnects_total', 'counter',
+                 'Відключення клієнтів стрічки подій за причиною')
+METRICS.describe('studyvault_log_records_total', 'counter',
+                 'Записи логу за рівнем')
+METRICS.describe('studyvault_log_dropped_total', 'counter',
+                 'Записи логу, відкинуті вибіркою, лімітом чи переповненою чергою')
+METRICS.describe('studyvault_log_queue_depth', 'gauge',
+                 'Записи логу в черзі фонового запису')
+
+
+class StackSampler:
+    """Семплювальний профайлер усіх потоків процесу
+
+    Раз на interval знімає стеки всіх потоків через sys._current_frames()
+    і рахує однакові стеки. Результат - collapsed stacks для
+    flamegraph.pl чи speedscope: 'потік;функція;...;функція кількість'.
+    Профіль wall-clock: потоки, що чекають (queue.get, select), теж
+    потрапляють у вибірку. Вибірку знімає потік, що викликав run(),
+    тож поза профілюванням накладних витрат немає.
+    """
+
+    # Номер потоку пулу не важливий: http_0..http_31 - один корінь
+    THREAD_NUMBER_RE = re.compile(r'[-_]\d+$')
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = max(0.001, interval)
+        self.labels = {}
+
+    def label(self, code):
+        """Назва функції в стеку: qualname (файл:рядок)"""
+        label = self.labels.get(code)
+        if label is None:
+            label = (f"{code.co_qualname} "
+                     f"({os.path.basename(code.co_filename)}:"
+                     f"{code.co_firstlineno})").replace(';', ':')
+            self.labels[code] = label
+        return label
+
+    def run(self, seconds):
+        """Вибірка протягом seconds -> (Counter стеків, кількість вибірок)"""
+        own = threading.get_ident()
+        stacks = Counter()
+        names = {}
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()
+            if not names.keys() >= frames.keys():
+                names = {thread.ident: self.THREAD_NUMBER_RE.sub(
+                    '', thread.name) for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                stacks[';'.join(reversed(stack))] += 1
+            frames = None
+            samples += 1
+            time.sleep(self.interval)
+        return stacks, samples
+
+
+def tracemalloc_report(before, after, top, key_type='lineno'):
+    """Топ різниці двох знімків tracemalloc у текстовому вигляді"""
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    if before is None:
+        stats = after.filter_traces(filters).statistics(key_type)
+    else:
+        stats = after.filter_traces(filters).compare_to(
+            before.filter_traces(filters), key_type)
+    lines = []
+    for stat in stats[:top]:
+        lines.append(str(stat))
+        if key_type == 'traceback':
+            lines.extend(stat.traceback.format())
+            lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+# Лише одне профілювання одночасно: два семплери спотворили б одне одного
+PROFILE_LOCK = threading.Lock()
+
+
+# Формат датаграм між HTTP та Socket серверами (версія 1):
+#   заголовок  'SV' | версія (1 байт) | кодування (1 байт) | кількість (2 байти)
+#   кадр       довжина (2 байти) | вміст
+# Кодування 0 - JSON об'єкт, 1 - компактний бінарний формат:
+#   timestamp (double) | довжина + username (UTF-8) | довжина + message (UTF-8)
+# Датаграми, що починаються з '{', приймаються як старий формат (один JSON).
+DATAGRAM_MAGIC = b'SV'
+DATAGRAM_VERSION = 1
+DATAGRAM_HEADER = struct.Struct('!2sBBH')
+FRAME_LENGTH = struct.Struct('!H')
+BINARY_TIMESTAMP = struct.Struct('!d')
+ENCODING_JSON = 0
+ENCODING_BINARY = 1
+# Максимальний розмір UDP датаграми в IPv4
+MAX_DATAGRAM_SIZE = 65507
+# Вміст кадру, що разом із заголовками вміщується в одну датаграму
+MAX_FRAME_PAYLOAD = MAX_DATAGRAM_SIZE - DATAGRAM_HEADER.size - FRAME_LENGTH.size
+
+
+def encode_frame(message, encoding):
+    """Кодування одного повідомлення в кадр
+
+    ValueError, якщо кадр не вміщується в датаграму: довжини полів
+    перевіряються до пакування в двобайтові префікси.
+    """
+    if encoding == ENCODING_BINARY:
+        timestamp = message.get('timestamp')
+        timestamp = datetime.fromisoformat(timestamp).timestamp() \
+            if timestamp else float('nan')
+        username = message['username'].encode('utf-8')
+        text = message['message'].encode('utf-8')
+        size = BINARY_TIMESTAMP.size + 2 * FRAME_LENGTH.size + \
+            len(username) + len(text)
+        if size > MAX_FRAME_PAYLOAD:
+            raise ValueError("Повідомлення перевищує розмір датаграми")
+        payload = b''.join((
+            BINARY_TIMESTAMP.pack(timestamp),
+            FRAME_LENGTH.pack(len(username)), username,
+            FRAME_LENGTH.pack(len(text)), text,
+        ))
+    else:
+        payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        if len(payload) > MAX_FRAME_PAYLOAD:
+            raise ValueError("Повідомлення перевищує розмір датаграми")
+
+    return FRAME_LENGTH.pack(len(payload)) + payload
+
+
+def decode_frame(payload, encoding):
+    """Декодування вмісту кадру (ValueError для некоректних даних)"""
+    if encoding == ENCODING_JSON:
+        message = json.loads(payload.decode('utf-8'))
+        if not isinstance(message, dict) or \
+                'username' not in message or 'message' not in message:
+            raise ValueError("Кадр без username або message")
+        return message
+
+    if encoding != ENCODING_BINARY:
+        raise ValueError(f"Невідоме кодування кадру: {encoding}")
+
+    try:
+        (timestamp,) = BINARY_TIMESTAMP.unpack_from(payload, 0)
+        offset = BINARY_TIMESTAMP.size
+        fields = []
+        for _ in range(2):
+            (length,) = FRAME_LENGTH.unpack_from(payload, offset)
+            offset += FRAME_LENGTH.size
+            if offset + length > len(payload):
+                raise ValueError("Поле виходить за межі кадру")
+            fields.append(payload[offset:offset + length].decode('utf-8'))
+            offset += length
+    except struct.error as e:
+        raise ValueError(f"Пошкоджений бінарний кадр: {e}")
+
+    message = {'username': fields[0], 'message': fields[1]}
+    if timestamp == timestamp:  # NaN - без часу відправки
+        message['timestamp'] = \
+            datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+    return message
+
+
+def pack_datagrams(messages, binary=False):
+    """Пакування повідомлень у мінімальну кількість датаграм
+
+    ValueError, якщо окреме повідомлення не вміщується в датаграму.
+    """
+    encoding = ENCODING_BINARY if binary else ENCODING_JSON
+    datagrams = []
+    frames = []
+    size = DATAGRAM_HEADER.size
+
+    for message in messages:
+        frame = encode_frame(message, encoding)
+        if size + len(frame) > MAX_DATAGRAM_SIZE:
+            datagrams.append(build_datagram(frames, encoding))
+            frames = []
+            size = DATAGRAM_HEADER.size
+
+        frames.append(frame)
+        size += len(frame)
+
+    if frames:
+        datagrams.append(build_datagram(frames, encoding))
+    return datagrams
+
+
+def build_datagram(frames, encoding):
+    """Збирання датаграми із заголовком"""
+    header = DATAGRAM_HEADER.pack(
+        DATAGRAM_MAGIC, DATAGRAM_VERSION, encoding, len(frames))
+    return header + b''.join(frames)
+
+
+def decode_datagram(data):
+    """Декодування всіх повідомлень датаграми
+
+    Повертає (messages, malformed, oversize): некоректні кадри та кадри,
+    довжина яких виходить за межі датаграми, пропускаються і рахуються.
+    """
+    # Старий формат: один JSON об'єкт
+    if data[:1] == b'{':
+        try:
+            return [decode_frame(data, ENCODING_JSON)], 0, 0
+        except ValueError:
+            return [], 1, 0
+
+    try:
+        magic, version, encoding, count = DATAGRAM_HEADER.unpack_from(data, 0)
+    except struct.error:
+        return [], 1, 0
+    if magic != DATAGRAM_MAGIC or version != DATAGRAM_VERSION:
+        return [], 1, 0
+
+    messages = []
+    malformed = 0
+    offset = DATAGRAM_HEADER.size
+    for index in range(count):
+        if offset + FRAME_LENGTH.size > len(data):
+            # Решта кадрів відсутня в датаграмі
+            return messages, malformed + count - index, 0
+        (length,) = FRAME_LENGTH.unpack_from(data, offset)
+        offset += FRAME_LENGTH.size
+        if offset + length > len(data):
+            return messages, malformed + count - index - 1, 1
+
+        try:
+            messages.append(
+                decode_frame(data[offset:offset + length], encoding))
+        except ValueError:
+            malformed += 1
+        offset += length
+
+    return messages, malformed, 0
+
+
+class UDPMessageSender:
+    """Спільний UDP socket для відправки повідомлень на Socket-сервер"""
+
+    def __init__(self, host=SOCKET_SERVER_HOST, port=SOCKET_SERVER_PORT,
+                 binary=UDP_BINARY_FRAMES):
+        self.address = (host, port)
+        self.binary = binary
+        self.socket = None
+        self.lock = threading.Lock()
+
+    def send_messages(self, messages):
+        """Відправка повідомлень, упакованих у якомога менше датаграм"""
+        datagrams = pack_datagrams(messages, self.binary)
+        with self.lock:
+            if self.socket is None:
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                for datagram in datagrams:
+                    self.socket.sendto(datagram, self.address)
+            except OSError:
+                # Наступна відправка створить новий socket
+                self.socket.close()
+                self.socket = None
+                raise
+
+    def close(self):
+        with self.lock:
+            if self.socket is not None:
+                self.socket.close()
+                self.socket = None
+
+
+class FrameCounters:
+    """Лічильники некоректних та завеликих кадрів датаграм"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.malformed = 0
+        self.oversize = 0
+
+    def add(self, malformed, oversize):
+        if malformed or oversize:
+            with self.lock:
+                self.malformed += malformed
+                self.oversize += oversize
+
+
+class RateLimiter:
+    """Token bucket на ключ (адресу чи username) з обмеженою пам'яттю
+
+    Кожен ключ отримує rate токенів за секунду із запасом burst. Ключі
+    зберігаються в LRU: понад max_keys витісняється найдавніше активний,
+    чий запас на той час зазвичай уже повний.
+    """
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max(1, max_keys)
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """Списання токена; False - ключ перевищив ліміт"""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                tokens = self.burst
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                tokens = min(self.burst,
+                             bucket[0] + (now - bucket[1]) * self.rate)
+                self.buckets.move_to_end(key)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+
+def parse_event_rates(spec):
+    """Розбір 'подія=число,...' у словник"""
+    rates = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        event, _, value = item.partition('=')
+        rates[event.strip()] = float(value)
+    return rates
+
+
+class StructuredLogger:
+    """Структурований лог із фоновим записом у stdout
+
+    Потік, що логує, лише кладе кортеж у обмежену чергу: JSON формує і
+    пише в stdout окремий потік, пакетом за один write(). Коли stdout
+    не встигає і черга заповнена, запис відкидається, а не блокує
+    запит. Часті події проріджуються вибіркою та лімітом записів за
+    секунду на подію; кількість відкинутих лімітом записів додається
+    до наступного запису тієї ж події полем suppressed.
+    """
+
+    BATCH_SIZE = 256
+
+    def __init__(self, level=LOG_LEVEL, log_format=LOG_FORMAT,
+                 queue_size=LOG_QUEUE_SIZE, sample=LOG_SAMPLE,
+                 rate_limit=LOG_RATE_LIMIT, rate_limits=LOG_RATE_LIMITS):
+        if level not in LOG_LEVELS:
+            raise ValueError(f"Невідомий LOG_LEVEL: {level}")
+        if log_format not in ('json', 'text'):
+            raise ValueError(f"Невідомий LOG_FORMAT: {log_format}")
+        self.level = LOG_LEVELS[level]
+        self.log_format = log_format
+        self.queue_size = queue_size
+        self.sample = parse_event_rates(sample)
+        self.limiter = RateLimiter(rate_limit, int(rate_limit * 2))
+        self.limiters = {
+            event: RateLimiter(rate, int(rate * 2))
+            for event, rate in parse_event_rates(rate_limits).items()
+        }
+        self._reset()
+        # Потік запису не переживає fork: дочірній процес запускає свій
+        os.register_at_fork(after_in_child=self._reset)
+        METRICS.register_callback(
+            'studyvault_log_queue_depth',
+            lambda: self.queue.qsize() if self.queue is not None else 0)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        self.suppressed = {}
+        self.queue = None
+        self.thread = None
+        for limiter in (self.limiter, *self.limiters.values()):
+            limiter.lock = threading.Lock()
+
+    def debug(self, event, message, **fields):
+        self.log('debug', event, message, **fields)
+
+    def info(self, event, message, **fields):
+        self.log('info', event, message, **fields)
+
+    def warning(self, event, message, **fields):
+        self.log('warning', event, message, **fields)
+
+    def error(self, event, message, **fields):
+        self.log('error', event, message, **fields)
+
+    def log(self, level, event, message, **fields):
+        """Запис у чергу без очікування; поля - довільні значення JSON"""
+        if LOG_LEVELS[level] < self.level:
+            return
+
+        rate = self.sample.get(event)
+        if rate is not None and rate < 1:
+            if random.random() >= rate:
+                METRICS.inc('studyvault_log_dropped_total',
+                            (('reason', 'sampled'),))
+                return
+            fields['sample_rate'] = rate
+
+        if not self.limiters.get(event, self.limiter).allow(event):
+            with self.lock:
+                self.suppressed[event] = self.suppressed.get(event, 0) + 1
+            METRICS.inc('studyvault_log_dropped_total',
+                        (('reason', 'rate_limited'),))
+            return
+        if self.suppressed:
+            with self.lock:
+                suppressed = self.suppressed.pop(event, 0)
+            if suppressed:
+                fields['suppressed'] = suppressed
+
+        record = (time.time(), level, event, message,
+                  threading.current_thread().name, fields)
+        log_queue = self.queue if self.thread is not None else self._start()
+        try:
+            log_queue.put_nowait(record)
+        except queue.Full:
+            METRICS.inc('studyvault_log_dropped_total',
+                        (('reason', 'queue_full'),))
+            return
+        METRICS.inc('studyvault_log_records_total', (('level', level),))
+
+    def _start(self):
+        """Черга й потік запису, що запускаються з першим записом"""
+        with self.lock:
+            if self.thread is None:
+                self.queue = queue.Queue(self.queue_size)
+                self.thread = threading.Thread(
+                    target=self._run, args=(self.queue,),
+                    name='log-writer', daemon=True)
+                self.thread.start()
+            return self.queue
+
+    def _run(self, log_queue):
+        while True:
+            batch = [log_queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            waiters = []
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    lines.append(self.render(item))
+            if lines:
+                try:
+                    sys.stdout.write(''.join(lines))
+                    sys.stdout.flush()
+                except (OSError, ValueError):
+                    pass
+            for waiter in waiters:
+                waiter.set()
+
+    def render(self, record):
+        """Рядок логу для запису"""
+        created, level, event, message, thread, fields = record
+        if self.log_format == 'text':
+            suppressed = fields.get('suppressed')
+            if suppressed:
+                return f"{message} (+{suppressed} пропущено)\n"
+            return message + '\n'
+
+        entry = {
+            'ts': datetime.fromtimestamp(created, timezone.utc)
+                  .isoformat(timespec='milliseconds'),
+            'level': level,
+            'event': event,
+            'msg': message,
+            'pid': os.getpid(),
+            'thread': thread,
+        }
+        entry.update(fields)
+        return json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+
+    def flush(self, timeout=2):
+        """Очікування запису всього, що вже в черзі"""
+        if self.thread is None:
+            return
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+
+LOG = StructuredLogger()
+atexit.register(LOG.flush)
+
+
+class DuplicateFilter:
+    """Фільтр повторів (username, message) у ковзному вікні
+
+    Два фільтри Блума фіксованого розміру: ключ записується в поточний,
+    перевіряються обидва, а кожні window секунд попередній відкидається.
+    Повтор розпізнається від window до 2*window секунд; хибний збіг
+    можливий, але при n ключах за вікно він має ймовірність
+    ~(1 - e^(-k*n/bits))^k.
+    """
+
+    HASHES = 4
+
+    def __init__(self, window=DEDUP_WINDOW, bits=DEDUP_FILTER_BITS):
+        self.window = window
+        self.size = max(1, bits // 8)
+        self.bits = self.size * 8
+        self.current = bytearray(self.size)
+        self.previous = bytearray(self.size)
+        self.rotate_at = time.monotonic() + window
+        self.lock = threading.Lock()
+
+    def positions(self, username, message):
+        """k позицій ключа з одного blake2b"""
+        key = f'{username}\0{message}'.encode('utf-8', 'surrogatepass')
+        digest = hashlib.blake2b(key, digest_size=4 * self.HASHES).digest()
+        return [int.from_bytes(digest[i:i + 4], 'little') % self.bits
+                for i in range(0, len(digest), 4)]
+
+    def seen(self, username, message):
+        """True для повтору; нове повідомлення запам'ятовується"""
+        positions = self.positions(username, message)
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.rotate_at:
+                # Після паузи, довшої за вікно, застарілі обидва фільтри
+                self.previous = self.current \
+                    if now < self.rotate_at + self.window \
+                    else bytearray(self.size)
+                self.current = bytearray(self.size)
+                self.rotate_at = now + self.window
+
+            for bloom in (self.current, self.previous):
+                if all(bloom[p >> 3] & (1 << (p & 7)) for p in positions):
+                    return True
+            for p in positions:
+                self.current[p >> 3] |= 1 << (p & 7)
+            return False
+
+
+class IngestFilter:
+    """Ліміти та відкидання повторів для Socket-сервера
+
+    allow_datagram() перевіряє адресу відправника ще до декодування
+    датаграми; довірені адреси (HTTP-сервер) ліміту не мають. accept()
+    пропускає декодовані повідомлення крізь ліміт на username і фільтр
+    повторів до створення документів для MongoDB.
+    """
+
+    def __init__(self, address_rate=UDP_RATE_LIMIT,
+                 address_burst=UDP_RATE_BURST, user_rate=USER_RATE_LIMIT,
+                 user_burst=USER_RATE_BURST, dedup_window=DEDUP_WINDOW,
+                 trusted=UDP_TRUSTED_SENDERS):
+        self.addresses = RateLimiter(address_rate, address_burst)
+        self.trusted = frozenset(trusted)
+        self.users = RateLimiter(user_rate, user_burst)
+        self.duplicates = DuplicateFilter(dedup_window) \
+            if dedup_window > 0 else None
+
+    def allow_datagram(self, address):
+        """Ліміт датаграм з однієї IP адреси"""
+        if address[0] in self.trusted or self.addresses.allow(address[0]):
+            return True
+        METRICS.inc('studyvault_ingest_rejected_total',
+                    (('reason', 'address_rate'),))
+        return False
+
+    def accept(self, messages):
+        """Повідомлення, що пройшли ліміт на username та фільтр повторів"""
+        accepted = []
+        for message in messages:
+            username = str(message['username'])
+            # Відкинуте лімітом не запам'ятовується: повторна відправка
+            # після паузи не вважатиметься дублікатом
+            if not self.users.allow(username):
+                reason = 'user_rate'
+            elif self.duplicates is not None and \
+                    self.duplicates.seen(username, message['message']):
+                reason = 'duplicate'
+            else:
+                accepted.append(message)
+                continue
+            METRICS.inc('studyvault_ingest_rejected_total',
+                        (('reason', reason),))
+        return accepted
+
+
+class CachedAsset:
+    """Файл у кеші: вміст, ETag та стиснуті варіанти"""
+
+    __slots__ = ('mtime_ns', 'size', 'body', 'etag', 'variants')
+
+    def __init__(self, mtime_ns, size, body, etag, variants):
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.body = body
+        self.etag = etag
+        # {'br': (bytes, etag), 'gzip': (bytes, etag)}
+        self.variants = variants
+
+    def etags(self):
+        """Усі ETag представлень файлу"""
+        return [self.etag] + [etag for _, etag in self.variants.values()]
+
+
+class StaticAssetCache:
+    """Кеш статичних файлів у пам'яті
+
+    Запис кешу перевіряється за mtime та розміром файлу, тому зміни на
+    диску підхоплюються без перезапуску. Для текстових файлів наперед
+    готуються gzip та (якщо встановлено brotli) br варіанти.
+    """
+
+    COMPRESSIBLE_TYPES = ('text/', 'application/javascript',
+                          'application/json', 'image/svg+xml')
+
+    def __init__(self, max_file_size=STATIC_CACHE_MAX_FILE_SIZE,
+                 compress_min_size=STATIC_COMPRESS_MIN_SIZE):
+        self.max_file_size = max_file_size
+        self.compress_min_size = compress_min_size
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def cacheable(self, stat):
+        """Чи поміщається файл у кеш (великі файли віддаються потоково)"""
+        return stat.st_size <= self.max_file_size
+
+    def get(self, path, content_type, stat=None):
+        """Отримання файлу з кешу (FileNotFoundError, якщо файлу немає)"""
+        if stat is None:
+            stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry.mtime_ns == stat.st_mtime_ns \
+                and entry.size == stat.st_size:
+            return entry
+
+        with open(path, 'rb') as f:
+            body = f.read()
+
+        entry = self.build_entry(stat, body, content_type)
+        if self.cacheable(stat):
+            with self.lock:
+                self.entries[path] = entry
+        return entry
+
+    def build_entry(self, stat, body, content_type):
+        """Підготовка запису кешу: ETag та стиснуті варіанти"""
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {}
+
+        if len(body) >= self.compress_min_size and \
+                content_type.startswith(self.COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                variants['gzip'] = (compressed, f'"{digest}-gzip"')
+
+            if brotli is not None:
+                compressed = brotli.compress(body)
+                if len(compressed) < len(body):
+                    variants['br'] = (compressed, f'"{digest}-br"')
+
+        return CachedAsset(stat.st_mtime_ns, stat.st_size, body,
+                           f'"{digest}"', variants)
+
+
+class Route:
+    """Маршрут: готовий абсолютний шлях до файлу або метод-обробник"""
+
+    __slots__ = ('pattern', 'file_path', 'content_type', 'handler',
+                 'cache_control')
+
+    def __init__(self, pattern, file_path=None, content_type=None,
+                 handler=None, cache_control='no-cache'):
+        self.pattern = pattern
+        self.file_path = file_path
+        self.content_type = content_type
+        self.handler = handler
+        self.cache_control = cache_control
+
+
+class RouteTable:
+    """Таблиця маршрутів, що будується один раз при старті сервера
+
+    Точні маршрути зберігаються у словнику (метод, шлях) -> Route.
+    Префіксні маршрути (/static/, /templates/) при монтуванні
+    розгортаються в точні для всіх наявних файлів, тому звичайний
+    запит не потребує ні розбору рядків, ні звернень до диска.
+    """
+
+    def __init__(self, base_dir='.', build_dir=ASSETS_BUILD_DIR):
+        self.base_dir = os.path.abspath(base_dir)
+        self.exact = {}
+        self.mounts = []
+        self.files = {}
+        # Зібрані build_assets.py файли мають пріоритет над вихідними
+        self.folders = (build_dir, os.path.join(build_dir, 'templates'),
+                        '', 'templates', 'static')
+
+    def find_file(self, filename):
+        """Пошук файлу в збірці, корені, templates та static (з кешуванням)"""
+        path = self.files.get(filename)
+        if path is not None:
+            return path
+
+        for folder in self.folders:
+            path = os.path.join(self.base_dir, folder, filename)
+            if os.path.isfile(path):
+                self.files[filename] = path
+                return path
+        return None
+
+    def add_file(self, path, filename, content_type):
+        """Маршрут на файл, знайдений у корені, templates або static"""
+        file_path = self.find_file(filename)
+        if file_path is not None:
+            self.exact[('GET', path)] = Route(path, file_path, content_type)
+
+    def add_handler(self, method, path, handler):
+        """Маршрут на метод StudyVaultHTTPHandler (для API)"""
+        self.exact[(method, path)] = Route(path, handler=handler)
+
+    def mount(self, prefix, directory, content_type=None, suffixes=None,
+              cache_control='no-cache'):
+        """Монтування папки під префіксом URL"""
+        directory = os.path.join(self.base_dir, directory)
+        self.mounts.append(
+            (prefix, directory, content_type, suffixes, cache_control))
+        if not os.path.isdir(directory):
+            return
+
+        for root, _, filenames in os.walk(directory):
+            for filename in filenames:
+                file_path = os.path.join(root, filename)
+                relative = os.path.relpath(file_path, directory)
+                self.mount_file(prefix, relative.replace(os.sep, '/'),
+                                file_path, content_type, suffixes,
+                                cache_control)
+
+    def mount_file(self, prefix, relative, file_path, content_type, suffixes,
+                   cache_control='no-cache'):
+        """Реєстрація файлу змонтованої папки як точного маршруту"""
+        if suffixes is not None and not relative.endswith(suffixes):
+            return None
+        if content_type is None:
+            content_type, _ = mimetypes.guess_type(relative)
+            content_type = content_type or 'application/octet-stream'
+            # Шаблони, стилі та скрипти StudyVault - в UTF-8
+            if content_type.startswith('text/') or \
+                    content_type.endswith('javascript'):
+                content_type += '; charset=utf-8'
+
+        route = Route(prefix, file_path, content_type,
+                      cache_control=cache_control)
+        self.exact[('GET', prefix + relative)] = route
+        return route
+
+    def resolve(self, method, path):
+        """Пошук маршруту для запиту"""
+        if method == 'HEAD':
+            method = 'GET'
+
+        route = self.exact.get((method, path))
+        if route is not None or method != 'GET':
+            return route
+
+        # Файли, що з'явились у змонтованих папках після старту
+        for prefix, directory, content_type, suffixes, cache_control \
+                in self.mounts:
+            if not path.startswith(prefix):
+                continue
+            relative = path[len(prefix):]
+            file_path = os.path.normpath(os.path.join(directory, relative))
+            if not file_path.startswith(directory + os.sep) or \
+                    not os.path.isfile(file_path):
+                return None
+            return self.mount_file(prefix, relative, file_path,
+                                   content_type, suffixes, cache_control)
+        return None
+
+
+def build_route_table(base_dir='.'):
+    """Побудова таблиці маршрутів StudyVault"""
+    routes = RouteTable(base_dir)
+    html = 'text/html; charset=utf-8'
+
+    # Папки монтуються першими, щоб явні маршрути нижче мали пріоритет
+    routes.mount('/static/', 'static')
+    # Файли з хешем вмісту в імені (dist/manifest.json) кешуються назавжди
+    routes.mount('/assets/', os.path.join(ASSETS_BUILD_DIR, 'assets'),
+                 cache_control=IMMUTABLE_CACHE_CONTROL)
+    routes.mount('/templates/', 'templates', html, suffixes=('.html',))
+
+    for path in ('/', '/index.html'):
+        routes.add_file(path, 'index.html', html)
+    for path in ('/message.html', '/message'):
+        routes.add_file(path, 'message.html', html)
+
+    assets = [
+        ('style.css', 'text/css; charset=utf-8', ('/style.css', '/styles.css')),
+        ('script.js', 'application/javascript; charset=utf-8',
+         ('/script.js',)),
+        ('logo.png', 'image/png', ('/logo.png',)),
+    ]
+    for filename, content_type, paths in assets:
+        for path in paths + ('/static/' + filename,):
+            routes.add_file(path, filename, content_type)
+
+    # Форма повідомлень
+    routes.add_handler('POST', '/message', 'handle_message_form')
+    routes.add_handler('POST', '/send_message', 'handle_message_form')
+
+    # API
+    routes.add_handler('GET', '/metrics', 'handle_metrics')
+    routes.add_handler('GET', '/admin/profile', 'handle_admin_profile')
+    routes.add_handler('GET', '/admin/memory', 'handle_admin_memory')
+    routes.add_handler('GET', '/api/messages', 'handle_messages_api')
+    routes.add_handler('GET', '/api/messages/cache', 'handle_cache_stats')
+    routes.add_handler('GET', '/api/messages/stream', 'handle_message_stream')
+    routes.add_handler('GET', '/api/stats', 'handle_stats_api')
+    routes.add_handler('GET', '/api/search', 'handle_search_api')
+    routes.add_handler('POST', '/api/materials', 'handle_material_add')
+    routes.add_handler('DELETE', '/api/materials', 'handle_material_remove')
+    routes.add_handler('POST', '/api/materials/upload', 'handle_material_upload')
+    routes.add_handler('GET', '/api/materials/download',
+                       'handle_material_download')
+
+    return routes
+
+
+def parse_byte_range(header, size):
+    """Розбір заголовка Range для одного діапазону
+
+    Повертає (start, end) включно, None якщо заголовок треба ігнорувати
+    (кілька діапазонів, інша одиниця або синтаксично некоректний
+    діапазон, як-от bytes=5-3 - RFC 9110 §14.1.1), або False якщо
+    діапазон не перетинається з файлом.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+
+    match = re.fullmatch(r'(\d*)-(\d*)', spec.strip())
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    start, end = match.groups()
+
+    if start == '':
+        # bytes=-N: останні N байт
+        length = int(end)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        return False
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def accepted_encodings(header):
+    """Розбір Accept-Encoding у множину дозволених кодувань"""
+    encodings = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.strip().replace(' ', '')
+        if params in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class UploadError(Exception):
+    """Некоректне тіло запиту завантаження (status - код відповіді)"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MultipartReader:
+    """Потоковий розбір multipart/form-data
+
+    next_part() повертає заголовки наступної частини, read_part() -
+    генератор її вмісту. В пам'яті тримається лише поточний шматок тіла
+    та хвіст довжиною в роздільник.
+    """
+
+    MAX_HEADERS_SIZE = 16 * 1024
+
+    def __init__(self, pieces, boundary):
+        self.pieces = iter(pieces)
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        # Перший роздільник не має попереднього CRLF - додаємо його,
+        # а преамбула до нього пропускається як звичайна частина
+        self.buffer = bytearray(b'\r\n')
+        self.in_part = True
+        self.finished = False
+
+    def _fill(self):
+        piece = next(self.pieces, None)
+        if piece is None:
+            raise UploadError(400, 'Неочікуваний кінець multipart тіла')
+        self.buffer += piece
+
+    def next_part(self):
+        """Заголовки наступної частини або None після останньої"""
+        if self.in_part:
+            for _ in self.read_part():
+                pass
+        if self.finished:
+            return None
+
+        while len(self.buffer) < 2:
+            self._fill()
+        if self.buffer[:2] == b'--':
+            # Епілог дочитується: інакше наступний запит keep-alive
+            # з'єднання почнеться з залишку цього тіла
+            self.finished = True
+            del self.buffer[:]
+            for _ in self.pieces:
+                pass
+            return None
+
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(self.buffer) > self.MAX_HEADERS_SIZE:
+                raise UploadError(400, 'Завеликі заголовки multipart частини')
+            self._fill()
+
+        block = bytes(self.buffer[:end]).decode('utf-8', 'replace')
+        del self.buffer[:end + 4]
+        self.in_part = True
+        # Перший рядок - залишок рядка роздільника
+        return email.parser.HeaderParser().parsestr(
+            block.partition('\r\n')[2] + '\r\n\r\n')
+
+    def read_part(self):
+        """Вміст поточної частини шматками"""
+        keep = len(self.delimiter) - 1
+        while self.in_part:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if index:
+                    yield bytes(self.buffer[:index])
+                del self.buffer[:index + len(self.delimiter)]
+                self.in_part = False
+                return
+
+            # Хвіст може бути початком роздільника - лишаємо його в буфері
+            if len(self.buffer) > keep:
+                data = bytes(self.buffer[:-keep])
+                del self.buffer[:-keep]
+                yield data
+            self._fill()
+
+    def read_field(self, limit=256):
+        """Текстове поле: перші limit байт, решта частини пропускається"""
+        value = bytearray()
+        for piece in self.read_part():
+            value += piece[:limit - len(value)]
+        return bytes(value).decode('utf-8', 'replace')
+
+
+def is_text_material(filename, content_type):
+    """Чи можна проіндексувати матеріал як текст"""
+    content_type = content_type or mimetypes.guess_type(filename)[0] or ''
+    return content_type.startswith('text/') or content_type in (
+        'application/json', 'application/xml')
+
 
 class StudyVaultHTTPHandler(BaseHTTPRequestHandler):
     """HTTP сервер для StudyVault з підтримкою існуючого frontend"""
 
-    def do_HEAD(self):
-        """Обробка HEAD запитів"""
-        self.do_GET()
+    # Постійні з'єднання HTTP/1.1: кожна відповідь має Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Таймаут простою keep-alive з'єднання
+    timeout = HTTP_KEEPALIVE_TIMEOUT
+    # Заголовки й тіло йдуть окремими write(): без TCP_NODELAY друга
+    # відповідь на keep-alive з'єднанні чекає на delayed ACK клієнта
+    disable_nagle_algorithm = True
+    # Спільний для всіх запитів кеш статичних файлів
+    asset_cache = StaticAssetCache()
+    # Спільний UDP socket для відправки на Socket-сервер
+    udp_sender = UDPMessageSender()
+    # Форма, більша за датаграму, читається, щоб відповісти редіректом
+    # з помилкою; 413 - лише для явно зловмисних тіл
+    form_max_size = 1024 * 1024
+
+    def do_HEAD(self):
+        """Обробка HEAD запитів"""
+        self.do_GET()
+
+    def do_GET(self):
+        """Обробка GET запитів"""
+        self.dispatch()
+
+    def do_POST(self):
+        """Обробка POST запитів"""
+        self.dispatch()
+
+    def do_DELETE(self):
+        """Обробка DELETE запитів"""
+        self.dispatch()
+
+    def send_response(self, code, message=None):
+        """Запам'ятовує статус відповіді для метрик"""
+        self.status_code = code
+        super().send_response(code, message)
+
+    def log_request(self, code='-', size='-'):
+        """Журнал запитів пише dispatch() разом із часом обробки"""
+
+    def log_error(self, format, *args):
+        LOG.warning('http.error', format % args,
+                    client=self.client_address[0])
+
+    def log_message(self, format, *args):
+        """Замість синхронного запису в stderr - черга логу"""
+        LOG.info('http.message', format % args, client=self.client_address[0])
+
+    def dispatch(self):
+        """Маршрутизація запиту через таблицю маршрутів сервера"""
+        started = time.perf_counter()
+        self.status_code = None
+
+        # Видаляємо query параметри з шляху
+        path, _, self.query = self.path.partition('?')
+        route = self.server.routes.resolve(
+            self.command, urllib.parse.unquote(path))
+
+        try:
+            if route is None:
+                if self.command in ('POST', 'DELETE'):
+                    # Тіло запиту не прочитане - з'єднання не можна використати далі
+                    self.close_connection = True
+                # 404 - повертаємо error.html
+                self.serve_file('error.html', 'text/html', 404)
+
+            elif route.handler is not None:
+                getattr(self, route.handler)()
+
+            else:
+                self.serve_route(route)
+
+        finally:
+            label = route.pattern if route is not None else 'unmatched'
+            METRICS.inc('studyvault_http_requests_total', (
+                ('method', self.command), ('route', label),
+                ('status', self.status_code)))
+            duration = time.perf_counter() - started
+            METRICS.observe('studyvault_http_request_duration_seconds',
+                            duration, (('route', label),))
+            LOG.info('http.access',
+                     f"{self.command} {path} {self.status_code}",
+                     method=self.command, path=path, route=label,
+                     status=self.status_code,
+                     duration_ms=round(duration * 1000, 3),
+                     client=self.client_address[0])
+
+    def handle_metrics(self):
+        """GET /metrics - метрики у форматі Prometheus"""
+        body = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.send_body(body)
+
+    def handle_message_form(self):
+        """Обробка форми повідомлень"""
+        content_length = self.read_content_length(self.form_max_size)
+        if content_length is None:
+            return
+        post_data = self.rfile.read(content_length).decode('utf-8', 'replace')
+
+        # Парсинг даних форми
+        form_data = urllib.parse.parse_qs(post_data)
+
+        username = form_data.get('username', [''])[0]
+        message = form_data.get('message', [''])[0]
+
+        if not (username and message):
+            # Помилка валідації
+            self.send_redirect('/message.html?error=1')
+            return
+
+        # відправляє дані на Socket-сервер
+        try:
+            self.send_to_socket_server(username, message)
+        except ValueError:
+            # Повідомлення не вміщується в датаграму
+            self.send_redirect('/message.html?error=2')
+        except OSError:
+            self.send_redirect('/message.html?error=3')
+        else:
+            # реренаправляє назад з повідомленням про успіх
+            self.send_redirect('/message.html?success=1')
+
+    def handle_messages_api(self):
+        """GET /api/messages - стрічка повідомлень
+
+        Параметри: limit, cursor, username, а також since/until (ISO 8601)
+        або day=YYYY-MM-DD для повідомлень за діапазон чи день (UTC).
+        """
+        params = urllib.parse.parse_qs(self.query)
+        reader = self.server.message_reader
+        if reader is None or reader.collection is None:
+            self.send_json(503, {'error': 'MongoDB не доступна'})
+            return
+
+        cursor = params.get('cursor', [None])[0]
+        username = params.get('username', [None])[0]
+        try:
+            limit = int(params.get('limit', [API_PAGE_SIZE])[0])
+        except ValueError:
+            self.send_json(400, {'error': 'limit має бути цілим числом '
+                                          f'від 1 до {API_MAX_PAGE_SIZE}'})
+            return
+        limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+        try:
+            since = until = None
+            if 'day' in params:
+                since = parse_date_param(params['day'][0][:10])
+                until = since + timedelta(days=1)
+            if 'since' in params:
+                since = parse_date_param(params['since'][0])
+            if 'until' in params:
+                until = parse_date_param(params['until'][0])
+        except ValueError:
+            self.send_json(400, {'error': 'since, until та day мають бути '
+                                          'датами ISO 8601'})
+            return
+        try:
+            key, generation, cached = reader.cached_page(
+                limit, cursor, username, since, until)
+            documents = None if cached else \
+                reader.page(limit, cursor, username, since, until)
+        except ValueError:
+            self.send_json(400, {'error': 'Некоректний курсор'})
+            return
+
+        self.start_chunked(200, 'application/json; charset=utf-8')
+
+        if cached:
+            items, next_cursor = cached
+            self.write_messages_page(items, next_cursor)
+            return
+
+        items = []
+        buffer = [b'{"messages":[']
+        size = 0
+        last = None
+        has_more = False
+
+        try:
+            for index, document in enumerate(documents):
+                if index == limit:
+                    has_more = True
+                    break
+                item = serialize_message(document).encode('utf-8')
+                items.append(item)
+                buffer.append(item if last is None else b',' + item)
+                size += len(item)
+                last = document
+                if size >= API_STREAM_CHUNK_SIZE:
+                    self.write_chunk(b''.join(buffer))
+                    buffer, size = [], 0
+
+            next_cursor = encode_cursor(last) if has_more else None
+            buffer.append(self.page_tail(next_cursor))
+            self.write_chunk(b''.join(buffer))
+            self.end_chunked()
+            reader.store_page(key, generation, items, next_cursor)
+
+        except Exception as e:
+            # Заголовки вже відправлені - обриваємо відповідь
+            LOG.error('messages.read_failed', f"❌ Помилка читання повідомлень: {e}",
+                      error=str(e))
+            self.close_connection = True
+
+    def write_messages_page(self, items, next_cursor):
+        """Потокова віддача сторінки з кешу"""
+        buffer = [b'{"messages":[']
+        size = 0
+        for index, item in enumerate(items):
+            buffer.append(item if index == 0 else b',' + item)
+            size += len(item)
+            if size >= API_STREAM_CHUNK_SIZE:
+                self.write_chunk(b''.join(buffer))
+                buffer, size = [], 0
+        buffer.append(self.page_tail(next_cursor))
+        self.write_chunk(b''.join(buffer))
+        self.end_chunked()
+
+    @staticmethod
+    def page_tail(next_cursor):
+        """Закінчення JSON сторінки з курсором наступної"""
+        return b'],"next_cursor":' + json.dumps(next_cursor).encode() + b'}'
+
+    def handle_cache_stats(self):
+        """GET /api/messages/cache - статистика кешу сторінок"""
+        reader = self.server.message_reader
+        if reader is None:
+            self.send_json(503, {'error': 'MongoDB не доступна'})
+            return
+        self.send_json(200, reader.cache.stats())
+
+    def handle_message_stream(self):
+        """GET /api/messages/stream - нові повідомлення (Server-Sent Events)
+
+        Параметр username обмежує стрічку одним автором. Клієнт, що
+        перепідключається з Last-Event-ID, спершу отримує пропущені
+        повідомлення з MongoDB, разом із вікном SSE_POLL_LAG перед
+        курсором (частину з них клієнт міг уже отримати). Після цього
+        з'єднання обслуговує SSEHub, а потік пулу повертається до інших
+        запитів.
+        """
+        hub = self.server.sse_hub
+        reader = self.server.message_reader
+        if hub is None:
+            self.send_json(503, {'error': 'Стрічка подій недоступна'})
+            return
+
+        params = urllib.parse.parse_qs(self.query)
+        username = params.get('username', [None])[0]
+        last_event_id = self.headers.get('Last-Event-ID') or \
+            params.get('last_event_id', [None])[0]
+        if last_event_id:
+            try:
+                decode_cursor(last_event_id)
+            except ValueError as e:
+                self.send_json(400, {'error': str(e)})
+                return
+
+        # Підписка до читання пропущених: нові повідомлення чекають у черзі
+        subscriber = hub.subscribe(username)
+        if subscriber is None:
+            self.close_connection = True
+            self.send_json(503, {'error': 'Забагато підключень до стрічки'})
+            return
+
+        documents = []
+        if last_event_id and reader is not None and \
+                reader.collection is not None:
+            try:
+                documents = list(reader.after(last_event_id, username,
+                                              lag=SSE_POLL_LAG))
+            except Exception as e:
+                # EventSource не перепідключається після помилки HTTP -
+                # віддаємо хоча б нові повідомлення
+                LOG.error('sse.catchup_failed',
+                          f"❌ Помилка читання пропущених повідомлень: {e}",
+                          error=str(e))
+
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Connection', 'close')
+        # Вимикає буферизацію відповіді в nginx
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        if self.command == 'HEAD':
+            hub.cancel(subscriber)
+            return
+
+        try:
+            self.wfile.write(b'retry: %d\n\n' % SSE_RETRY_MS + b''.join(
+                format_sse_event(document) for document in documents))
+        except OSError:
+            hub.cancel(subscriber)
+            return
+        self.server.detach(self.request)
+        hub.attach(subscriber, self.request,
+                   [document['_id'] for document in documents])
+
+    def handle_stats_api(self):
+        """GET /api/stats - статистика з інкрементних лічильників
+
+        Параметри: days (кількість останніх днів), top (кількість
+        найактивніших користувачів), username (лічильник користувача).
+        """
+        stats = self.server.stats
+        if stats is None:
+            self.send_json(503, {'error': 'MongoDB не доступна'})
+            return
+
+        params = urllib.parse.parse_qs(self.query)
+        try:
+            days = max(0, min(int(params.get('days', [STATS_DAYS])[0]), 3660))
+            top = max(0, min(int(params.get('top', [STATS_TOP_USERS])[0]),
+                             100))
+        except ValueError:
+            self.send_json(400, {'error': 'days і top мають бути числами'})
+            return
+
+        try:
+            payload = stats.snapshot(days, top,
+                                     params.get('username', [None])[0])
+        except PyMongoError as e:
+            LOG.error('stats.read_failed', f"❌ Помилка читання статистики: {e}",
+                      error=str(e))
+            self.send_json(503, {'error': 'MongoDB не доступна'})
+            return
+        self.send_json(200, payload)
+
+    def check_admin(self):
+        """Доступ до /admin/*: Bearer токен ADMIN_TOKEN
+
+        Без ADMIN_TOKEN адмін-маршрутів ніби не існує (404).
+        """
+        if not ADMIN_TOKEN:
+            self.serve_file('error.html', 'text/html', 404)
+            return False
+        authorization = self.headers.get('Authorization', '')
+        token = authorization[7:] if authorization.startswith('Bearer ') \
+            else ''
+        if not hmac.compare_digest(token.encode('utf-8'),
+                                   ADMIN_TOKEN.encode('utf-8')):
+            self.send_json(403, {'error': 'Потрібен адмін-токен'})
+            return False
+        return True
+
+    def admin_seconds(self, params, default):
+        """Тривалість профілювання з параметра seconds (ValueError)"""
+        seconds = float(params.get('seconds', [default])[0])
+        if not 0 <= seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(
+                f"seconds має бути від 0 до {PROFILE_MAX_SECONDS:g}")
+        return seconds
+
+    def send_text(self, status_code, text, headers=()):
+        """Текстова відповідь адмін-маршрутів"""
+        body = text.encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', len(body))
+        self.send_header('Cache-Control', 'no-store')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.send_body(body)
+
+    def handle_admin_profile(self):
+        """GET /admin/profile?seconds=N - collapsed stacks усіх потоків
+
+        Профіль знімається в процесі, що обслужив запит (X-Profile-PID);
+        відповідь можна передати у flamegraph.pl чи speedscope.
+        """
+        if not self.check_admin():
+            return
+        params = urllib.parse.parse_qs(self.query)
+        try:
+            seconds = self.admin_seconds(params, 10)
+            interval = float(params.get('interval_ms',
+                                        [PROFILE_INTERVAL_MS])[0]) / 1000
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        if not PROFILE_LOCK.acquire(blocking=False):
+            self.send_json(409, {'error': 'Профілювання вже виконується'})
+            return
+        try:
+            stacks, samples = StackSampler(interval).run(seconds)
+        finally:
+            PROFILE_LOCK.release()
+
+        self.send_text(200, ''.join(
+            f'{stack} {count}\n' for stack, count in stacks.most_common()),
+            (('X-Profile-PID', os.getpid()), ('X-Profile-Samples', samples)))
+
+    def handle_admin_memory(self):
+        """GET /admin/memory - алокації пам'яті через tracemalloc
+
+        action=diff (за замовчуванням) - різниця знімків за seconds;
+        start - увімкнути tracemalloc надовго, snapshot - живі алокації
+        з моменту start, stop - вимкнути. key - lineno або traceback.
+        """
+        if not self.check_admin():
+            return
+        params = urllib.parse.parse_qs(self.query)
+        action = params.get('action', ['diff'])[0]
+        key_type = params.get('key', ['lineno'])[0]
+        try:
+            seconds = self.admin_seconds(params, 10)
+            top = max(1, int(params.get('top', ['30'])[0]))
+            if key_type not in ('lineno', 'traceback', 'filename'):
+                raise ValueError("key має бути lineno, traceback чи filename")
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        if action == 'start':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self.send_json(200, {'tracing': True})
+            return
+        if action == 'stop':
+            tracemalloc.stop()
+            self.send_json(200, {'tracing': False})
+            return
+        if action == 'snapshot':
+            if not tracemalloc.is_tracing():
+                self.send_json(409, {'error': 'tracemalloc не запущено '
+                                              '(action=start)'})
+                return
+            self.send_text(200, tracemalloc_report(
+                None, tracemalloc.take_snapshot(), top, key_type))
+            return
+        if action != 'diff':
+            self.send_json(400, {'error': f"Невідома дія: {action}"})
+            return
+
+        if not PROFILE_LOCK.acquire(blocking=False):
+            self.send_json(409, {'error': 'Профілювання вже виконується'})
+            return
+        # Запущене на час вікна трасування зупиняється після нього
+        started = not tracemalloc.is_tracing()
+        try:
+            if started:
+                tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started:
+                tracemalloc.stop()
+            PROFILE_LOCK.release()
+
+        self.send_text(200, tracemalloc_report(before, after, top, key_type),
+                       (('X-Profile-PID', os.getpid()),))
+
+    def handle_search_api(self):
+        """GET /api/search?q=&k= - пошук по матеріалах"""
+        params = urllib.parse.parse_qs(self.query)
+        query = params.get('q', [''])[0]
+        try:
+            limit = int(params.get('k', [SEARCH_DEFAULT_RESULTS])[0])
+        except ValueError:
+            self.send_json(400, {'error': 'Параметр k має бути числом'})
+            return
+
+        started = time.perf_counter()
+        results = self.server.search_index.search(query, max(1, min(limit, 100)))
+        self.send_json(200, {
+            'query': query,
+            'results': results,
+            'took_ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+
+    def handle_material_add(self):
+        """POST /api/materials - додавання матеріалу в пошуковий індекс"""
+        material = self.read_json_body(SEARCH_MAX_DOCUMENT_SIZE)
+        if material is None:
+            return
+
+        filename = material.get('filename') if isinstance(material, dict) else None
+        content = material.get('content') if filename else None
+        if not isinstance(filename, str) or not isinstance(content, str):
+            self.send_json(400, {'error': 'Потрібні поля filename та content'})
+            return
+
+        self.server.search_index.add(
+            filename, content, str(material.get('category', '')))
+        self.send_json(201, {'filename': filename})
+
+    def handle_material_remove(self):
+        """DELETE /api/materials?filename= - видалення матеріалу з індексу"""
+        filename = urllib.parse.parse_qs(self.query).get('filename', [''])[0]
+        if self.server.search_index.remove(filename):
+            self.send_json(200, {'filename': filename})
+        else:
+            self.send_json(404, {'error': 'Матеріал не знайдено'})
+
+    def handle_material_upload(self):
+        """POST /api/materials/upload?filename=&category= - файл у GridFS
+
+        Тіло - вміст файлу (Content-Length або chunked) або
+        multipart/form-data з полем file. Файл пишеться в GridFS шматками,
+        тож пам'ять не залежить від його розміру.
+        """
+        store = self.server.materials
+        if store is None:
+            self.close_connection = True
+            self.send_json(503, {'error': 'Сховище матеріалів недоступне'})
+            return
+
+        params = urllib.parse.parse_qs(self.query)
+        filename = params.get('filename', [''])[0]
+        category = params.get('category', [''])[0]
+        content_type = self.headers.get_content_type() \
+            if 'Content-Type' in self.headers else ''
+
+        try:
+            pieces = self.read_body_pieces(MATERIAL_MAX_UPLOAD_SIZE)
+            if content_type == 'multipart/form-data':
+                boundary = self.headers.get_param('boundary')
+                if not boundary:
+                    raise UploadError(400, 'Не вказано boundary')
+                reader = MultipartReader(pieces, boundary)
+                fields = {}
+                while True:
+                    part = reader.next_part()
+                    if part is None:
+                        raise UploadError(400, 'Немає поля file')
+                    name = part.get_param('name', header='content-disposition')
+                    if name == 'file':
+                        filename = filename or part.get_filename() or ''
+                        content_type = part.get_content_type() \
+                            if 'Content-Type' in part else ''
+                        pieces = self.multipart_file(reader, fields)
+                        break
+                    fields[name] = reader.read_field()
+                # Поле category може йти і після файлу
+                category = category or (lambda: fields.get('category', ''))
+
+            if not filename:
+                raise UploadError(400, 'Потрібна назва файлу (filename)')
+
+            # Невеликі текстові матеріали одразу додаються в пошук
+            text = bytearray() if is_text_material(filename, content_type) \
+                else None
+
+            def collect(source):
+                nonlocal text
+                for piece in source:
+                    if text is not None:
+                        text += piece
+                        if len(text) > SEARCH_MAX_DOCUMENT_SIZE:
+                            text = None
+                    yield piece
+
+            document, duplicate = store.save(
+                filename, collect(pieces), content_type, category)
+
+        except UploadError as e:
+            self.close_connection = True
+            self.send_json(e.status, {'error': str(e)})
+            return
+
+        except Exception as e:
+            LOG.error('material.save_failed',
+                      f"❌ Помилка збереження матеріалу: {e}", error=str(e))
+            self.close_connection = True
+            self.send_json(503, {'error': 'Не вдалося зберегти файл'})
+            return
+
+        if text is not None and not duplicate:
+            try:
+                self.server.search_index.add(
+                    filename, text.decode('utf-8'),
+                    document['metadata'].get('category', ''))
+            except UnicodeDecodeError:
+                pass
+
+        self.send_json(200 if duplicate else 201, {
+            'id': str(document['_id']),
+            'filename': document['filename'],
+            'length': document['length'],
+            'sha256': document['metadata']['sha256'],
+            'category': document['metadata'].get('category', ''),
+            'duplicate': duplicate,
+        })
+
+    def handle_material_download(self):
+        """GET /api/materials/download?id= - потокова віддача файлу з GridFS"""
+        store = self.server.materials
+        if store is None:
+            self.send_json(503, {'error': 'Сховище матеріалів недоступне'})
+            return
+
+        try:
+            file_id = ObjectId(urllib.parse.parse_qs(self.query)['id'][0])
+            stored = store.open(file_id)
+        except (KeyError, InvalidId):
+            self.send_json(400, {'error': 'Некоректний id файлу'})
+            return
+        except gridfs.NoFile:
+            self.send_json(404, {'error': 'Файл не знайдено'})
+            return
+
+        metadata = stored.metadata or {}
+        etag = f'"{metadata.get("sha256", file_id)}"'
+        if self.etag_matches(self.headers.get('If-None-Match', ''), [etag]):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        quoted = urllib.parse.quote(stored.filename or str(file_id))
+        self.send_response(200)
+        self.send_header('Content-Type',
+                         metadata.get('contentType', 'application/octet-stream'))
+        self.send_header('Content-Length', stored.length)
+        self.send_header('Content-Disposition',
+                         f"attachment; filename*=UTF-8''{quoted}")
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'private, no-cache')
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+
+        # Шматки GridFS віддаються по одному
+        while True:
+            chunk = stored.readchunk()
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+
+    @staticmethod
+    def multipart_file(reader, fields):
+        """Вміст поля file, після якого дочитуються решта полів форми
+
+        Поля після файлу потрапляють у fields, а тіло читається до
+        завершального роздільника.
+        """
+        yield from reader.read_part()
+        while True:
+            part = reader.next_part()
+            if part is None:
+                return
+            name = part.get_param('name', header='content-disposition')
+            fields[name] = reader.read_field()
+
+    def read_body_pieces(self, max_size):
+        """Генератор тіла запиту шматками (Content-Length або chunked)"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            pieces = self.read_chunked_body()
+        elif 'Content-Length' in self.headers:
+            try:
+                length = int(self.headers['Content-Length'])
+            except ValueError:
+                raise UploadError(400, 'Некоректний Content-Length')
+            if length > max_size:
+                raise UploadError(413, 'Завеликий файл')
+            pieces = self.read_fixed_body(length)
+        else:
+            raise UploadError(411, 'Потрібен Content-Length або chunked')
+
+        def limited():
+            total = 0
+            for piece in pieces:
+                total += len(piece)
+                if total > max_size:
+                    raise UploadError(413, 'Завеликий файл')
+                yield piece
+        return limited()
+
+    def read_fixed_body(self, length):
+        """Тіло відомої довжини шматками по MATERIAL_CHUNK_SIZE"""
+        remaining = length
+        while remaining:
+            data = self.rfile.read(min(remaining, MATERIAL_CHUNK_SIZE))
+            if not data:
+                raise UploadError(400, 'Тіло запиту обірвалось')
+            remaining -= len(data)
+            yield data
+
+    def read_chunked_body(self):
+        """Тіло з Transfer-Encoding: chunked"""
+        while True:
+            line = self.rfile.readline(1024)
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise UploadError(400, 'Некоректний chunked запит')
+
+            if size == 0:
+                # Trailer заголовки до порожнього рядка
+                while self.rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+
+            remaining = size
+            while remaining:
+                data = self.rfile.read(min(remaining, MATERIAL_CHUNK_SIZE))
+                if not data:
+                    raise UploadError(400, 'Тіло запиту обірвалось')
+                remaining -= len(data)
+                yield data
+            self.rfile.readline(3)
+
+    def read_content_length(self, max_size):
+        """Content-Length запиту (None, якщо відповідь з помилкою вже надіслана)
+
+        Тіло з некоректною довжиною не прочитати, тож з'єднання
+        закривається разом із відповіддю.
+        """
+        header = self.headers.get('Content-Length')
+        if header is None:
+            status, error = 411, 'Потрібен Content-Length'
+        else:
+            try:
+                length = int(header)
+            except ValueError:
+                length = -1
+            if length < 0:
+                status, error = 400, 'Некоректний Content-Length'
+            elif length > max_size:
+                status, error = 413, 'Завеликий запит'
+            else:
+                return length
+
+        self.close_connection = True
+        self.send_json(status, {'error': error})
+        return None
+
+    def read_json_body(self, max_size):
+        """Читання JSON тіла запиту (None, якщо відповідь з помилкою вже надіслана)"""
+        content_length = self.read_content_length(max_size)
+        if content_length is None:
+            return None
+
+        try:
+            return json.loads(self.rfile.read(content_length).decode('utf-8'))
+        except (ValueError, UnicodeDecodeError):
+            self.send_json(400, {'error': 'Некоректний JSON'})
+            return None
+
+    def send_json(self, status_code, payload):
+        """Відправка JSON відповіді з Content-Length"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', len(body))
+        self.send_header('Cache-Control', 'no-store')
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.send_body(body)
+
+    def start_chunked(self, status_code, content_type):
+        """Початок потокової відповіді (chunked для HTTP/1.1)"""
+        self.chunked = self.request_version == 'HTTP/1.1'
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-store')
+        if self.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # Без chunked кінець відповіді позначає закриття з'єднання
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        """Запис шматка потокової відповіді"""
+        if self.command == 'HEAD' or not data:
+            return
+        if self.chunked:
+            self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def end_chunked(self):
+        """Завершення потокової відповіді"""
+        if self.command != 'HEAD' and self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def send_redirect(self, location):
+        """Перенаправлення 302 без тіла відповіді"""
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_body(self, content):
+        """Запис тіла відповіді (крім HEAD запитів)"""
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    def serve_file(self, filename, content_type, status_code=200):
+        """Відправка файлу клієнту"""
+        file_found = self.server.routes.find_file(filename)
+        if not file_found:
+            self.send_error(404, f"File {filename} not found")
+            return
+
+        self.serve_route(Route(filename, file_found,
+                               content_type + '; charset=utf-8'),
+                         status_code)
+
+    def serve_route(self, route, status_code=200):
+        """Відправка файлу маршруту через кеш статики"""
+        try:
+            stat = os.stat(route.file_path)
+            if self.asset_cache.cacheable(stat):
+                asset = self.asset_cache.get(
+                    route.file_path, route.content_type, stat)
+                self.send_asset(asset, route.content_type, status_code,
+                                route.cache_control)
+            else:
+                self.stream_file(route.file_path, stat, route.content_type,
+                                 status_code, route.cache_control)
+
+        except FileNotFoundError:
+            if status_code == 404:
+                self.send_error(404, "File not found")
+            else:
+                self.serve_file('error.html', 'text/html', 404)
+
+    def stream_file(self, file_path, stat, content_type, status_code=200,
+                    cache_control='no-cache'):
+        """Потокова відправка великого файлу з підтримкою Range"""
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+        start, end = 0, size - 1
+
+        if status_code == 200:
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match and self.etag_matches(if_none_match, [etag]):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', cache_control)
+                self.end_headers()
+                return
+
+            range_header = self.headers.get('Range')
+            if_range = self.headers.get('If-Range')
+            if range_header and (if_range is None or if_range == etag):
+                byte_range = parse_byte_range(range_header, size)
+                if byte_range is False:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if byte_range is not None:
+                    start, end = byte_range
+                    status_code = 206
+
+        with open(file_path, 'rb') as f:
+            length = end - start + 1
+            self.send_response(status_code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', length)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            if status_code == 206:
+                self.send_header('Content-Range',
+                                 f'bytes {start}-{end}/{size}')
+            self.end_headers()
+
+            if self.command != 'HEAD' and length > 0:
+                self.send_file_range(f, start, length)
+
+    def send_file_range(self, f, offset, length):
+        """Відправка частини файлу без копіювання в пам'ять процесу"""
+        if hasattr(os, 'sendfile'):
+            # socket.sendfile використовує os.sendfile з урахуванням таймауту
+            self.connection.sendfile(f, offset, length)
+            return
+
+        # Запасний варіант: читання через mmap фіксованими шматками
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            end = offset + length
+            for position in range(offset, end, STATIC_STREAM_CHUNK_SIZE):
+                chunk_end = min(position + STATIC_STREAM_CHUNK_SIZE, end)
+                self.wfile.write(mapped[position:chunk_end])
+
+    def send_asset(self, asset, content_type, status_code=200,
+                   cache_control='no-cache'):
+        """Відправка файлу з кешу з урахуванням ETag та Accept-Encoding"""
+        body, etag, encoding = asset.body, asset.etag, None
+        if asset.variants:
+            accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+            for name in ('br', 'gzip'):
+                if name in accepted and name in asset.variants:
+                    body, etag = asset.variants[name]
+                    encoding = name
+                    break
+
+        if status_code == 200:
+            if_none_match = self.headers.get('If-None-Match')
+            # 304 несе ETag того представлення, яке вже є в клієнта
+            # (обране за Accept-Encoding має пріоритет, зокрема для '*')
+            etags = [etag] + [tag for tag in asset.etags() if tag != etag]
+            matched = next((tag for tag in etags if if_none_match and
+                            self.etag_matches(if_none_match, [tag])), None)
+            if matched is not None:
+                self.send_response(304)
+                self.send_header('ETag', matched)
+                self.send_header('Cache-Control', cache_control)
+                if asset.variants:
+                    self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', len(body))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if asset.variants:
+            self.send_header('Vary', 'Accept-Encoding')
+        if status_code == 200:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.send_body(body)
+
+    @staticmethod
+    def etag_matches(if_none_match, etags):
+        """Перевірка If-None-Match проти ETag усіх представлень файлу"""
+        if if_none_match.strip() == '*':
+            return True
+        candidates = {tag.strip().removeprefix('W/')
+                      for tag in if_none_match.split(',')}
+        return any(etag in candidates for etag in etags)
+
+    def send_to_socket_server(self, username, message):
+        """Відправка даних на Socket-сервер
+
+        ValueError - повідомлення не вміщується в датаграму, OSError -
+        помилка відправки; обидві записуються в лог і передаються далі.
+        """
+        # Підготовка даних
+        data = {
+            'username': username,
+            'message': message,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }
+
+        try:
+            # Відправляємо через спільний UDP socket
+            self.udp_sender.send_messages([data])
+        except (ValueError, OSError) as e:
+            LOG.error('message.send_failed',
+                      f"❌ Помилка відправки на Socket-сервер: {e}",
+                      username=username, error=str(e))
+            raise
+
+        LOG.info('message.sent',
+                 f"✅ Повідомлення відправлено на Socket-сервер: {username}",
+                 username=username)
+
+
+def register_frame_metrics(frames):
+    """Метрики некоректних кадрів датаграм"""
+    METRICS.register_callback(
+        'studyvault_udp_frames_failed_total',
+        lambda: [((('reason', 'malformed'),), frames.malformed),
+                 ((('reason', 'oversize'),), frames.oversize)])
+
+
+# Повідомлення користувача потрапляють в одні bucket'и time-series колекції
+TIMESERIES_OPTIONS = {
+    'timeField': 'date',
+    'metaField': 'username',
+    'granularity': 'seconds',
+}
+
+
+DURABILITY_PROFILES = {
+    'fast': {'w': 0},
+    'acknowledged': {'w': 1},
+    'majority': {'w': 'majority', 'j': True},
+}
+
+
+def message_write_concern(profile=MONGO_DURABILITY):
+    """WriteConcern запису повідомлень для профілю надійності"""
+    if profile not in DURABILITY_PROFILES:
+        raise ValueError(f"Невідомий профіль MONGO_DURABILITY: {profile} "
+                         f"(доступні: {', '.join(DURABILITY_PROFILES)})")
+    options = dict(DURABILITY_PROFILES[profile])
+    if options['w'] == 'majority' and MONGO_WTIMEOUT_MS:
+        options['wtimeout'] = MONGO_WTIMEOUT_MS
+    return WriteConcern(**options)
+
+
+def create_mongo_client():
+    """MongoClient з явними пулом з'єднань, таймаутами та стисненням
+
+    Пул за замовчуванням розрахований на одночасні запити всіх потоків
+    HTTP пулу та потоків запису повідомлень. Параметри з MONGODB_URL
+    перекриваються змінними середовища.
+    """
+    options = {
+        'appname': 'studyvault',
+        'maxPoolSize': MONGO_MAX_POOL_SIZE or
+        HTTP_MAX_WORKERS + MONGO_EXECUTOR_WORKERS + 2,
+        'minPoolSize': MONGO_MIN_POOL_SIZE,
+        'connectTimeoutMS': MONGO_CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        'socketTimeoutMS': MONGO_SOCKET_TIMEOUT_MS or None,
+    }
+    if MONGO_COMPRESSORS:
+        options['compressors'] = MONGO_COMPRESSORS
+    return MongoClient(MONGODB_URL, **options)
+
+
+def check_mongodb():
+    """Перевірка доступності MongoDB командою ping перед запуском серверів"""
+    client = create_mongo_client()
+    try:
+        client.admin.command('ping')
+        return True
+    except PyMongoError as e:
+        LOG.error('mongo.unavailable', f"❌ MongoDB недоступна: {e}",
+                  error=str(e))
+        return False
+    finally:
+        client.close()
+
+
+def connect_mongodb():
+    """Підключення до MongoDB, повертає (client, database, collection)
+
+    Профіль MONGO_DURABILITY застосовується лише до колекції
+    повідомлень: матеріали та індекси завжди пишуться з підтвердженням.
+    """
+    client = create_mongo_client()
+    database = client['studyvault']
+    if MESSAGES_TIMESERIES:
+        ensure_timeseries_collection(database, MESSAGES_COLLECTION)
+    collection = database.get_collection(
+        MESSAGES_COLLECTION, write_concern=message_write_concern())
+    return client, database, collection
+
+
+def is_timeseries_collection(database, name):
+    """Чи є колекція time-series"""
+    info = next(database.list_collections(filter={'name': name}), None)
+    return info is not None and info.get('type') == 'timeseries'
+
+
+def ensure_timeseries_collection(database, name):
+    """Створення time-series колекції повідомлень, якщо її ще немає"""
+    info = next(database.list_collections(filter={'name': name}), None)
+    if info is None:
+        try:
+            database.create_collection(name, timeseries=TIMESERIES_OPTIONS)
+            LOG.info('mongo.timeseries_created',
+                     f"✅ Створено time-series колекцію {name}", collection=name)
+        except CollectionInvalid:
+            # Колекцію одночасно створив інший воркер
+            pass
+    elif info.get('type') != 'timeseries':
+        LOG.error('mongo.timeseries_conflict',
+                  f"❌ Колекція {name} вже існує як звичайна; перенесіть дані "
+                  f"командою: python migrate_dates.py --target <нова колекція> "
+                  f"--timeseries", collection=name)
+
+
+def parse_timestamp(value):
+    """ISO час від клієнта як datetime в UTC (None, якщо не розібрати)
+
+    Час без часового поясу вважається локальним часом відправника.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed.astimezone(timezone.utc)
+
+
+def create_message_document(json_data):
+    """Документ для MongoDB: {date, username, message[, sent_at]}
+
+    date - час отримання сервером, sent_at - час відправки клієнтом;
+    обидва зберігаються як BSON datetime (UTC).
+    """
+    document = {
+        'date': datetime.now(timezone.utc),
+        'username': json_data['username'],
+        'message': json_data['message']
+    }
+    sent_at = parse_timestamp(json_data.get('timestamp'))
+    if sent_at is not None:
+        document['sent_at'] = sent_at
+    return document
+
+
+# Код помилки MongoDB для документа з уже наявним _id
+DUPLICATE_KEY_ERROR = 11000
+
+
+def missing_documents(collection, documents):
+    """Документи, _id яких ще немає в колекції
+
+    Time-series колекція не має унікального індексу _id: повторна
+    вставка документа не дає помилки дубліката, а тихо додає копію.
+    Тому перед записом у неї наявні _id відсіюються запитом, обмеженим
+    діапазоном date пакета - так він читає лише bucket'и цього часу.
+    """
+    known = [d for d in documents if '_id' in d]
+    if not known:
+        return documents
+    dates = [to_utc_naive(d['date']) for d in known]
+    existing = {d['_id'] for d in collection.find(
+        {'date': {'$gte': min(dates), '$lte': max(dates)},
+         '_id': {'$in': [d['_id'] for d in known]}}, {'_id': 1})}
+    return [d for d in documents if d.get('_id') not in existing]
+
+
+def insert_message_batch(collection, batch, listeners=()):
+    """Запис пакета повідомлень одним insert_many
+
+    Після запису кожен listener отримує список щойно збережених
+    документів. Документи з уже наявним _id (повторна відправка після
+    збою) вважаються збереженими, але listeners не передаються; для
+    time-series колекції їх відсіює missing_documents().
+    Повертає False, якщо пакет не записано через помилку MongoDB
+    і його варто відправити ще раз.
+    """
+    if not batch:
+        return True
+
+    started = time.perf_counter()
+    duplicates = set()
+    skipped = 0
+    try:
+        if MESSAGES_TIMESERIES:
+            fresh = missing_documents(collection, batch)
+            skipped = len(batch) - len(fresh)
+            batch = fresh
+        if batch:
+            result = collection.insert_many(batch, ordered=False)
+            LOG.info('messages.saved',
+                     f"✅ Збережено пакет повідомлень: "
+                     f"{len(result.inserted_ids)}",
+                     count=len(result.inserted_ids))
+        persisted = batch
+
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        duplicates = {error['index'] for error in errors
+                      if error.get('code') == DUPLICATE_KEY_ERROR}
+        failed = {error['index'] for error in errors} - duplicates
+        if failed:
+            LOG.error('messages.save_partial',
+                      f"❌ Не збережено {len(failed)} з {len(batch)} "
+                      f"повідомлень пакета", failed=len(failed),
+                      count=len(batch))
+        persisted = [d for i, d in enumerate(batch)
+                     if i not in failed and i not in duplicates]
+
+    except Exception as e:
+        LOG.error('messages.save_failed',
+                  f"❌ Помилка пакетного запису в MongoDB: {e}",
+                  count=len(batch), error=str(e))
+        METRICS.inc('studyvault_mongo_documents_total',
+                    (('result', 'failed'),), len(batch))
+        return False
+
+    finally:
+        METRICS.observe('studyvault_mongo_batch_duration_seconds',
+                        time.perf_counter() - started)
+
+    METRICS.inc('studyvault_mongo_documents_total',
+                (('result', 'inserted'),), len(persisted))
+    if duplicates or skipped:
+        METRICS.inc('studyvault_mongo_documents_total',
+                    (('result', 'duplicate'),), len(duplicates) + skipped)
+    failed_count = len(batch) - len(persisted) - len(duplicates)
+    if failed_count:
+        METRICS.inc('studyvault_mongo_documents_total',
+                    (('result', 'failed'),), failed_count)
+
+    for listener in listeners:
+        try:
+            listener(persisted)
+        except Exception as e:
+            LOG.error('messages.listener_failed',
+                      f"❌ Помилка обробника збережених повідомлень: {e}",
+                      error=str(e))
+    return True
+
+
+# pymongo повертає BSON datetime як naive datetime в UTC
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def to_utc_naive(value):
+    """datetime в UTC без tzinfo, як його повертає pymongo"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def format_datetime(value):
+    """Дата документа для API: ISO 8601 в UTC (рядки старого формату як є)"""
+    if isinstance(value, datetime):
+        return to_utc_naive(value).isoformat(timespec='milliseconds') + 'Z'
+    return value
+
+
+def parse_date_param(value):
+    """Параметр запиту since/until/day як datetime в UTC (ValueError)"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Некоректна дата: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def encode_cursor(document):
+    """Курсор сторінки: позиція останнього документа (date, _id)
+
+    BSON datetime кодується мілісекундами від epoch - точністю, з якою
+    його зберігає MongoDB; рядкові дати старих документів - як є.
+    """
+    date = document['date']
+    if isinstance(date, datetime):
+        date = (to_utc_naive(date) - EPOCH) // MILLISECOND
+    raw = json.dumps([date, str(document['_id'])])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Розбір курсора сторінки (ValueError для некоректного курсора)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        date, object_id = json.loads(raw.decode('utf-8'))
+        if isinstance(date, int):
+            date = EPOCH + date * MILLISECOND
+        elif not isinstance(date, str):
+            raise ValueError("дата має бути числом або рядком")
+        return date, ObjectId(object_id)
+    except (ValueError, TypeError, OverflowError, InvalidId,
+            UnicodeError) as e:
+        raise ValueError(f"Некоректний курсор: {e}")
+
+
+def serialize_message(document):
+    """Повідомлення для API у вигляді JSON"""
+    message = {
+        'id': str(document['_id']),
+        'date': format_datetime(document['date']),
+        'username': document['username'],
+        'message': document['message'],
+    }
+    if document.get('sent_at') is not None:
+        message['sent_at'] = format_datetime(document['sent_at'])
+    return json.dumps(message, ensure_ascii=False, default=str)
+
+
+def format_sse_event(document):
+    """Подія Server-Sent Events; id - курсор документа для Last-Event-ID"""
+    return ('id: %s\nevent: message\ndata: %s\n\n' % (
+        encode_cursor(document), serialize_message(document))).encode('utf-8')
+
+
+class QueryCache:
+    """LRU+TTL кеш сторінок повідомлень з інвалідацією за поколіннями
+
+    Кожен запис пам'ятає покоління на момент запиту до MongoDB: загальне
+    для стрічки або окреме для username. Новий документ збільшує
+    покоління свого автора та загальне, тож застарілі записи
+    перестають збігатися без перебору кешу.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.feed_generation = 0
+        self.user_generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def generation(self, username):
+        """Поточне покоління стрічки або користувача"""
+        if username:
+            return self.user_generations.get(username, 0)
+        return self.feed_generation
+
+    def get(self, key, username):
+        """Пошук запису; повертає (значення або None, покоління)"""
+        with self.lock:
+            generation = self.generation(username)
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, entry_generation, value, size = entry
+                if entry_generation == generation and \
+                        expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value, generation
+                del self.entries[key]
+                self.bytes -= size
+
+            self.misses += 1
+            return None, generation
+
+    def put(self, key, generation, value, size):
+        """Збереження результату, отриманого для вказаного покоління"""
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[3]
+
+            self.entries[key] = (time.monotonic() + self.ttl, generation,
+                                 value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted[3]
+
+    def invalidate(self, documents):
+        """Інвалідація після запису нових документів"""
+        with self.lock:
+            self.feed_generation += 1
+            for username in {d['username'] for d in documents}:
+                self.user_generations[username] = \
+                    self.user_generations.get(username, 0) + 1
+
+    def stats(self):
+        """Статистика кешу: влучання та зайнята пам'ять"""
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / requests, 4) if requests else 0.0,
+                'bytes': self.bytes,
+            }
+
+
+class MessageReader:
+    """Читання повідомлень з keyset-пагінацією від нових до старих
+
+    Сторінка продовжується з позиції (date, _id) останнього документа
+    попередньої сторінки, тому глибокі сторінки коштують стільки ж,
+    скільки перша: без skip, лише діапазон по індексу.
+
+    Поки migrate_dates.py не перетворив усі дати, у колекції є і BSON
+    datetime, і рядки. MongoDB порівнює лише значення одного типу, а в
+    спадному порядку всі рядки йдуть після всіх datetime, тож курсор на
+    datetime явно продовжується рядковими датами (і навпаки для after).
+    Фільтри since/until - діапазони datetime і рядкових дат не бачать.
+    """
+
+    PROJECTION = {'date': 1, 'username': 1, 'message': 1, 'sent_at': 1}
+    SORT = [('date', -1), ('_id', -1)]
+
+    def __init__(self, collection, cache=None):
+        self.collection = collection
+        self.cache = cache if cache is not None else QueryCache()
+        METRICS.register_callback(
+            'studyvault_query_cache_requests_total',
+            lambda: [((('result', 'hit'),), self.cache.hits),
+                     ((('result', 'miss'),), self.cache.misses)])
+        METRICS.register_callback('studyvault_query_cache_bytes',
+                                  lambda: self.cache.bytes)
+
+    def ensure_indexes(self):
+        """Індекси для сортування стрічки та фільтра за username"""
+        self.collection.create_index(self.SORT)
+        self.collection.create_index([('username', 1)] + self.SORT)
+
+    def page(self, limit, cursor=None, username=None, since=None, until=None):
+        """Курсор MongoDB для сторінки (limit + 1 документ для has_more)
+
+        since/until обмежують діапазон date [since, until) - це діапазон
+        по тому ж індексу, що й сортування стрічки.
+        """
+        query = {}
+        if username:
+            query['username'] = username
+        if since is not None or until is not None:
+            query['date'] = {}
+            if since is not None:
+                query['date']['$gte'] = since
+            if until is not None:
+                query['date']['$lt'] = until
+        if cursor:
+            date, object_id = decode_cursor(cursor)
+            query['$or'] = [
+                {'date': {'$lt': date}},
+                {'date': date, '_id': {'$lt': object_id}},
+            ]
+            if isinstance(date, datetime):
+                query['$or'].append({'date': {'$type': 'string'}})
+
+        return self.collection.find(
+            query, self.PROJECTION, sort=self.SORT,
+            limit=limit + 1, batch_size=min(limit + 1, 1000))
+
+    def after(self, cursor, username=None, limit=SSE_CATCHUP_LIMIT, lag=0):
+        """Документи, новіші за позицію курсора, від старих до нових
+
+        Той самий індекс (date, _id), пройдений у зворотному напрямку.
+        lag (с) додає документи, старші за курсор не більше ніж на lag:
+        їх могли записати вже після документа курсора.
+        """
+        date, object_id = decode_cursor(cursor)
+        if lag and isinstance(date, datetime):
+            query = {'date': {'$gte': date - timedelta(seconds=lag)}}
+        else:
+            query = {'$or': [
+                {'date': {'$gt': date}},
+                {'date': date, '_id': {'$gt': object_id}},
+            ]}
+        if isinstance(date, str):
+            query['$or'].append({'date': {'$type': 'date'}})
+        if username:
+            query['username'] = username
+        return self.collection.find(
+            query, self.PROJECTION, sort=[('date', 1), ('_id', 1)],
+            limit=limit, batch_size=min(limit, 1000))
+
+    def cached_page(self, limit, cursor=None, username=None, since=None,
+                    until=None):
+        """Сторінка з кешу: (key, покоління, (items, next_cursor) або None)"""
+        key = (limit, cursor, username, since, until)
+        value, generation = self.cache.get(key, username)
+        return key, generation, value
+
+    def store_page(self, key, generation, items, next_cursor):
+        """Збереження серіалізованої сторінки в кеш"""
+        size = sum(len(item) for item in items) + len(next_cursor or '')
+        self.cache.put(key, generation, (items, next_cursor), size)
+
+
+class SSESubscriber:
+    """Клієнт стрічки подій: черга ще не відправлених подій"""
+
+    __slots__ = ('username', 'skip', 'queue', 'pending', 'sock', 'events',
+                 'dropped', 'closed')
+
+    def __init__(self, username=None, buffer_size=SSE_BUFFER_SIZE):
+        self.username = username
+        # _id повідомлень, уже надісланих з MongoDB за Last-Event-ID
+        self.skip = frozenset()
+        self.queue = deque(maxlen=buffer_size)
+        # Частина подій, яку сокет ще не прийняв (лише потік SSEHub)
+        self.pending = b''
+        self.sock = None
+        self.events = 0
+        self.dropped = False
+        self.closed = False
+
+
+class SSEHub:
+    """Розсилка нових повідомлень підписникам Server-Sent Events
+
+    Один потік з selectors обслуговує всі з'єднання: після заголовків
+    обробник передає сокет хабу і звільняє потік HTTP пулу. publish()
+    лише форматує подію один раз і дописує її в черги підписників;
+    відправка неблокуюча, тож повільний клієнт не затримує інших.
+    Клієнт, черга якого переповнилась, відключається - EventSource
+    перепідключиться з Last-Event-ID і дочитає пропущене з MongoDB.
+    """
+
+    HEARTBEAT = b': ping\n\n'
+
+    def __init__(self, buffer_size=SSE_BUFFER_SIZE,
+                 max_subscribers=SSE_MAX_SUBSCRIBERS,
+                 heartbeat=SSE_HEARTBEAT_INTERVAL):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.subscribers = set()
+        # Зміни для потоку хабу: нові з'єднання та черги з подіями
+        self.attached = []
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='sse-hub',
+                                       daemon=True)
+        self.thread.start()
+        METRICS.register_callback('studyvault_sse_subscribers',
+                                  lambda: len(self.subscribers))
+
+    def subscribe(self, username=None):
+        """Новий підписник (None, якщо досягнуто ліміту)
+
+        Події збираються в його черзі одразу, ще до attach(), тож
+        повідомлення, збережені під час читання пропущених, не губляться.
+        """
+        subscriber = SSESubscriber(username, self.buffer_size)
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def cancel(self, subscriber):
+        """Відмова від підписки до передачі сокета"""
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def attach(self, subscriber, sock, skip=()):
+        """Передача сокета хабу; skip - _id уже надісланих повідомлень"""
+        sock.setblocking(False)
+        with self.lock:
+            subscriber.sock = sock
+            if skip:
+                subscriber.skip = frozenset(skip)
+                events = [event for object_id, event in subscriber.queue
+                          if object_id not in subscriber.skip]
+                subscriber.queue.clear()
+                subscriber.queue.extend(events)
+            self.attached.append(subscriber)
+        self._wakeup()
+
+    def publish(self, documents):
+        """Подія для кожного нового документа (від MessageFeed)"""
+        events = [(d['_id'], d['username'], format_sse_event(d))
+                  for d in documents]
+        if not events:
+            return
+        with self.lock:
+            for subscriber in self.subscribers:
+                if subscriber.dropped:
+                    continue
+                for object_id, username, event in events:
+                    if subscriber.username and subscriber.username != username:
+                        continue
+                    if object_id in subscriber.skip:
+                        continue
+                    if len(subscriber.queue) == self.buffer_size:
+                        subscriber.dropped = True
+                        break
+                    subscriber.queue.append((object_id, event))
+                if subscriber.sock is not None:
+                    self.dirty.add(subscriber)
+        METRICS.inc('studyvault_sse_events_total', amount=len(events))
+        self._wakeup()
+
+    def close(self):
+        """Зупинка потоку та закриття всіх з'єднань"""
+        self.running = False
+        self._wakeup()
+        self.thread.join(timeout=5)
+        with self.lock:
+            subscribers = list(self.subscribers)
+            self.subscribers.clear()
+        for subscriber in subscribers:
+            if subscriber.sock is not None:
+                subscriber.sock.close()
+        self.selector.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+
+    def _wakeup(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Буфер уже містить непрочитане пробудження
+            pass
+
+    def _run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat
+        while self.running:
+            timeout = max(0.0, next_heartbeat - time.monotonic())
+            for key, mask in self.selector.select(timeout):
+                subscriber = key.data
+                if subscriber is None:
+                    try:
+                        while self.wakeup_reader.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ and not self._read(subscriber):
+                    self._disconnect(subscriber, 'closed')
+                elif mask & selectors.EVENT_WRITE:
+                    self._flush(subscriber)
+
+            with self.lock:
+                attached, self.attached = self.attached, []
+                dirty, self.dirty = self.dirty, set()
+            for subscriber in attached:
+                subscriber.events = selectors.EVENT_READ
+                self.selector.register(subscriber.sock, subscriber.events,
+                                       subscriber)
+            for subscriber in attached + list(dirty):
+                self._flush(subscriber)
+
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + self.heartbeat
+                with self.lock:
+                    idle = [s for s in self.subscribers
+                            if s.sock is not None and not s.queue]
+                # Пінг тримає з'єднання крізь проксі й виявляє мертві сокети
+                for subscriber in idle:
+                    if not subscriber.pending:
+                        subscriber.pending = self.HEARTBEAT
+                        self._flush(subscriber)
+
+    def _read(self, subscriber):
+        """Клієнт SSE нічого не надсилає: порожнє читання - закриття"""
+        try:
+            return bool(subscriber.sock.recv(4096))
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+
+    def _flush(self, subscriber):
+        """Неблокуюча відправка черги підписника"""
+        if subscriber.closed:
+            return
+        if subscriber.dropped:
+            self._disconnect(subscriber, 'slow')
+            return
+
+        if not subscriber.pending:
+            with self.lock:
+                subscriber.pending = b''.join(e for _, e in subscriber.queue)
+                subscriber.queue.clear()
+        while subscriber.pending:
+            try:
+                sent = subscriber.sock.send(subscriber.pending)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._disconnect(subscriber, 'error')
+                return
+            subscriber.pending = subscriber.pending[sent:]
+            if not subscriber.pending and subscriber.queue:
+                with self.lock:
+                    subscriber.pending = b''.join(
+                        e for _, e in subscriber.queue)
+                    subscriber.queue.clear()
+
+        # Очікуємо готовності сокета, лише поки є що відправити
+        events = selectors.EVENT_READ
+        if subscriber.pending:
+            events |= selectors.EVENT_WRITE
+        if events != subscriber.events:
+            self.selector.modify(subscriber.sock, events, subscriber)
+            subscriber.events = events
+
+    def _disconnect(self, subscriber, reason):
+        subscriber.closed = True
+        with self.lock:
+            self.subscribers.discard(subscriber)
+        try:
+            self.selector.unregister(subscriber.sock)
+        except (KeyError, ValueError):
+            pass
+        subscriber.sock.close()
+        METRICS.inc('studyvault_sse_disconnects_total', (('reason', reason),))
+
+
+class MessageFeed:
+    """Джерело подій SSEHub: нові повідомлення всіх воркерів з MongoDB
+
+    Кожен воркер приймає лише свою частку датаграм, тож власних
+    listeners запису хабу недостатньо: feed опитує індекс (date, _id).
+    Документ з часом отримання T потрапляє в MongoDB із затримкою
+    пакетного запису, тож інший воркер може записати його вже після
+    новіших. Тому кожне опитування перечитує вікно lag секунд до
+    найновішої побаченої дати, пропускаючи вже опубліковані _id.
+    Запит вікна покривається індексом; повні документи читаються
+    лише для нових _id. Власні записи воркера publish() передає хабу
+    одразу, без очікування опитування. Записи інших воркерів, знайдені
+    опитуванням, також інвалідують кеш сторінок reader.
+    """
+
+    def __init__(self, reader, hub, interval=SSE_POLL_INTERVAL,
+                 lag=SSE_POLL_LAG):
+        self.reader = reader
+        self.hub = hub
+        self.interval = interval
+        self.lag = timedelta(seconds=lag)
+        # _id опублікованих документів вікна -> date
+        self.seen = {}
+        self.mark = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='sse-feed',
+                                       daemon=True)
+        self.thread.start()
+
+    def publish(self, documents):
+        """Listener запису цього воркера"""
+        self.hub.publish(self._fresh(documents))
+
+    def _fresh(self, documents):
+        """Ще не опубліковані документи (і позначка про їх публікацію)"""
+        with self.lock:
+            fresh = [d for d in documents if d['_id'] not in self.seen]
+            for document in fresh:
+                self.seen[document['_id']] = to_utc_naive(document['date'])
+        return fresh
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            if self.reader.collection is None:
+                continue
+            try:
+                self.poll()
+            except Exception as e:
+                LOG.error('sse.poll_failed',
+                          f"❌ Помилка опитування стрічки повідомлень: {e}",
+                          error=str(e))
+
+    def poll(self):
+        """Публікація документів вікна, яких ще не було в стрічці"""
+        collection = self.reader.collection
+        if self.mark is None:
+            self.mark = to_utc_naive(datetime.now(timezone.utc))
+        recent = list(collection.find(
+            {'date': {'$gte': self.mark - self.lag}}, {'date': 1},
+            sort=[('date', 1), ('_id', 1)]))
+
+        with self.lock:
+            new_ids = [d['_id'] for d in recent if d['_id'] not in self.seen]
+        if new_ids:
+            documents = collection.find(
+                {'_id': {'$in': new_ids}}, MessageReader.PROJECTION,
+                sort=[('date', 1), ('_id', 1)])
+            fresh = self._fresh(documents)
+            if fresh:
+                self.reader.cache.invalidate(fresh)
+                self.hub.publish(fresh)
+
+        if recent:
+            self.mark = max(self.mark, to_utc_naive(recent[-1]['date']))
+        cutoff = self.mark - self.lag
+        with self.lock:
+            self.seen = {object_id: date for object_id, date
+                         in self.seen.items() if date >= cutoff}
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join(timeout=5)
+
+
+class MaterialStore:
+    """Файли матеріалів у GridFS з дедуплікацією за SHA-256
+
+    Файл записується шматками по chunk_size, а хеш рахується на льоту.
+    Унікальний індекс по metadata.sha256 не дає зберегти той самий
+    вміст двічі навіть при одночасних завантаженнях: дублікат
+    видаляється, а повертається вже збережений файл.
+    """
+
+    def __init__(self, database, bucket_name='materials',
+                 chunk_size=MATERIAL_CHUNK_SIZE):
+        self.bucket = gridfs.GridFSBucket(
+            database, bucket_name, chunk_size_bytes=chunk_size)
+        self.files = database[f'{bucket_name}.files']
+        # Обробники нових (не дублікатів) файлів
+        self.listeners = []
+
+    def ensure_indexes(self):
+        """Індекс для дедуплікації за вмістом"""
+        self.files.create_index('metadata.sha256', unique=True)
+
+    def save(self, filename, pieces, content_type='', category=''):
+        """Потоковий запис файлу -> (документ файлу, чи це дублікат)
+
+        category може бути функцією: її викликають після читання вмісту,
+        коли вже відомі поля форми, що йдуть після файлу.
+        """
+        digest = hashlib.sha256()
+        upload = self.bucket.open_upload_stream(filename)
+        try:
+            for piece in pieces:
+                digest.update(piece)
+                upload.write(piece)
+        except BaseException:
+            upload.abort()
+            raise
+
+        sha256 = digest.hexdigest()
+        if callable(category):
+            category = category()
+        upload.metadata = {
+            'sha256': sha256,
+            'contentType': content_type or 'application/octet-stream',
+            'category': category,
+        }
+        try:
+            upload.close()
+        except (DuplicateKeyError, FileExists):
+            # GridIn повідомляє про дублікат унікального індексу як FileExists
+            upload.abort()
+            return self.files.find_one({'metadata.sha256': sha256}), True
+
+        document = self.files.find_one({'_id': upload._id})
+        for listener in self.listeners:
+            try:
+                listener(document)
+            except Exception as e:
+                LOG.error('material.listener_failed',
+                          f"❌ Помилка обробника збережених матеріалів: {e}",
+                          error=str(e))
+        return document, False
+
+    def open(self, file_id):
+        """Потік читання файлу (gridfs.NoFile, якщо файлу немає)"""
+        return self.bucket.open_download_stream(file_id)
+
+
+def escape_key(value):
+    """Значення як ім'я поля MongoDB: без '.', '$' та NUL"""
+    if not value:
+        return '%'
+    return value.replace('%', '%25').replace('.', '%2E') \
+        .replace('$', '%24').replace('\0', '%00')
+
+
+def unescape_key(key):
+    """Зворотне до escape_key перетворення"""
+    return '' if key == '%' else urllib.parse.unquote(key)
+
+
+class StatsCounter:
+    """Статистика повідомлень і матеріалів з інкрементних лічильників
+
+    Документ stats/global містить загальні лічильники, лічильники за
+    днями та годинами доби (UTC) і за категоріями матеріалів, а
+    лічильник кожного користувача - окремий документ stats_users з
+    індексом за count. Listeners лише додають збережене до лічильників
+    у пам'яті; потік раз на flush_interval записує їх через $inc. Тож
+    /api/stats читає один документ і top користувачів за індексом,
+    скільки б повідомлень не було в колекції.
+
+    Раз на reconcile_interval лічильники перераховуються агрегаціями,
+    що виправляє розбіжності після збоїв. Перерахунок виконує один
+    воркер - той, хто взяв оренду reconcile_after у документі.
+    """
+
+    GLOBAL_ID = 'global'
+
+    def __init__(self, database, messages=None,
+                 flush_interval=STATS_FLUSH_INTERVAL,
+                 reconcile_interval=STATS_RECONCILE_INTERVAL):
+        self.stats = database['stats']
+        self.users = database['stats_users']
+        self.files = database['materials.files']
+        self.messages = messages
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        self.pending = Counter()
+        self.pending_users = Counter()
+        self.lock = threading.Lock()
+        self.running = True
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='stats',
+                                       daemon=True)
+        self.thread.start()
+
+    def ensure_indexes(self):
+        """Індекс для top користувачів"""
+        self.users.create_index([('count', -1)])
+
+    def add_messages(self, documents):
+        """Listener запису повідомлень"""
+        with self.lock:
+            for document in documents:
+                self.pending['messages.total'] += 1
+                self.pending_users[document['username']] += 1
+                date = document.get('date')
+                if isinstance(date, datetime):
+                    date = to_utc_naive(date)
+                    self.pending['messages.days.' +
+                                 date.strftime('%Y-%m-%d')] += 1
+                    self.pending['messages.hours.%02d' % date.hour] += 1
+
+    def add_material(self, document):
+        """Listener нових файлів MaterialStore"""
+        category = (document.get('metadata') or {}).get('category', '')
+        with self.lock:
+            self.pending['materials.total'] += 1
+            self.pending['materials.bytes'] += document.get('length', 0)
+            self.pending['materials.categories.' + escape_key(category)] += 1
+
+    def flush(self):
+        """Запис накопичених лічильників; при помилці вони повертаються"""
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            users, self.pending_users = self.pending_users, Counter()
+
+        if pending:
+            try:
+                self.stats.update_one({'_id': self.GLOBAL_ID},
+                                      {'$inc': dict(pending)}, upsert=True)
+            except PyMongoError as e:
+                LOG.error('stats.flush_failed',
+                          f"❌ Помилка запису статистики: {e}", error=str(e))
+                with self.lock:
+                    self.pending.update(pending)
+        if users:
+            try:
+                self.users.bulk_write([
+                    UpdateOne({'_id': username}, {'$inc': {'count': count}},
+                              upsert=True)
+                    for username, count in users.items()
+                ], ordered=False)
+            except PyMongoError as e:
+                LOG.error('stats.flush_failed',
+                          f"❌ Помилка запису статистики користувачів: {e}",
+                          error=str(e))
+                with self.lock:
+                    self.pending_users.update(users)
+
+    def close(self):
+        """Зупинка потоку із записом останніх лічильників"""
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        # Оренда перевіряється одразу: перший запуск будує лічильники
+        next_reconcile = time.monotonic()
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.flush()
+            if self.reconcile_interval <= 0 or \
+                    time.monotonic() < next_reconcile or not self.running:
+                continue
+            next_reconcile = time.monotonic() + \
+                min(self.reconcile_interval, 60)
+            try:
+                if self.acquire_lease():
+                    self.reconcile()
+            except PyMongoError as e:
+                LOG.error('stats.reconcile_failed',
+                          f"❌ Помилка перерахунку статистики: {e}",
+                          error=str(e))
+
+    def acquire_lease(self):
+        """Оренда перерахунку до now + reconcile_interval"""
+        now = datetime.now(timezone.utc)
+        try:
+            result = self.stats.update_one(
+                {'_id': self.GLOBAL_ID,
+                 'reconcile_after': {'$not': {'$gt': now}}},
+                {'$set': {'reconcile_after': now + timedelta(
+                    seconds=self.reconcile_interval)}},
+                upsert=True)
+        except DuplicateKeyError:
+            # Документ є, а оренду тримає інший воркер
+            return False
+        return bool(result.modified_count or result.upserted_id)
+
+    def reconcile(self):
+        """Перерахунок лічильників агрегаціями по колекціях
+
+        Приріст, записаний іншими воркерами під час перерахунку, може
+        бути втрачено - його виправить наступний перерахунок.
+        """
+        started = time.perf_counter()
+        stamp = datetime.now(timezone.utc)
+        messages = {'total': 0, 'days': {}, 'hours': {}}
+        users = 0
+
+        if self.messages is not None:
+            messages['total'] = self.messages.count_documents({})
+            # Дати старого рядкового формату враховуються лише в total
+            for row in self.messages.aggregate([
+                {'$match': {'date': {'$type': 'date'}}},
+                {'$group': {
+                    '_id': {
+                        'day': {'$dateToString': {
+                            'format': '%Y-%m-%d', 'date': '$date'}},
+                        'hour': {'$hour': '$date'},
+                    },
+                    'count': {'$sum': 1},
+                }},
+            ], allowDiskUse=True):
+                day = row['_id']['day']
+                hour = '%02d' % row['_id']['hour']
+                messages['days'][day] = \
+                    messages['days'].get(day, 0) + row['count']
+                messages['hours'][hour] = \
+                    messages['hours'].get(hour, 0) + row['count']
+
+            requests = []
+            for row in self.messages.aggregate([
+                {'$group': {'_id': '$username', 'count': {'$sum': 1}}},
+            ], allowDiskUse=True):
+                requests.append(UpdateOne(
+                    {'_id': row['_id']},
+                    {'$set': {'count': row['count'], 'reconciled': stamp}},
+                    upsert=True))
+                users += 1
+                if len(requests) == 1000:
+                    self.users.bulk_write(requests, ordered=False)
+                    requests = []
+            if requests:
+                self.users.bulk_write(requests, ordered=False)
+            # Користувачі, чиїх повідомлень уже немає в колекції
+            self.users.delete_many({'reconciled': {'$lt': stamp}})
+
+        materials = {'total': 0, 'bytes': 0, 'categories': {}}
+        for row in self.files.aggregate([
+            {'$group': {'_id': '$metadata.category', 'count': {'$sum': 1},
+                        'bytes': {'$sum': '$length'}}},
+        ]):
+            materials['total'] += row['count']
+            materials['bytes'] += row['bytes']
+            materials['categories'][escape_key(row['_id'] or '')] = \
+                row['count']
+
+        self.stats.update_one({'_id': self.GLOBAL_ID}, {'$set': {
+            'messages': messages,
+            'materials': materials,
+            'reconciled_at': stamp,
+        }}, upsert=True)
+        elapsed = time.perf_counter() - started
+        LOG.info('stats.reconciled',
+                 f"✅ Статистику перераховано: {messages['total']} повідомлень, "
+                 f"{users} користувачів, {materials['total']} матеріалів за "
+                 f"{elapsed:.1f} с", messages=messages['total'], users=users,
+                 materials=materials['total'], seconds=round(elapsed, 3))
+
+    def snapshot(self, days=STATS_DAYS, top=STATS_TOP_USERS, username=None):
+        """Статистика для /api/stats"""
+        document = self.stats.find_one({'_id': self.GLOBAL_ID}) or {}
+        messages = document.get('messages', {})
+        materials = document.get('materials', {})
+        per_day = messages.get('days', {})
+        hours = messages.get('hours', {})
+
+        result = {
+            'messages': {
+                'total': messages.get('total', 0),
+                'users': self.users.estimated_document_count(),
+                'top_users': [
+                    {'username': user['_id'], 'count': user['count']}
+                    for user in self.users.find(
+                        {}, sort=[('count', -1)], limit=top)
+                ] if top else [],
+                # Ключі YYYY-MM-DD сортуються хронологічно
+                'per_day': {day: per_day[day]
+                            for day in sorted(per_day)[-days:]} if days else {},
+                'per_hour': [hours.get('%02d' % hour, 0)
+                             for hour in range(24)],
+            },
+            'materials': {
+                'total': materials.get('total', 0),
+                'bytes': materials.get('bytes', 0),
+                'per_category': {
+                    unescape_key(key): count for key, count
+                    in materials.get('categories', {}).items()},
+            },
+            'reconciled_at': format_datetime(document['reconciled_at'])
+            if document.get('reconciled_at') else None,
+        }
+        if username:
+            user = self.users.find_one({'_id': username})
+            result['messages']['user'] = {
+                'username': username, 'count': user['count'] if user else 0}
+        return result
+
+
+# Слова: літери, цифри та апостроф всередині слова (п'ять, м'ята)
+WORD_RE = re.compile(r"\w+(?:'\w+)*")
+# Варіанти апострофа, що зустрічаються в українських текстах
+APOSTROPHES = str.maketrans({'’': "'", 'ʼ': "'", '`': "'", '‘': "'"})
+# Відмінкові закінчення, що відкидаються легким стемером (від довших до
+# коротших). Дієслівних -ти/-ла/-ли тут немає: вони зрізали б основи
+# іменників (студен-ти, шко-ла), і форми одного слова розходились би.
+UKRAINIAN_ENDINGS = (
+    (3, frozenset({'ами', 'ями', 'ові', 'еві', 'ого', 'ому', 'ими', 'іми'})),
+    (2, frozenset({'ої', 'ою', 'ею', 'ій', 'ий', 'их', 'іх', 'ів', 'ам',
+                   'ям', 'ах', 'ях', 'ом', 'ем'})),
+    (1, frozenset('аяиіїуюоеьй')),
+)
+REFLEXIVE_ENDINGS = ('ся', 'сь')
+# М'які основи, що лишаються після закінчення (лекці-я, лекц-ій)
+SOFT_STEM_ENDINGS = frozenset('іиь')
+MIN_STEM_LENGTH = 3
+
+
+@functools.lru_cache(maxsize=200000)
+def normalize_word(word):
+    """Нормалізація слова: апострофи, ё/ґ та закінчення
+
+    Форми одного слова мають спільну основу:
+
+    >>> {normalize_word(w) for w in ('студент', 'студенти', 'студентів',
+    ...                               'студентами', 'студента')}
+    {'студент'}
+    >>> {normalize_word(w) for w in ('лекція', 'лекції', 'лекцій',
+    ...                               'лекціями', 'лекцію')}
+    {'лекц'}
+    >>> {normalize_word(w) for w in ('школа', 'школи', 'школою', 'школі')}
+    {'школ'}
+    >>> {normalize_word(w) for w in ('новий', 'нового', 'нова', 'новими')}
+    {'нов'}
+    >>> {normalize_word(w) for w in ('завдання', 'завдань', 'завданням')}
+    {'завдан'}
+    >>> {normalize_word(w) for w in ('вчити', 'вчитися', 'вчиться')}
+    {'вчит'}
+    """
+    word = word.replace("'", '').replace('ё', 'е').replace('ґ', 'г')
+    if word[-2:] in REFLEXIVE_ENDINGS and len(word) - 2 >= MIN_STEM_LENGTH:
+        word = word[:-2]
+    for length, endings in UKRAINIAN_ENDINGS:
+        if len(word) - length >= MIN_STEM_LENGTH and word[-length:] in endings:
+            word = word[:-length]
+            break
+    if len(word) > MIN_STEM_LENGTH:
+        if word[-1] in SOFT_STEM_ENDINGS:
+            word = word[:-1]
+        # Подвоєння перед закінченням: завданн-я, але завдан-ь
+        if len(word) > MIN_STEM_LENGTH and word[-1] == word[-2]:
+            word = word[:-1]
+    return word
+
 
-    def do_GET(self):
-        """Обробка GET запитів"""
+def tokenize(text):
+    """Розбиття тексту на нормалізовані терміни (як у frontend: > 2 символів)"""
+    text = unicodedata.normalize('NFKC', text).casefold().translate(APOSTROPHES)
+    return [normalize_word(word) for word in WORD_RE.findall(text)
+            if len(word) > 2]
 
-        # Видаляємо query параметри з шляху
-        path = self.path.split('?')[0]
 
-        # маршрутизація
-        if path == '/' or path == '/index.html':
-            self.serve_file('index.html', 'text/html')
+class SearchIndex:
+    """Інвертований індекс матеріалів з ранжуванням BM25
 
-        elif path == '/message.html' or path == '/message':
-            self.serve_file('message.html', 'text/html')
+    Для кожного терміна зберігається список входжень {doc_id: tf}.
+    Зміни дописуються в журнал JSONL і відтворюються при старті, тож
+    оновлення інкрементальні: новий матеріал не перебудовує індекс.
+    Повний текст матеріалу лишається лише в журналі: у пам'яті - терміни
+    документа та початок тексту для фрагментів результатів.
+    """
 
-        elif self.path == '/style.css' or self.path == '/styles.css':
-            self.serve_file('style.css', 'text/css')
+    K1 = 1.2
+    B = 0.75
+    SNIPPET_RADIUS = 80
+    # Байти початку журналу, за якими видно його заміну стисканням
+    HEAD_SIZE = 64
 
-        elif self.path == '/script.js':
-            self.serve_file('script.js', 'application/javascript')
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        # Блокування журналу між воркерами; файл відкривається вже у
+        # воркері, тож flock не спільний із батьківським процесом
+        self.lock_file = None
+        self.lock_depth = 0
+        self._clear()
 
-        elif self.path == '/logo.png':
-            self.serve_file('logo.png', 'image/png')
+    def _clear(self):
+        self.postings = {}
+        self.documents = {}
+        self.ids = {}
+        self.next_id = 0
+        self.total_length = 0
+        self.journal_records = 0
+        # Прочитана частина журналу: inode, перші байти і позиція
+        self.inode = None
+        self.head = b''
+        self.offset = 0
 
-        # обробка файлів зі static папки
-        elif self.path.startswith('/static/'):
-            filename = self.path[8:]  # Видаляємо '/static/'
-            if filename == 'script.js':
-                self.serve_file('script.js', 'application/javascript')
-            elif filename == 'style.css':
-                self.serve_file('style.css', 'text/css')
-            elif filename == 'logo.png':
-                self.serve_file('logo.png', 'image/png')
-            else:
-                self.serve_static_file(filename)
+    @contextlib.contextmanager
+    def _locked(self, exclusive=False):
+        """Блокування журналу: спільне для читання, виключне для запису
 
-        elif self.path.startswith('/templates/'):
-            filename = self.path[11:]  # Видаляємо '/templates/'
-            if filename.endswith('.html'):
-                self.serve_file(filename, 'text/html')
-            else:
-                self.serve_file('error.html', 'text/html', 404)
+        Блокується окремий файл .lock, а не сам журнал: стискання
+        замінює журнал новим файлом. Вкладені виклики (стискання під час
+        запису) використовують уже взяте блокування.
+        """
+        with self.lock:
+            if not self.path or self.lock_depth:
+                self.lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self.lock_depth -= 1
+                return
+            if self.lock_file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.lock_file = open(self.path + '.lock', 'a')
+            fcntl.flock(self.lock_file,
+                        fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self.lock_depth = 1
+            try:
+                yield
+            finally:
+                self.lock_depth = 0
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
 
-        else:
-            # 404 - повертаємо error.html
-            self.serve_file('error.html', 'text/html', 404)
+    def load(self):
+        """Відтворення індексу з журналу"""
+        with self._locked():
+            self._catch_up()
 
-    def do_POST(self):
-        """Обробка POST запитів (форма повідомлень)"""
+        LOG.info('search.loaded',
+                 f"🔍 Пошуковий індекс завантажено: {len(self.documents)} "
+                 f"матеріалів", documents=len(self.documents))
+        return self
+
+    def _catch_up(self):
+        """Застосування записів, дописаних іншими воркерами
+
+        Журнал, замінений стисканням в іншому воркері (інший inode або
+        початок файлу), відтворюється заново.
+        """
+        if not self.path:
+            return
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            if self.inode is not None:
+                self._clear()
+            return
 
-        if self.path == '/message' or self.path == '/send_message':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length).decode('utf-8')
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            head = f.read(self.HEAD_SIZE)
+            if inode != self.inode or head[:len(self.head)] != self.head:
+                self._clear()
+                self.inode = inode
+            self.head = head
 
-            # Парсинг даних форми
-            form_data = urllib.parse.parse_qs(post_data)
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Недописаний останній рядок після аварійної зупинки
+                    break
+                self.offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.journal_records += 1
+                if record['op'] == 'add':
+                    self._add(record['filename'], record['content'],
+                              record.get('category', ''))
+                elif record['op'] == 'remove':
+                    self._remove(record['filename'])
 
-            username = form_data.get('username', [''])[0]
-            message = form_data.get('message', [''])[0]
+    def add(self, filename, content, category=''):
+        """Додавання або оновлення матеріалу"""
+        with self._locked(exclusive=True):
+            self._catch_up()
+            self._add(filename, content, category)
+            self._journal({'op': 'add', 'filename': filename,
+                           'category': category, 'content': content})
 
-            if username and message:
-                # відправляє дані на Socket-сервер
-                self.send_to_socket_server(username, message)
+    def remove(self, filename):
+        """Видалення матеріалу з індексу"""
+        with self._locked(exclusive=True):
+            self._catch_up()
+            if filename not in self.ids:
+                return False
+            self._remove(filename)
+            self._journal({'op': 'remove', 'filename': filename})
+            return True
 
-                # реренаправляє назад з повідомленням про успіх
-                self.send_response(302)
-                self.send_header('Location', '/message.html?success=1')
-                self.end_headers()
-            else:
-                # Помилка валідації
-                self.send_response(302)
-                self.send_header('Location', '/message.html?error=1')
-                self.end_headers()
-        else:
-            self.serve_file('error.html', 'text/html', 404)
+    def _add(self, filename, content, category):
+        self._remove(filename)
+        terms = tokenize(content + ' ' + filename)
 
-    def serve_file(self, filename, content_type, status_code=200):
-        """Відправка файлу клієнту"""
-        # Пошук файлу в різних папках
-        search_paths = [
-            filename,  # корінь
-            f'templates/{filename}',  # templates
-            f'static/{filename}'  # static
-        ]
-
-        file_found = None
-        for path in search_paths:
-            if os.path.exists(path):
-                file_found = path
-                break
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
 
-        if not file_found:
-            self.send_error(404, f"File {filename} not found")
+        doc_id = self.next_id
+        self.next_id += 1
+        self.ids[filename] = doc_id
+        self.documents[doc_id] = (filename, category, len(terms),
+                                  content[:SEARCH_SNIPPET_SOURCE_SIZE],
+                                  tuple(frequencies))
+        self.total_length += len(terms)
+        for term, tf in frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def _remove(self, filename):
+        doc_id = self.ids.pop(filename, None)
+        if doc_id is None:
             return
 
-        try:
-            with open(file_found, 'rb') as f:
-                content = f.read()
+        _, _, length, _, terms = self.documents.pop(doc_id)
+        self.total_length -= length
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
 
-            self.send_response(status_code)
-            self.send_header('Content-Type', content_type + '; charset=utf-8')
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
-            self.wfile.write(content)
+    def _journal(self, record):
+        """Дописування зміни в журнал під виключним блокуванням
 
-        except FileNotFoundError:
-            self.send_error(404, f"File {filename} not found")
+        Журнал уже прочитано до кінця (_catch_up), тож після запису
+        позиція - кінець файлу. Стискання - за потреби.
+        """
+        if not self.path:
+            return
 
-    def serve_static_file(self, filename):
-        """Обробка статичних файлів"""
-        try:
-            content_type, _ = mimetypes.guess_type(filename)
-            if content_type is None:
-                content_type = 'application/octet-stream'
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with open(self.path, 'ab') as f:
+            if f.tell() > self.offset:
+                # Недописаний хвіст після аварії не має склеїтись із записом
+                line = b'\n' + line
+            f.write(line)
+            self.offset = f.tell()
+        self.journal_records += 1
+        if self.inode is None:
+            self._catch_up()
 
-            with open(os.path.join('static', filename), 'rb') as f:
-                content = f.read()
+        # Журнал переважно із застарілих записів - переписуємо його
+        if self.journal_records > 2 * len(self.documents) + 1000:
+            self.compact()
 
-            self.send_response(200)
-            self.send_header('Content-Type', content_type)
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
-            self.wfile.write(content)
+    def compact(self):
+        """Перезапис журналу лише з останніми записами 'add' матеріалів
 
-        except FileNotFoundError:
-            self.serve_file('error.html', 'text/html', 404)
+        Повного тексту в пам'яті немає, тож журнал переписується з самого
+        себе: перший прохід знаходить позицію останнього запису кожного
+        матеріалу, другий копіює потрібні рядки. Перший рядок нового
+        журналу - унікальна позначка, тож інші воркери помітять заміну
+        навіть за повторно використаного inode.
+        """
+        with self._locked(exclusive=True):
+            self._catch_up()
+            latest = {}
+            offset = 0
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        latest[record['filename']] = (offset, record['op'])
+                    except (ValueError, KeyError):
+                        pass
+                    offset += len(line)
 
-    def send_to_socket_server(self, username, message):
-        """Відправка даних на Socket-сервер"""
+            keep = sorted(position for position, op in latest.values()
+                          if op == 'add')
+            temp_path = self.path + '.tmp'
+            with open(self.path, 'rb') as source, \
+                    open(temp_path, 'wb') as target:
+                target.write(json.dumps({
+                    'op': 'compacted', 'id': os.urandom(8).hex(),
+                }).encode('utf-8') + b'\n')
+                for position in keep:
+                    source.seek(position)
+                    line = source.readline()
+                    target.write(line if line.endswith(b'\n') else line + b'\n')
+            os.replace(temp_path, self.path)
+            # Стан у пам'яті вже відповідає журналу - лише нова позиція
+            with open(self.path, 'rb') as f:
+                self.inode = os.fstat(f.fileno()).st_ino
+                self.head = f.read(self.HEAD_SIZE)
+                self.offset = f.seek(0, os.SEEK_END)
+            self.journal_records = len(keep)
+
+    def search(self, query, limit=SEARCH_DEFAULT_RESULTS):
+        """Пошук top-k матеріалів за BM25 з урахуванням змін інших воркерів"""
+        terms = set(tokenize(query))
+        with self._locked():
+            self._catch_up()
+            count = len(self.documents)
+            if not terms or not count:
+                return []
+
+            average_length = self.total_length / count or 1
+            scores = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                for doc_id, tf in posting.items():
+                    length = self.documents[doc_id][2]
+                    norm = self.K1 * (1 - self.B + self.B * length / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + \
+                        idf * tf * (self.K1 + 1) / (tf + norm)
+
+            top = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+            results = []
+            for doc_id, score in top:
+                filename, category, _, content, _ = self.documents[doc_id]
+                results.append({
+                    'filename': filename,
+                    'category': category,
+                    'score': round(score, 4),
+                    'snippet': self.snippet(content, terms),
+                })
+            return results
+
+    def snippet(self, content, terms):
+        """Фрагмент тексту навколо першого знайденого терміна
+
+        Пошук іде в збереженому початку тексту; якщо терміна там немає,
+        повертається сам початок.
+        """
+        normalized = unicodedata.normalize('NFKC', content)
+        for match in WORD_RE.finditer(normalized):
+            word = match.group().casefold().translate(APOSTROPHES)
+            if len(word) > 2 and normalize_word(word) in terms:
+                start = max(0, match.start() - self.SNIPPET_RADIUS)
+                end = min(len(normalized), match.end() + self.SNIPPET_RADIUS)
+                prefix = '…' if start > 0 else ''
+                suffix = '…' if end < len(normalized) else ''
+                return prefix + normalized[start:end].strip() + suffix
+        return normalized[:2 * self.SNIPPET_RADIUS]
+
+
+class MessageBatchWriter:
+    """Пакетний запис повідомлень в MongoDB
+
+    Документи накопичуються в обмеженому буфері та записуються одним
+    insert_many, коли набирається batch_size документів або минає
+    flush_interval_ms з моменту появи першого документа в пакеті.
+    """
+
+    _STOP = object()
+
+    def __init__(self, collection, batch_size=MONGO_BATCH_SIZE,
+                 flush_interval_ms=MONGO_FLUSH_INTERVAL_MS,
+                 buffer_size=MONGO_BUFFER_SIZE, listeners=()):
+        self.collection = collection
+        self.listeners = listeners
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        # Обмежений буфер: при переповненні add() чекає на writer
+        self.buffer = queue.Queue(maxsize=buffer_size)
+        METRICS.register_callback('studyvault_mongo_write_buffer_depth',
+                                  self.buffer.qsize)
+        self.thread = threading.Thread(
+            target=self._run, name='mongo-writer', daemon=True)
+        self.thread.start()
+
+    def add(self, document):
+        """Додавання документа в буфер запису"""
+        self.buffer.put(document)
+
+    def close(self, timeout=10):
+        """Запис залишку буфера та зупинка потоку"""
+        if self.thread.is_alive():
+            self.buffer.put(self._STOP)
+            self.thread.join(timeout)
+
+    def _run(self):
+        """Цикл збору пакетів"""
+        batch = []
+        deadline = None
+
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+
+            try:
+                item = self.buffer.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                insert_message_batch(self.collection, batch, self.listeners)
+                return
+
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if len(batch) >= self.batch_size or (
+                    deadline is not None and time.monotonic() >= deadline):
+                insert_message_batch(self.collection, batch, self.listeners)
+                batch = []
+                deadline = None
+
+
+class MessageSpool:
+    """Журнал повідомлень на диску перед записом в MongoDB
+
+    add() лише дописує документ у BSON сегмент і не чекає на MongoDB,
+    тож прийом повідомлень не залежить від її затримок і доступності.
+    Потік-дренажник пакетами переносить журнал у колекцію, зберігає
+    позицію в checkpoint і видаляє повністю записані сегменти; після
+    перезапуску запис продовжується з checkpoint. _id призначається
+    при записі в журнал, тому повторно відправлений після збою пакет
+    дає duplicate key, що вважається успішним записом.
+    """
+
+    FSYNC_POLICIES = ('always', 'interval', 'never')
+    SEGMENT_PREFIX = 'segment-'
+    SEGMENT_SUFFIX = '.bson'
+    CHECKPOINT = 'checkpoint.json'
+    # Максимальний розмір BSON документа в MongoDB
+    MAX_DOCUMENT_SIZE = 16 * 1024 * 1024
+    RETRY_MIN_DELAY = 0.5
+    RETRY_MAX_DELAY = 30
+
+    def __init__(self, collection, path=SPOOL_DIR, fsync=SPOOL_FSYNC,
+                 fsync_interval_ms=SPOOL_FSYNC_INTERVAL_MS,
+                 segment_size=SPOOL_SEGMENT_SIZE,
+                 batch_size=MONGO_BATCH_SIZE,
+                 flush_interval_ms=MONGO_FLUSH_INTERVAL_MS,
+                 listeners=(), connect=None):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Невідома політика fsync журналу: {fsync}")
+
+        self.collection = collection
+        self.connect = connect
+        self.mongodb_client = None
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = max(0, fsync_interval_ms) / 1000
+        self.segment_size = max(1, segment_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        self.listeners = listeners
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closing = False
+        self.dirty = False
+        self.appended = 0
+
+        os.makedirs(path, exist_ok=True)
+        segments = self._segments()
+        self.position = self._load_checkpoint(segments)
+        # Новий сегмент при кожному старті: хвіст старого міг бути недописаний
+        self.segment = (segments[-1] + 1) if segments else self.position[0]
+        self.file = self._open_segment(self.segment)
+        if segments:
+            LOG.info('spool.pending',
+                     f"📼 Сегментів журналу, що очікують запису в MongoDB: "
+                     f"{len(segments)}", segments=len(segments))
+
+        METRICS.register_callback('studyvault_spool_pending_bytes',
+                                  self.pending_bytes)
+        METRICS.register_callback('studyvault_spool_segments',
+                                  lambda: len(self._segments()))
+
+        self.thread = threading.Thread(
+            target=self._drain, name='spool-drainer', daemon=True)
+        self.thread.start()
+        self.fsync_thread = None
+        if fsync == 'interval':
+            self.fsync_thread = threading.Thread(
+                target=self._fsync_loop, name='spool-fsync', daemon=True)
+            self.fsync_thread.start()
+
+    def add(self, document):
+        """Дописування документа в журнал"""
+        document.setdefault('_id', ObjectId())
+        data = bson.encode(document)
+
+        with self.lock:
+            if self.closing:
+                raise RuntimeError("Журнал повідомлень закрито")
+            # Один write() без буфера: дренажник одразу бачить документ
+            self.file.write(data)
+            self.appended += len(data)
+            if self.fsync == 'always':
+                os.fsync(self.file.fileno())
+            else:
+                self.dirty = True
+            if self.file.tell() >= self.segment_size:
+                self._rotate()
+
+        self.wakeup.set()
+
+    def close(self, timeout=10):
+        """Запис залишку журналу (якщо MongoDB доступна) та зупинка"""
+        with self.lock:
+            self.closing = True
+        self.wakeup.set()
+        self.thread.join(timeout)
+        if self.fsync_thread is not None:
+            self.fsync_thread.join(timeout)
+
+        with self.lock:
+            if self.fsync != 'never':
+                os.fsync(self.file.fileno())
+            self.file.close()
+            # Порожній активний сегмент не потрібен
+            if self.position[0] == self.segment and \
+                    os.path.getsize(self._segment_path(self.segment)) == \
+                    self.position[1]:
+                os.remove(self._segment_path(self.segment))
+
+    def pending_bytes(self):
+        """Розмір журналу, що ще не записаний в MongoDB"""
+        total = 0
+        for segment in self._segments():
+            try:
+                total += os.path.getsize(self._segment_path(segment))
+            except OSError:
+                continue
+        return max(0, total - self.position[1])
+
+    def _segment_path(self, segment):
+        return os.path.join(
+            self.path, f"{self.SEGMENT_PREFIX}{segment:012d}{self.SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        """Номери наявних сегментів за зростанням"""
+        segments = []
+        for name in os.listdir(self.path):
+            if name.startswith(self.SEGMENT_PREFIX) and \
+                    name.endswith(self.SEGMENT_SUFFIX):
+                number = name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)]
+                if number.isdigit():
+                    segments.append(int(number))
+        return sorted(segments)
+
+    def _open_segment(self, segment):
+        # buffering=0: кожен документ потрапляє у файл одним write()
+        return open(self._segment_path(segment), 'ab', buffering=0)
+
+    def _rotate(self):
+        """Закриття заповненого сегмента та відкриття наступного"""
+        if self.fsync != 'never':
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.segment += 1
+        self.file = self._open_segment(self.segment)
+        self.dirty = False
+
+    def _load_checkpoint(self, segments):
+        """Позиція (сегмент, зсув), з якої продовжується запис в MongoDB"""
+        first = segments[0] if segments else 1
         try:
-            # Створю UDP socket
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            with open(os.path.join(self.path, self.CHECKPOINT),
+                      encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            segment, offset = int(checkpoint['segment']), int(checkpoint['offset'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return first, 0
+
+        if segment in segments:
+            return segment, offset
+        # Сегмент checkpoint уже видалено - продовжуємо з наступного наявного
+        later = [s for s in segments if s > segment]
+        return (later[0], 0) if later else (max(segment, first), 0)
+
+    def _save_checkpoint(self, position):
+        path = os.path.join(self.path, self.CHECKPOINT)
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+        os.replace(temporary, path)
+
+    def _fsync_loop(self):
+        """Періодичний fsync активного сегмента"""
+        while not self.closing:
+            time.sleep(self.fsync_interval)
+            with self.lock:
+                if self.dirty and not self.file.closed:
+                    os.fsync(self.file.fileno())
+                    self.dirty = False
+
+    def _read_batch(self):
+        """Наступний пакет: (документи, нова позиція, завершені сегменти)"""
+        documents = []
+        finished = []
+        segment, offset = self.position
+
+        while len(documents) < self.batch_size:
+            # Номер активного сегмента береться до читання: якщо сегмент
+            # уже не активний, усі його документи дописані
+            with self.lock:
+                active = self.segment
+            if segment > active:
+                break
+
+            complete = True
+            try:
+                with open(self._segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    while len(documents) < self.batch_size:
+                        header = f.read(4)
+                        size = int.from_bytes(header, 'little')
+                        if len(header) < 4 or not \
+                                5 <= size <= self.MAX_DOCUMENT_SIZE:
+                            complete = not header
+                            break
+                        body = f.read(size - 4)
+                        if len(body) < size - 4:
+                            complete = False
+                            break
+                        try:
+                            documents.append(bson.decode(header + body))
+                        except Exception:
+                            complete = False
+                            break
+                        offset += size
+            except FileNotFoundError:
+                pass
+
+            if len(documents) >= self.batch_size or segment == active:
+                break
+
+            # Сегмент прочитано до кінця; None - без пошкодженого хвоста
+            finished.append((segment, None if complete else offset))
+            segment, offset = segment + 1, 0
+
+        return documents, (segment, offset), finished
+
+    def _ensure_collection(self):
+        """Повторне підключення, якщо MongoDB була недоступна при старті"""
+        if self.collection is None and self.connect is not None:
+            try:
+                self.mongodb_client, _, self.collection = self.connect()
+                LOG.info('mongo.connected', "✅ Підключено до MongoDB")
+            except Exception as e:
+                LOG.error('mongo.connect_failed',
+                          f"❌ Помилка підключення до MongoDB: {e}",
+                          error=str(e))
+        return self.collection is not None
+
+    def _drain(self):
+        """Цикл перенесення журналу в MongoDB"""
+        delay = self.RETRY_MIN_DELAY
+
+        while True:
+            closing = self.closing
+            documents, position, finished = self._read_batch()
+
+            # Неповний пакет - трохи чекаємо, поки накопичиться більше
+            if documents and len(documents) < self.batch_size and not closing:
+                time.sleep(self.flush_interval)
+                documents, position, finished = self._read_batch()
+
+            if not documents:
+                self._finish(position, finished)
+                if closing:
+                    return
+                self.wakeup.wait(1)
+                self.wakeup.clear()
+                continue
+
+            if self._ensure_collection() and insert_message_batch(
+                    self.collection, documents, self.listeners):
+                self._finish(position, finished)
+                delay = self.RETRY_MIN_DELAY
+                continue
+
+            # MongoDB недоступна: документи лишаються в журналі
+            if closing:
+                LOG.error('spool.unflushed',
+                          "❌ MongoDB недоступна, журнал буде записано "
+                          "після перезапуску")
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, self.RETRY_MAX_DELAY)
+
+    def _finish(self, position, finished):
+        """Збереження позиції та видалення записаних сегментів"""
+        if position != self.position or finished:
+            self.position = position
+            self._save_checkpoint(position)
+        for segment, torn_offset in finished:
+            if torn_offset is not None:
+                LOG.error('spool.torn_segment',
+                          f"❌ Пошкоджений хвіст сегмента журналу {segment} "
+                          f"з позиції {torn_offset} пропущено",
+                          segment=segment, offset=torn_offset)
+            try:
+                os.remove(self._segment_path(segment))
+            except FileNotFoundError:
+                pass
+
+
+def create_message_writer(collection, listeners, spool_dir=SPOOL_DIR,
+                          connect=None):
+    """Буфер запису повідомлень: журнал на диску або пакети в пам'яті"""
+    if spool_dir:
+        return MessageSpool(collection, path=spool_dir,
+                            listeners=listeners, connect=connect)
+    if collection is not None:
+        return MessageBatchWriter(collection, listeners=listeners)
+    return None
+
+
+class IngestWorkerPool:
+    """Фіксований пул потоків обробки датаграм з обмеженою чергою
+
+    Політика переповнення черги:
+    - drop-newest: нова датаграма відкидається
+    - drop-oldest: з черги видаляється найстаріша датаграма
+    - block: потік прийому чекає на вільне місце в черзі
+    """
+
+    POLICIES = ('drop-newest', 'drop-oldest', 'block')
+    _STOP = object()
+
+    def __init__(self, handler, workers=INGEST_WORKERS,
+                 queue_size=INGEST_QUEUE_SIZE,
+                 overflow_policy=INGEST_OVERFLOW_POLICY):
+        if overflow_policy not in self.POLICIES:
+            raise ValueError(
+                f"Невідома політика переповнення: {overflow_policy}")
+
+        self.handler = handler
+        self.overflow_policy = overflow_policy
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+
+        # Лічильники прийнятих та відкинутих датаграм
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.dropped_newest = 0
+        self.dropped_oldest = 0
+
+        self.threads = []
+        for i in range(max(1, workers)):
+            thread = threading.Thread(
+                target=self._worker, name=f'ingest-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, *args):
+        """Додавання задачі в чергу згідно з політикою переповнення"""
+        if self.overflow_policy == 'block':
+            self.queue.put(args)
+
+        elif self.overflow_policy == 'drop-newest':
+            try:
+                self.queue.put_nowait(args)
+            except queue.Full:
+                with self.lock:
+                    self.dropped_newest += 1
+                return False
+
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(args)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        with self.lock:
+                            self.dropped_oldest += 1
+                    except queue.Empty:
+                        pass
 
-            # Підготовка даних
-            data = {
-                'username': username,
-                'message': message,
-                'timestamp': datetime.now().isoformat()
+        with self.lock:
+            self.accepted += 1
+        return True
+
+    def stats(self):
+        """Знімок лічильників пулу"""
+        with self.lock:
+            return {
+                'accepted': self.accepted,
+                'dropped_newest': self.dropped_newest,
+                'dropped_oldest': self.dropped_oldest,
+                'queue_depth': self.queue.qsize(),
             }
 
-            # Відправляємо JSON дані
-            json_data = json.dumps(data).encode('utf-8')
-            client_socket.sendto(json_data, ('localhost', 5000))
-            client_socket.close()
+    def close(self, timeout=10):
+        """Обробка залишку черги та зупинка потоків"""
+        for _ in self.threads:
+            self.queue.put(self._STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _worker(self):
+        """Цикл потоку-обробника"""
+        while True:
+            args = self.queue.get()
+            if args is self._STOP:
+                return
+            self.handler(*args)
 
-            print(f"✅ Повідомлення відправлено на Socket-сервер: {username}")
 
-        except Exception as e:
-            print(f"❌ Помилка відправки на Socket-сервер: {e}")
+class StudyVaultHTTPServer(HTTPServer):
+    """HTTP сервер з обмеженим пулом потоків для з'єднань
+
+    Кожне з'єднання (разом з усіма keep-alive запитами) обслуговується
+    потоком з пулу; з'єднання понад ліміт чекають у черзі пулу.
+    """
+
+    # Черга listen(): після перезапуску всі клієнти стрічки подій
+    # перепідключаються одночасно, а 5 за замовчуванням - це SYN повтори
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, server_address, handler_class,
+                 max_workers=HTTP_MAX_WORKERS, routes=None,
+                 message_reader=None, search_index=None, materials=None,
+                 sse_hub=None, stats=None, reuse_port=False):
+        # SO_REUSEPORT: кілька процесів слухають один порт
+        self.allow_reuse_port = reuse_port
+        super().__init__(server_address, handler_class)
+        self.routes = routes if routes is not None else build_route_table()
+        self.message_reader = message_reader
+        self.search_index = search_index if search_index is not None \
+            else SearchIndex(path=None)
+        self.materials = materials
+        self.sse_hub = sse_hub
+        self.stats = stats
+        # З'єднання, передані SSEHub, після обробника не закриваються
+        self.detached = set()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        """Передача з'єднання в пул потоків"""
+        self.executor.submit(self.process_request_thread,
+                             request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """Обслуговування з'єднання в потоці пулу"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def detach(self, request):
+        """Передача з'єднання іншому власнику після обробника"""
+        self.detached.add(request)
+
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            return
+        super().shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.sse_hub is not None:
+            self.sse_hub.close()
 
 
 class StudyVaultSocketServer:
     """Socket сервер для обробки повідомлень та збереження в MongoDB"""
 
-    def __init__(self, host='localhost', port=5000):
+    def __init__(self, host='localhost', port=5000, collection=None,
+                 spool_dir=SPOOL_DIR, reuse_port=False, ingest_filter=None):
         self.host = host
         self.port = port
+        self.reuse_port = reuse_port
+        self.ingest_filter = ingest_filter if ingest_filter is not None \
+            else IngestFilter()
         self.mongodb_client = None
         self.database = None
-        self.collection = None
-        self.setup_mongodb()
+        self.collection = collection
+        self.writer = None
+        self.pool = None
+        self.frames = FrameCounters()
+        # Обробники збережених документів (інвалідація кешу тощо)
+        self.listeners = []
+        self.running = False
+        self.stopped = threading.Event()
+        if collection is None:
+            self.setup_mongodb()
+        # Журнал на диску приймає повідомлення й без MongoDB
+        self.writer = create_message_writer(
+            self.collection, self.listeners, spool_dir,
+            connect=connect_mongodb)
 
     def setup_mongodb(self):
         """Підключення до MongoDB"""
         try:
             # Підключення до MongoDB
-            mongodb_url = os.getenv(
-                'MONGODB_URL', 'mongodb://localhost:27017/')
-            self.mongodb_client = MongoClient(mongodb_url)
-            self.database = self.mongodb_client['studyvault']
-            self.collection = self.database['messages']
+            self.mongodb_client, self.database, self.collection = \
+                connect_mongodb()
 
-            print("✅ Підключено до MongoDB")
+            LOG.info('mongo.connected', "✅ Підключено до MongoDB")
 
         except Exception as e:
-            print(f"❌ Помилка підключення до MongoDB: {e}")
+            LOG.error('mongo.connect_failed',
+                      f"❌ Помилка підключення до MongoDB: {e}", error=str(e))
+
+    def reconnect_mongodb(self):
+        """Повторне підключення, якщо MongoDB була недоступна при старті"""
+        if self.database is None:
+            self.setup_mongodb()
+            # Без журналу буфера запису ще немає: він потребує колекції
+            if self.writer is None and self.collection is not None:
+                self.writer = MessageBatchWriter(self.collection,
+                                                 listeners=self.listeners)
+        return self.database is not None
 
     def start_server(self):
         """Запуск UDP сервера"""
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECV_BUFFER)
+        if self.reuse_port:
+            server_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         server_socket.bind((self.host, self.port))
+        # Таймаут дозволяє циклу помітити зупинку сервера
+        server_socket.settimeout(0.5)
+        self.pool = IngestWorkerPool(self.handle_message)
+        self.register_metrics()
+        self.running = True
+        self.stopped.clear()
 
-        print(f"🚀 Socket-сервер запущено на {self.host}:{self.port}")
+        LOG.info('udp.started',
+                 f"🚀 Socket-сервер запущено на {self.host}:{self.port}",
+                 host=self.host, port=self.port, mode='threaded')
 
-        while True:
+        while self.running:
             try:
                 # Отримує дані
-                data, client_address = server_socket.recvfrom(1024)
+                data, client_address = server_socket.recvfrom(MAX_DATAGRAM_SIZE)
+                METRICS.inc('studyvault_udp_datagrams_received_total')
+
+                # Адреса понад ліміт відкидається ще до черги пулу
+                if not self.ingest_filter.allow_datagram(client_address):
+                    continue
+
+                # Передає на обробку в пул потоків
+                self.pool.submit(data, client_address)
 
-                # Обробляє в окремому потоці
-                thread = threading.Thread(
-                    target=self.handle_message,
-                    args=(data, client_address)
-                )
-                thread.daemon = True
-                thread.start()
+            except socket.timeout:
+                continue
 
             except Exception as e:
-                print(f"❌ Помилка Socket-сервера: {e}")
+                LOG.error('udp.error', f"❌ Помилка Socket-сервера: {e}",
+                          error=str(e))
+
+        server_socket.close()
+        self.stopped.set()
+
+    def register_metrics(self):
+        """Метрики пулу обробки та декодування, що читаються при запиті"""
+        pool = self.pool
+        METRICS.register_callback('studyvault_ingest_queue_depth',
+                                  pool.queue.qsize)
+        METRICS.register_callback(
+            'studyvault_udp_datagrams_dropped_total',
+            lambda: [((('reason', 'queue_full_newest'),), pool.dropped_newest),
+                     ((('reason', 'queue_full_oldest'),), pool.dropped_oldest)])
+        register_frame_metrics(self.frames)
+
+    def stop_server(self):
+        """Зупинка UDP сервера із записом буфера в MongoDB"""
+        self.running = False
+        self.stopped.wait(2)
+
+        if self.pool is not None:
+            self.pool.close()
+            stats = self.pool.stats()
+            LOG.info(
+                'udp.pool_stats',
+                f"📊 Датаграм прийнято: {stats['accepted']}, "
+                f"відкинуто нових: {stats['dropped_newest']}, "
+                f"відкинуто старих: {stats['dropped_oldest']}", **stats)
+            LOG.info(
+                'udp.frame_stats',
+                f"📊 Некоректних кадрів: {self.frames.malformed}, "
+                f"завеликих кадрів: {self.frames.oversize}",
+                malformed=self.frames.malformed, oversize=self.frames.oversize)
+
+        if self.writer is not None:
+            self.writer.close()
+            LOG.info('writer.closed', "✅ Буфер повідомлень закрито")
 
     def handle_message(self, data, client_address):
-        """Обробка повідомлення"""
+        """Обробка датаграми з одним або кількома повідомленнями"""
         try:
-            # Декодує JSON дані
-            json_data = json.loads(data.decode('utf-8'))
+            # Декодує всі кадри датаграми
+            messages, malformed, oversize = decode_datagram(data)
+            self.frames.add(malformed, oversize)
+            messages = self.ingest_filter.accept(messages)
 
-            # Підготовка документу для MongoDB
-            document = {
-                'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'),
-                'username': json_data['username'],
-                'message': json_data['message']
-            }
+            for json_data in messages:
+                # Підготовка документу для MongoDB
+                document = create_message_document(json_data)
 
-            # Зберігає в MongoDB
-            if self.collection is not None:
-                result = self.collection.insert_one(document)
-                print(
-                    f"✅ Повідомлення збережено: {document['username']} - {result.inserted_id}")
-            else:
-                print("❌ MongoDB не доступна")
+                # Передає документ на пакетний запис в MongoDB
+                if self.writer is not None:
+                    self.writer.add(document)
+                else:
+                    LOG.error('mongo.unavailable', "❌ MongoDB не доступна")
 
         except Exception as e:
-            print(f"❌ Помилка обробки повідомлення: {e}")
-
-
-def create_message_html():
-    """Створення message.html"""
-    message_html_content = """<!DOCTYPE html>
-<html lang="uk">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>📬 Надіслати повідомлення - StudyVault</title>
-    <link rel="stylesheet" href="style.css">
-</head>
-<body>
-    <header>
-        <div class="header-content">
-            <h1>📬 Надіслати повідомлення</h1>
-            <p>Поділіться своєю думкою з іншими студентами</p>
-        </div>
-    </header>
-
-    <div class="container">
-        <div class="section">
-            <h2>✍️ Написати повідомлення</h2>
-
-            <!-- Повідомлення про успіх/помилку -->
-            <div id="message-status"></div>
-
-            <form action="/message" method="POST" class="message-form">
-                <div class="form-group">
-                    <label for="username" class="form-label">Ваше ім'я</label>
-                    <input
-                        type="text"
-                        id="username"
-                        name="username"
-                        class="form-input"
-                        placeholder="Введіть ваше ім'я..."
-                        required
-                    />
-                </div>
-
-                <div class="form-group">
-                    <label for="message" class="form-label">Повідомлення</label>
-                    <textarea
-                        id="message"
-                        name="message"
-                        class="form-input message-textarea"
-                        placeholder="Напишіть ваше повідомлення..."
-                        rows="4"
-                        required
-                    ></textarea>
-                </div>
-
-                <button type="submit" class="message-btn">📤 Надіслати повідомлення</button>
-            </form>
-
-            <a href="/" class="btn-secondary" style="display: inline-block; margin-top: 1rem;">
-                🏠 На головну
-            </a>
-        </div>
-    </div>
-
-    <script>
-        // Показуємо повідомлення про результат
-        const urlParams = new URLSearchParams(window.location.search);
-        const messageStatus = document.getElementById('message-status');
-
-        if (urlParams.get('success') === '1') {
-            messageStatus.innerHTML = '<div class="alert alert-success">✅ Повідомлення успішно надіслано!</div>';
-        } else if (urlParams.get('error') === '1') {
-            messageStatus.innerHTML = '<div class="alert alert-error">❌ Помилка: заповніть всі поля!</div>';
-        }
+            LOG.error('message.ingest_failed',
+                      f"❌ Помилка обробки повідомлення: {e}",
+                      client=client_address[0], error=str(e))
 
-        // Стилі для повідомлень
-        const style = document.createElement('style');
-        style.textContent = `
-            .alert {
-                padding: 1rem;
-                margin-bottom: 1rem;
-                border-radius: 8px;
-                font-weight: 600;
-            }
-            .alert-success {
-                background: #d4edda;
-                color: #155724;
-                border: 1px solid #c3e6cb;
-            }
-            .alert-error {
-                background: #f8d7da;
-                color: #721c24;
-                border: 1px solid #f5c6cb;
-            }
-        `;
-        document.head.appendChild(style);
-    </script>
-</body>
-</html>"""
-
-    with open('message.html', 'w', encoding='utf-8') as f:
-        f.write(message_html_content)
-    print("✅ Створено message.html")
-
-
-def create_error_html():
-    """Створення error.html для 404"""
-    error_html_content = """<!DOCTYPE html>
-<html lang="uk">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>❌ Помилка 404 - StudyVault</title>
-    <link rel="stylesheet" href="style.css">
-</head>
-<body>
-    <header>
-        <div class="header-content">
-            <h1>❌ Сторінка не знайдена</h1>
-            <p>Помилка 404 - Not Found</p>
-        </div>
-    </header>
-
-    <div class="container">
-        <div class="section" style="text-align: center;">
-            <h2>🔍 Сторінка не існує</h2>
-            <p style="font-size: 1.2rem; margin: 2rem 0;">
-                Вибачте, але запитувана сторінка не знайдена.
-            </p>
-
-            <div style="margin: 2rem 0;">
-                <a href="/" class="btn-primary" style="margin: 0.5rem;">🏠 На головну</a>
-                <a href="/message.html" class="btn-secondary" style="margin: 0.5rem;">📬 Повідомлення</a>
-            </div>
-
-            <div style="font-size: 3rem; margin: 2rem 0;">📚🔍❓</div>
-        </div>
-    </div>
-</body>
-</html>"""
-
-    with open('error.html', 'w', encoding='utf-8') as f:
-        f.write(error_html_content)
-    print("✅ Створено error.html")
-
-
-def create_logo_png():
-    """Створення логотипу logo.png"""
-    try:
-        from PIL import Image, ImageDraw, ImageFont
-        import random
-
-        # Створюємо зображення 128x128
-        img = Image.new('RGB', (128, 128), color='#000011')
-        draw = ImageDraw.Draw(img)
-
-        # Градієнт фону від темно-синього до фіолетового
-        for y in range(128):
-            # Градієнт від темно-синього до фіолетового
-            progress = y / 128
-            r = int(17 + (102 - 17) * progress)      # 11 -> 66 (hex)
-            g = int(17 + (30 - 17) * progress)       # 11 -> 1e
-            b = int(34 + (138 - 34) * progress)      # 22 -> 8a
-
-            # Додаємо трохи варіації
-            r += random.randint(-5, 5)
-            g += random.randint(-3, 3)
-            b += random.randint(-8, 8)
-
-            # Обмеження кольорів
-            r = max(0, min(255, r))
-            g = max(0, min(255, g))
-            b = max(0, min(255, b))
-
-            draw.line([(0, y), (128, y)], fill=(r, g, b))
-
-        # Додаємо зірки на фон
-        for _ in range(25):
-            x = random.randint(5, 123)
-            y = random.randint(5, 123)
-            size = random.randint(1, 2)
-            brightness = random.randint(180, 255)
-            draw.ellipse([x-size, y-size, x+size, y+size],
-                         fill=(brightness, brightness, brightness))
-
-        # Додаємо хрестики зірок
-        for _ in range(8):
-            x = random.randint(10, 118)
-            y = random.randint(10, 118)
-            brightness = random.randint(200, 255)
-            draw.line([(x-3, y), (x+3, y)], fill=(brightness,
-                      brightness, brightness), width=1)
-            draw.line([(x, y-3), (x, y+3)], fill=(brightness,
-                      brightness, brightness), width=1)
-            draw.line([(x-2, y-2), (x+2, y+2)],
-                      fill=(brightness, brightness, brightness), width=1)
-            draw.line([(x-2, y+2), (x+2, y-2)],
-                      fill=(brightness, brightness, brightness), width=1)
-
-        center_x, center_y = 64, 64
-
-        # Сяйво навколо книги
-        for radius in range(35, 25, -2):
-            alpha = int(50 - (35-radius)*3)
-            if alpha > 0:
-                glow_color = (102, 126, 234)  # #667eea
-                # Імітуємо прозорість через змішування кольорів
-                background_color = img.getpixel((center_x, center_y))
-                mixed_color = tuple(
-                    int(bg + (glow - bg) * alpha / 255)
-                    for bg, glow in zip(background_color, glow_color)
-                )
-                draw.ellipse([center_x-radius, center_y-radius,
-                              center_x+radius, center_y+radius],
-                             outline=mixed_color, width=1)
-
-        # Книга (основна форма)
-        book_width, book_height = 32, 24
-        book_left = center_x - book_width // 2
-        book_top = center_y - book_height // 2
-
-        # Тінь книги
-        draw.rectangle([book_left+2, book_top+2,
-                        book_left+book_width+2, book_top+book_height+2],
-                       fill=(0, 0, 20))
-
-        # Основа книги (білий фон)
-        draw.rectangle([book_left, book_top,
-                        book_left+book_width, book_top+book_height], fill=(245, 248, 255))
-
-        # Обкладинка книги (градієнт)
-        for i in range(book_height):
-            progress = i / book_height
-            r = int(102 + (118 - 102) * progress)  # 667eea -> 764ba2
-            g = int(126 + (75 - 126) * progress)
-            b = int(234 + (162 - 234) * progress)
-
-            draw.line([(book_left, book_top + i),
-                      (book_left + book_width, book_top + i)],
-                      fill=(r, g, b))
-
-        # Лінії тексту на книзі
-        line_color = (255, 255, 255, 200)
-        for i, offset in enumerate([6, 10, 14, 18]):
-            line_width = book_width - 8 - i * 2
-            draw.line([(book_left + 4, book_top + offset),
-                      (book_left + 4 + line_width, book_top + offset)],
-                      fill=(255, 255, 255), width=1)
-
-        # Закладка
-        bookmark_x = book_left + book_width - 2
-        draw.rectangle([bookmark_x, book_top,
-                        bookmark_x + 4, book_top + book_height + 6],
-                       fill=(72, 187, 120))
-        # Кінчик закладки
-        draw.polygon([bookmark_x, book_top + book_height + 6,
-                      bookmark_x + 4, book_top + book_height + 6,
-                      bookmark_x + 2, book_top + book_height + 10],
-                     fill=(56, 161, 105))
-
-        # Символи "SV" під книгою
-        try:
-            font_size = 16
+
+class StudyVaultDatagramProtocol(asyncio.DatagramProtocol):
+    """Протокол прийому UDP датаграм для asyncio сервера"""
+
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.handle_message(data, addr)
+
+    def error_received(self, exc):
+        LOG.error('udp.error', f"❌ Помилка Socket-сервера: {exc}",
+                  error=str(exc))
+
+
+class StudyVaultAsyncSocketServer:
+    """Socket сервер на asyncio: один event loop замість пулу потоків
+
+    Датаграми обробляються прямо в event loop, а пакети документів
+    записуються через insert_many в окремому executor для pymongo.
+    Формат документів той самий, що й у StudyVaultSocketServer.
+    """
+
+    def __init__(self, host='localhost', port=5000, collection=None,
+                 batch_size=MONGO_BATCH_SIZE,
+                 flush_interval_ms=MONGO_FLUSH_INTERVAL_MS,
+                 buffer_size=MONGO_BUFFER_SIZE,
+                 executor_workers=MONGO_EXECUTOR_WORKERS,
+                 spool_dir=SPOOL_DIR, reuse_port=False, ingest_filter=None):
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self.ingest_filter = ingest_filter if ingest_filter is not None \
+            else IngestFilter()
+        self.mongodb_client = None
+        self.database = None
+        self.collection = collection
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000
+        self.buffer_size = buffer_size
+        self.executor_workers = max(1, executor_workers)
+
+        self.loop = None
+        self.batch = []
+        self.flush_handle = None
+        self.pending = set()
+        self.stop_event = None
+        self.dropped = 0
+        self.frames = FrameCounters()
+        self.listeners = []
+        self.running = False
+        self.stopped = threading.Event()
+
+        if collection is None:
+            self.setup_mongodb()
+        # З журналом документи пишуться на диск, а в MongoDB - його дренажником
+        self.spool = MessageSpool(
+            self.collection, path=spool_dir, listeners=self.listeners,
+            connect=connect_mongodb) if spool_dir else None
+
+    def setup_mongodb(self):
+        """Підключення до MongoDB"""
+        try:
+            self.mongodb_client, self.database, self.collection = \
+                connect_mongodb()
+            LOG.info('mongo.connected', "✅ Підключено до MongoDB")
+
+        except Exception as e:
+            LOG.error('mongo.connect_failed',
+                      f"❌ Помилка підключення до MongoDB: {e}", error=str(e))
+
+    def reconnect_mongodb(self):
+        """Повторне підключення, якщо MongoDB була недоступна при старті"""
+        if self.database is None:
+            self.setup_mongodb()
+        return self.database is not None
+
+    def start_server(self):
+        """Запуск UDP сервера у власному event loop"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """Основна корутина сервера"""
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.executor_workers,
+            thread_name_prefix='mongo-executor')
+        self.stopped.clear()
+
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: StudyVaultDatagramProtocol(self),
+            local_addr=(self.host, self.port),
+            reuse_port=self.reuse_port or None)
+        transport.get_extra_info('socket').setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECV_BUFFER)
+        METRICS.register_callback('studyvault_mongo_write_buffer_depth',
+                                  lambda: len(self.batch))
+        METRICS.register_callback(
+            'studyvault_udp_datagrams_dropped_total',
+            lambda: [((('reason', 'buffer_full'),), self.dropped)])
+        register_frame_metrics(self.frames)
+        self.running = True
+
+        LOG.info(
+            'udp.started',
+            f"🚀 Socket-сервер (asyncio) запущено на {self.host}:{self.port}",
+            host=self.host, port=self.port, mode='asyncio')
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            transport.close()
+            self.flush(force=True)
+            if self.pending:
+                await asyncio.wait(list(self.pending))
+            self.executor.shutdown(wait=True)
+            self.running = False
+            self.stopped.set()
+
+    def stop_server(self):
+        """Зупинка сервера із записом буфера в MongoDB"""
+        if self.loop is not None and self.running:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+            self.stopped.wait(10)
+            LOG.info('writer.closed', "✅ Буфер повідомлень записано в MongoDB")
+        if self.spool is not None:
+            self.spool.close()
+        if self.dropped:
+            LOG.info('udp.pool_stats',
+                     f"📊 Відкинуто повідомлень через переповнення: "
+                     f"{self.dropped}", dropped=self.dropped)
+        LOG.info(
+            'udp.frame_stats',
+            f"📊 Некоректних кадрів: {self.frames.malformed}, "
+            f"завеликих кадрів: {self.frames.oversize}",
+            malformed=self.frames.malformed, oversize=self.frames.oversize)
+
+    def handle_message(self, data, client_address):
+        """Обробка датаграми в event loop"""
+        METRICS.inc('studyvault_udp_datagrams_received_total')
+        if not self.ingest_filter.allow_datagram(client_address):
+            return
+        try:
+            messages, malformed, oversize = decode_datagram(data)
+            self.frames.add(malformed, oversize)
+            documents = [create_message_document(m)
+                         for m in self.ingest_filter.accept(messages)]
+
+        except Exception as e:
+            LOG.error('message.ingest_failed',
+                      f"❌ Помилка обробки повідомлення: {e}",
+                      client=client_address[0], error=str(e))
+            return
+
+        if not documents:
+            return
+
+        if self.spool is not None:
+            for document in documents:
+                self.spool.add(document)
+            return
+
+        if self.collection is None:
+            LOG.error('mongo.unavailable', "❌ MongoDB не доступна")
+            return
+
+        # Якщо всі executor-потоки зайняті і буфер заповнений - відкидаємо
+        free = self.buffer_size - len(self.batch)
+        if free < len(documents):
+            self.dropped += len(documents) - max(0, free)
+            documents = documents[:max(0, free)]
+
+        self.batch.extend(documents)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(
+                self.flush_interval, self.flush)
+
+    def flush(self, force=False):
+        """Передача накопиченого пакета в executor"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if not self.batch:
+            return
+
+        # Всі потоки executor зайняті - пакет піде після завершення попереднього
+        if not force and len(self.pending) >= self.executor_workers:
+            return
+
+        batch, self.batch = self.batch, []
+        future = self.loop.run_in_executor(
+            self.executor, insert_message_batch, self.collection, batch,
+            self.listeners)
+        self.pending.add(future)
+        future.add_done_callback(self._batch_done)
+
+    def _batch_done(self, future):
+        """Після запису пакета відправляє те, що накопичилось за цей час"""
+        self.pending.discard(future)
+        if self.batch:
+            self.flush()
+
+
+def create_socket_server(host='localhost', port=5000, collection=None,
+                         mode=SOCKET_SERVER_MODE, spool_dir=SPOOL_DIR,
+                         reuse_port=False, ingest_filter=None):
+    """Створення Socket-сервера у вибраному режимі"""
+    if mode == 'threaded':
+        return StudyVaultSocketServer(host, port, collection,
+                                      spool_dir=spool_dir,
+                                      reuse_port=reuse_port,
+                                      ingest_filter=ingest_filter)
+    if mode == 'asyncio':
+        return StudyVaultAsyncSocketServer(host, port, collection,
+                                           spool_dir=spool_dir,
+                                           reuse_port=reuse_port,
+                                           ingest_filter=ingest_filter)
+    raise ValueError(f"Невідомий режим Socket-сервера: {mode}")
+
+
+class WorkerSupervisor:
+    """Запуск кількох процесів з серверами та перезапуск тих, що впали
+
+    Кожен процес відкриває HTTP та UDP порти з SO_REUSEPORT, тож ядро
+    розподіляє між ними з'єднання й датаграми, а кожен процес має свій
+    GIL і свій MongoClient. По SIGTERM/SIGINT процеси отримують SIGTERM і
+    завершуються штатно; ті, що не встигли за shutdown_timeout, - SIGKILL.
+    """
+
+    RESTART_MIN_DELAY = 1
+    RESTART_MAX_DELAY = 30
+    # Процес, що впав раніше, вважається таким, що падає при старті
+    MIN_UPTIME = 5
+
+    def __init__(self, workers, target,
+                 shutdown_timeout=SERVER_SHUTDOWN_TIMEOUT):
+        self.workers = workers
+        self.target = target
+        self.shutdown_timeout = shutdown_timeout
+        # pid -> (номер воркера, час запуску)
+        self.children = {}
+        # номер воркера -> час запланованого перезапуску
+        self.restarts = {}
+        # номер воркера -> остання пауза перед перезапуском
+        self.delays = {}
+        self.stopping = False
+
+    def run(self):
+        """Запуск воркерів і нагляд до сигналу зупинки"""
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+
+        while not self.stopping:
+            self.reap()
+            now = time.monotonic()
+            for worker_id, restart_at in list(self.restarts.items()):
+                if now >= restart_at:
+                    del self.restarts[worker_id]
+                    self.spawn(worker_id)
+            time.sleep(0.2)
+
+        self.shutdown()
+
+    def request_stop(self, signum, frame):
+        self.stopping = True
+
+    def spawn(self, worker_id):
+        """Запуск процесу воркера через fork"""
+        # Потік запису логу не має тримати stdout у момент fork
+        LOG.flush()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            # Дочірній процес: сигнали зупинки - як Ctrl+C у run_worker
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            code = 0
             try:
-                font = ImageFont.truetype(
-                    "/System/Library/Fonts/Helvetica.ttc", font_size)
-            except:
-                try:
-                    font = ImageFont.truetype("arial.ttf", font_size)
-                except:
-                    font = ImageFont.load_default()
+                self.target(worker_id)
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                LOG.error('worker.failed',
+                          f"❌ Воркер {worker_id} завершився з помилкою: {e}",
+                          worker=worker_id, error=str(e))
+                code = 1
+            finally:
+                LOG.flush()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        self.children[pid] = (worker_id, time.monotonic())
+        LOG.info('worker.started', f"👷 Воркер {worker_id} запущено (pid {pid})",
+                 worker=worker_id, worker_pid=pid)
+
+    def reap(self):
+        """Обробка завершених процесів і планування перезапуску"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            worker_id, started = self.children.pop(pid)
+            if self.stopping:
+                continue
+
+            # Воркер, що падає при старті, перезапускається з паузою,
+            # що подвоюється, аби не крутити fork в циклі
+            if time.monotonic() - started < self.MIN_UPTIME:
+                delay = min(self.delays.get(worker_id, 0) * 2 or
+                            self.RESTART_MIN_DELAY, self.RESTART_MAX_DELAY)
+            else:
+                delay = 0
+            self.delays[worker_id] = delay
+            self.restarts[worker_id] = time.monotonic() + delay
+            code = os.waitstatus_to_exitcode(status)
+            LOG.error('worker.exited',
+                      f"❌ Воркер {worker_id} (pid {pid}) завершився з кодом "
+                      f"{code}, перезапуск через {delay} с",
+                      worker=worker_id, worker_pid=pid, code=code,
+                      restart_delay=delay)
 
-            text = "SV"
-            # Розрахунок позиції для центрування
-            bbox = draw.textbbox((0, 0), text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
+    def shutdown(self):
+        """Штатна зупинка всіх воркерів"""
+        LOG.info('worker.stopping',
+                 f"🛑 Зупинка воркерів: {len(self.children)}",
+                 workers=len(self.children))
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for pid, (worker_id, _) in list(self.children.items()):
+            LOG.error('worker.killed',
+                      f"❌ Воркер {worker_id} не зупинився вчасно, SIGKILL",
+                      worker=worker_id, worker_pid=pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.clear()
 
-            text_x = center_x - text_width // 2
-            text_y = center_y + book_height // 2 + 8
 
-            # Тінь тексту
-            draw.text((text_x + 1, text_y + 1), text,
-                      fill=(0, 0, 50), font=font)
-            # Основний текст
-            draw.text((text_x, text_y), text, fill=(255, 255, 255), font=font)
+def ensure_indexes(message_reader, materials, stats):
+    """Створення індексів повідомлень, матеріалів і статистики
 
+    Повертає False, якщо MongoDB недоступна і створення варто повторити.
+    """
+    available = True
+    for store, collection, label in (
+            (message_reader, 'messages', 'повідомлень'),
+            (materials, 'materials', 'матеріалів'),
+            (stats, 'stats', 'статистики')):
+        try:
+            store.ensure_indexes()
         except Exception as e:
-            # Fallback - малюємо букви вручну простими лініями
-            # S
-            draw.line([(center_x - 10, center_y + 18), (center_x - 5, center_y + 18)],
-                      fill=(255, 255, 255), width=2)
-            draw.line([(center_x - 10, center_y + 18), (center_x - 10, center_y + 21)],
-                      fill=(255, 255, 255), width=2)
-            draw.line([(center_x - 10, center_y + 21), (center_x - 5, center_y + 21)],
-                      fill=(255, 255, 255), width=2)
-            draw.line([(center_x - 5, center_y + 21), (center_x - 5, center_y + 24)],
-                      fill=(255, 255, 255), width=2)
-            draw.line([(center_x - 10, center_y + 24), (center_x - 5, center_y + 24)],
-                      fill=(255, 255, 255), width=2)
-
-            # V
-            draw.line([(center_x + 2, center_y + 18), (center_x + 5, center_y + 24)],
-                      fill=(255, 255, 255), width=2)
-            draw.line([(center_x + 8, center_y + 18), (center_x + 5, center_y + 24)],
-                      fill=(255, 255, 255), width=2)
-
-        for _ in range(12):
-            angle = random.random() * 3.14159 * 2
-            distance = random.randint(20, 35)
-            px = int(center_x + distance * (angle % 1))
-            py = int(center_y + distance * ((angle * 1.3) % 1))
-
-            if 5 <= px <= 123 and 5 <= py <= 123:
-                brightness = random.randint(150, 255)
-                size = random.randint(1, 2)
-                draw.ellipse([px-size, py-size, px+size, py+size],
-                             fill=(brightness, brightness, brightness))
-
-        img.save('logo.png')
-        print("✅ Створено красивий космічний логотип StudyVault")
-
-        # Копіюємо в static
-        try:
-            import shutil
-            shutil.copy('logo.png', 'static/logo.png')
-            print("✅ Логотип скопійовано в static/")
-        except:
-            pass
+            LOG.error('indexes.failed',
+                      f"❌ Не вдалося створити індекси {label}: {e}",
+                      collection=collection, error=str(e))
+            if isinstance(e, ConnectionFailure):
+                available = False
+    return available
 
-    except ImportError:
-        print("⚠️ PIL недоступна, створюємо простий логотип...")
-        # Fallback версія
-        simple_png_data = bytes([
-            137, 80, 78, 71, 13, 10, 26, 10, 0, 0, 0, 13, 73, 72, 68, 82,
-            0, 0, 0, 128, 0, 0, 0, 128, 8, 2, 0, 0, 0, 233, 178, 81,
-            130, 0, 0, 0, 25, 73, 68, 65, 84, 120, 156, 99, 100, 96, 248,
-            79, 193, 128, 137, 129, 129, 37, 0, 0, 14, 48, 1, 225, 39, 222,
-            252, 232, 0, 0, 0, 0, 73, 69, 78, 68, 174, 66, 96, 130
-        ])
-
-        with open('logo.png', 'wb') as f:
-            f.write(simple_png_data)
-        print("✅ Створено базовий логотип")
 
-    except Exception as e:
-        print(f"❌ Помилка створення логотипу: {e}")
-        # Створюємо мінімальний файл
-        with open('logo.png', 'wb') as f:
-            f.write(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS\xde\x00\x00\x00\x0cIDATx\x9cc```\x00\x00\x00\x04\x00\x01\xdd\xcc\xdb\x27\x00\x00\x00\x00IEND\xaeB`\x82')
-        print("✅ Створено мінімальний логотип")
+def attach_storage(socket_server, http_server):
+    """Підключення API, матеріалів і статистики до MongoDB
 
+    Воркер, що стартував без MongoDB (MONGO_FAIL_FAST=0), повторює
+    підключення та створення індексів з наростаючою паузою: до того
+    /api/messages, матеріали та /api/stats відповідають 503, а після -
+    працюють без перезапуску.
+    """
+    delay = MessageSpool.RETRY_MIN_DELAY
+    while not socket_server.reconnect_mongodb():
+        time.sleep(delay)
+        delay = min(delay * 2, MessageSpool.RETRY_MAX_DELAY)
 
-def main():
-    """Головна функція - запуск обох серверів"""
-    print("🚀 Запуск StudyVault - Гібридний сервер")
+    reader = http_server.message_reader
+    reader.collection = socket_server.collection
+    # Файли матеріалів у GridFS тієї ж бази
+    materials = MaterialStore(socket_server.database)
+    # Лічильники /api/stats оновлюються з тих самих listeners
+    stats = StatsCounter(socket_server.database, socket_server.collection)
+    socket_server.listeners.append(stats.add_messages)
+    materials.listeners.append(stats.add_material)
+    http_server.materials = materials
+    http_server.stats = stats
+
+    delay = MessageSpool.RETRY_MIN_DELAY
+    while not ensure_indexes(reader, materials, stats):
+        time.sleep(delay)
+        delay = min(delay * 2, MessageSpool.RETRY_MAX_DELAY)
+
+
+def run_worker(worker_id=None):
+    """Запуск Socket та HTTP серверів в одному процесі
 
-    # Створюємо необхідні файли ТІЛЬКИ якщо їх немає
-    if not os.path.exists('templates/message.html'):
-        create_message_html()
-    if not os.path.exists('templates/error.html') and not os.path.exists('error.html'):
-        create_error_html()
-    if not os.path.exists('logo.png'):
-        create_logo_png()
+    worker_id задається supervisor'ом: порти відкриваються з
+    SO_REUSEPORT, а журнал повідомлень у кожного воркера свій.
+    """
+    # docker stop надсилає SIGTERM - зупиняємося так само, як по Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    reuse_port = worker_id is not None
+    spool_dir = SPOOL_DIR
+    if SPOOL_DIR and worker_id is not None:
+        spool_dir = os.path.join(SPOOL_DIR, f'worker-{worker_id}')
+    if worker_id is not None:
+        METRICS.labels = (('worker', str(worker_id)),)
 
     # Запуск Socket-сервера в окремому потоці
-    socket_server = StudyVaultSocketServer()
-    socket_thread = threading.Thread(target=socket_server.start_server)
+    socket_server = create_socket_server(
+        port=SOCKET_SERVER_PORT, spool_dir=spool_dir, reuse_port=reuse_port)
+    socket_thread = threading.Thread(target=socket_server.start_server,
+                                     name='udp-server')
     socket_thread.daemon = True
     socket_thread.start()
 
+    # Читання повідомлень для API працює з тією ж колекцією;
+    # кеш сторінок інвалідується після кожного запису в MongoDB
+    # (записи інших воркерів - з опитування MessageFeed)
+    message_reader = MessageReader(socket_server.collection)
+    socket_server.listeners.append(message_reader.cache.invalidate)
+
+    # Стрічка подій: повідомлення всіх воркерів з MongoDB, власні -
+    # одразу після запису
+    sse_hub = SSEHub()
+    sse_feed = MessageFeed(message_reader, sse_hub)
+    socket_server.listeners.append(sse_feed.publish)
+
     # Запуск HTTP-сервера на порту 3000
-    http_server = HTTPServer(('localhost', 3000), StudyVaultHTTPHandler)
-    print("🌐 HTTP-сервер запущено на http://localhost:3000")
+    http_server = StudyVaultHTTPServer(
+        (HTTP_HOST, HTTP_PORT), StudyVaultHTTPHandler,
+        message_reader=message_reader,
+        search_index=SearchIndex().load(),
+        sse_hub=sse_hub,
+        reuse_port=reuse_port)
+
+    # /metrics лише цього воркера: Prometheus опитує кожен порт окремо
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_routes = RouteTable()
+        metrics_routes.add_handler('GET', '/metrics', 'handle_metrics')
+        metrics_port = METRICS_PORT + (worker_id or 0)
+        metrics_server = StudyVaultHTTPServer(
+            (HTTP_HOST, metrics_port), StudyVaultHTTPHandler, max_workers=2,
+            routes=metrics_routes)
+        threading.Thread(target=metrics_server.serve_forever,
+                         name='metrics-http', daemon=True).start()
+
+    # Матеріали, статистика та індекси підключаються у фоні:
+    # недоступна MongoDB не затримує старт
+    threading.Thread(target=attach_storage, args=(socket_server, http_server),
+                     name='mongo-attach', daemon=True).start()
+    LOG.info('http.started',
+             f"🌐 HTTP-сервер запущено на http://{HTTP_HOST}:{HTTP_PORT}",
+             host=HTTP_HOST, port=HTTP_PORT)
 
     try:
         http_server.serve_forever()
     except KeyboardInterrupt:
-        print("\n🛑 Сервер зупинено")
+        LOG.info('http.stopped', "🛑 Сервер зупинено")
         http_server.server_close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        socket_server.stop_server()
+        sse_feed.close()
+        if http_server.stats is not None:
+            http_server.stats.close()
+
+
+def main():
+    """Головна функція - запуск обох серверів"""
+    LOG.info('server.starting', "🚀 Запуск StudyVault - Гібридний сервер")
+
+    # Неправильний профіль надійності - помилка конфігурації, а не збій
+    message_write_concern()
+    # Перевірка до fork: воркери створюють власні MongoClient
+    if check_mongodb():
+        LOG.info('mongo.available',
+                 f"✅ MongoDB доступна, надійність запису: {MONGO_DURABILITY}",
+                 durability=MONGO_DURABILITY)
+    elif MONGO_FAIL_FAST:
+        LOG.error('server.aborted', "🛑 Запуск скасовано (MONGO_FAIL_FAST=1)")
+        sys.exit(1)
+    else:
+        LOG.warning('server.degraded',
+                    "⚠️ Запуск без MongoDB: повідомлення чекатимуть у журналі")
+
+    # Логотип, шаблони та хешовані файли готує build_assets.py
+    # (у Docker - на етапі збірки образу), сервер нічого не генерує
+    if not os.path.exists(os.path.join(ASSETS_BUILD_DIR, 'manifest.json')):
+        LOG.warning('assets.missing',
+                    "⚠️ Збірку статики не знайдено, запустіть: "
+                    "python build_assets.py")
+
+    workers = SERVER_WORKERS or os.cpu_count() or 1
+    if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        LOG.warning('server.single_worker',
+                    "❌ SO_REUSEPORT не підтримується, запуск одного процесу")
+        workers = 1
+
+    if workers == 1:
+        run_worker()
+    else:
+        # fork до створення потоків і MongoClient: кожен воркер має власні
+        WorkerSupervisor(workers, run_worker).run()
 
 
 if __name__ == "__main__":
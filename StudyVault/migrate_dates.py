@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Перетворення рядкових дат повідомлень у BSON datetime
+
+Старі документи мають date у вигляді рядка '%Y-%m-%d %H:%M:%S.%f'
+(локальний час сервера). Інструмент проходить колекцію пакетами за _id,
+показує прогрес і зберігає позицію в checkpoint, тож перерваний запуск
+продовжується з місця зупинки.
+
+    # Перетворення на місці
+    python migrate_dates.py
+
+    # Копія в нову time-series колекцію (username - metaField)
+    python migrate_dates.py --target messages_ts --timeseries
+    # після чого: MESSAGES_COLLECTION=messages_ts MESSAGES_TIMESERIES=1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from main import (
+    DUPLICATE_KEY_ERROR, MESSAGES_COLLECTION, TIMESERIES_OPTIONS,
+    connect_mongodb, ensure_timeseries_collection, is_timeseries_collection,
+    missing_documents,
+)
+
+
+def parse_legacy_date(value, assume_utc):
+    """Рядкова дата старого формату як datetime в UTC (None, якщо не розібрати)"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        # Старий сервер писав datetime.now() - локальний час
+        parsed = parsed.replace(tzinfo=timezone.utc) if assume_utc \
+            else parsed.astimezone()
+    return parsed.astimezone(timezone.utc)
+
+
+def load_checkpoint(path, source, target):
+    """Позиція попереднього запуску для тієї ж пари колекцій"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None, 0
+
+    if checkpoint.get('source') != source or checkpoint.get('target') != target:
+        print(f"⚠️  Checkpoint {path} належить іншій міграції, починаємо спочатку")
+        return None, 0
+    return ObjectId(checkpoint['last_id']), checkpoint.get('processed', 0)
+
+
+def save_checkpoint(path, source, target, last_id, processed):
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump({'source': source, 'target': target,
+                   'last_id': str(last_id), 'processed': processed}, f)
+    os.replace(temporary, path)
+
+
+def convert_batch(documents, assume_utc):
+    """Документи з datetime замість рядкових дат і кількість нерозібраних"""
+    converted = []
+    failed = 0
+    for document in documents:
+        if isinstance(document.get('date'), str):
+            date = parse_legacy_date(document['date'], assume_utc)
+            if date is None:
+                failed += 1
+                continue
+            document['date'] = date
+        converted.append(document)
+    return converted, failed
+
+
+def write_batch(source, target, documents, in_place, timeseries=False):
+    """Запис пакета: $set date на місці або insert у нову колекцію
+
+    Time-series колекція не повідомляє про дублікати _id, тож пакет,
+    записаний перед обривом попереднього запуску, відсіюється запитом.
+    """
+    if timeseries:
+        documents = missing_documents(target, documents)
+    if not documents:
+        return
+    if in_place:
+        # Умова на старе значення не перезапише документ, змінений паралельно
+        source.bulk_write([
+            UpdateOne({'_id': d['_id'], 'date': {'$type': 'string'}},
+                      {'$set': {'date': d['date']}})
+            for d in documents
+        ], ordered=False)
+        return
+
+    try:
+        target.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Пакет, записаний перед обривом попереднього запуску
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+
+
+def migrate(args):
+    client, database, _ = connect_mongodb()
+    source = database[args.source]
+    target_name = args.target or args.source
+    in_place = target_name == args.source
+    target = database[target_name]
+
+    if args.timeseries:
+        if in_place:
+            print("❌ Існуючу колекцію не можна перетворити на time-series; "
+                  "вкажіть --target")
+            return 1
+        ensure_timeseries_collection(database, target_name)
+    timeseries = not in_place and \
+        is_timeseries_collection(database, target_name)
+
+    last_id, processed = load_checkpoint(
+        args.checkpoint, args.source, target_name)
+    if last_id is not None:
+        print(f"↩️  Продовження після _id {last_id} ({processed} оброблено)")
+
+    # На місці достатньо пройти лише документи з рядковою датою
+    query = {'date': {'$type': 'string'}} if in_place else {}
+    remaining = source.count_documents(
+        dict(query, _id={'$gt': last_id}) if last_id else query)
+    total = processed + remaining
+    print(f"🔄 {args.source} -> {target_name}: до обробки {remaining} документів")
+
+    failed = 0
+    started = time.monotonic()
+    done_now = 0
+    while True:
+        batch_query = dict(query, _id={'$gt': last_id}) if last_id else query
+        documents = list(source.find(
+            batch_query, sort=[('_id', 1)], limit=args.batch_size))
+        if not documents:
+            break
+
+        last_id = documents[-1]['_id']
+        converted, batch_failed = convert_batch(documents, args.assume_utc)
+        write_batch(source, target, converted, in_place, timeseries)
+        failed += batch_failed
+        processed += len(documents)
+        done_now += len(documents)
+        save_checkpoint(args.checkpoint, args.source, target_name,
+                        last_id, processed)
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        rate = done_now / elapsed
+        eta = (total - processed) / rate if rate else 0
+        percent = processed / total * 100 if total else 100
+        print(f"\r⏳ {processed}/{total} ({percent:.1f}%), "
+              f"{rate:.0f} док./с, залишилось ~{eta:.0f} с",
+              end='', flush=True)
+
+    print()
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    if failed:
+        print(f"⚠️  Не вдалося розібрати дату в {failed} документах, "
+              f"їх залишено без змін")
+    print(f"✅ Міграцію завершено: {processed} документів")
+    client.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=MESSAGES_COLLECTION,
+                        help='колекція з рядковими датами')
+    parser.add_argument('--target',
+                        help='нова колекція (за замовчуванням - на місці)')
+    parser.add_argument('--timeseries', action='store_true',
+                        help='створити --target як time-series колекцію '
+                             f'(metaField {TIMESERIES_OPTIONS["metaField"]})')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--checkpoint', default='data/migrate_dates.json',
+                        help='файл позиції для продовження')
+    parser.add_argument('--assume-utc', action='store_true',
+                        help='рядкові дати записані в UTC, а не в '
+                             'локальному часі')
+    args = parser.parse_args()
+
+    directory = os.path.dirname(args.checkpoint)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    sys.exit(migrate(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,15 +10,19 @@ db.createCollection('messages');
 db.messages.createIndex({ "date": -1 });
 db.messages.createIndex({ "username": 1 });
 
-// Додавання тестових даних
+// Індекси для keyset-пагінації API (/api/messages)
+db.messages.createIndex({ "date": -1, "_id": -1 });
+db.messages.createIndex({ "username": 1, "date": -1, "_id": -1 });
+
+// Додавання тестових даних (date - BSON datetime в UTC)
 db.messages.insertMany([
     {
-        "date": "2024-08-14 18:00:00.000000",
+        "date": new Date("2024-08-14T18:00:00Z"),
         "username": "admin",
         "message": "Ласкаво просимо до StudyVault! 🎉"
     },
     {
-        "date": "2024-08-14 18:01:00.000000",
+        "date": new Date("2024-08-14T18:01:00Z"),
         "username": "system",
         "message": "База даних MongoDB успішно ініціалізована ✅"
     }
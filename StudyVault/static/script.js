@@ -130,6 +130,7 @@ async function uploadFile() {
       };
 
       storage.saveFile(fileData);
+      uploadToServer(file, categorySelect.value);
       successCount++;
     } catch (error) {
       console.error("❌ Помилка при завантаженні файлу:", file.name, error);
@@ -146,6 +147,19 @@ async function uploadFile() {
   }
 }
 
+// Копія файлу на сервері (GridFS); без сервера лишається тільки localStorage
+function uploadToServer(file, category) {
+  const params = new URLSearchParams({ filename: file.name, category });
+  fetch(`/api/materials/upload?${params}`, {
+    method: "POST",
+    headers: { "Content-Type": file.type || "application/octet-stream" },
+    body: file,
+  })
+    .then((response) => response.json())
+    .then((result) => console.log("☁️ Файл збережено на сервері:", result))
+    .catch((error) => console.warn("⚠️ Файл не збережено на сервері:", error));
+}
+
 // Читання вмісту файлу
 function readFileContent(file) {
   return new Promise((resolve, reject) => {
@@ -502,4 +516,16 @@ function showStats() {
     "Розмір в localStorage:",
     formatBytes(JSON.stringify(files).length)
   );
+
+  // Статистика сервера з лічильників, без перебору колекцій
+  fetch("/api/stats")
+    .then((response) => (response.ok ? response.json() : null))
+    .then((stats) => {
+      if (!stats) return;
+      console.log("Повідомлень на сервері:", stats.messages.total);
+      console.log("Найактивніші користувачі:", stats.messages.top_users);
+      console.log("Матеріалів на сервері:", stats.materials.total);
+      console.log("По категоріях на сервері:", stats.materials.per_category);
+    })
+    .catch(() => {});
 }
@@ -0,0 +1,72 @@
+"""Збірка статики: сторінки посилаються на хешовані файли /assets/"""
+
+import contextlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import build_assets
+import main
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class BuildAssetsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.base_dir = tempfile.mkdtemp(prefix='studyvault-build-')
+        for folder in ('templates', 'static'):
+            shutil.copytree(os.path.join(SOURCE_DIR, folder),
+                            os.path.join(cls.base_dir, folder))
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.manifest = build_assets.build(cls.base_dir, 'dist')
+        with mock.patch.object(main, 'ASSETS_BUILD_DIR', 'dist'):
+            cls.routes = main.build_route_table(cls.base_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.base_dir, ignore_errors=True)
+
+    def built_page(self, filename):
+        path = os.path.join(self.base_dir, 'dist', 'templates', filename)
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+
+    def test_pages_reference_hashed_assets(self):
+        for filename in ('index.html', 'message.html', 'error.html'):
+            stem = os.path.splitext(filename)[0]
+            html = self.built_page(filename)
+
+            self.assertIn(self.manifest['logo.png'], html)
+            self.assertIn(self.manifest[stem + '.css'], html)
+            self.assertIn(self.manifest[stem + '.js'], html)
+            self.assertNotIn('<style>', html)
+            self.assertNotIn('<script>', html)
+
+    def test_pages_served_from_build(self):
+        route = self.routes.resolve('GET', '/')
+
+        self.assertEqual(route.file_path, os.path.join(
+            self.base_dir, 'dist', 'templates', 'index.html'))
+
+    def test_hashed_assets_are_immutable(self):
+        html = self.built_page('index.html')
+        urls = re.findall(r'(?:href|src)="(/assets/[^"]+)"', html)
+
+        self.assertEqual(len(urls), 3)
+        for url in urls:
+            self.assertRegex(url, r'^/assets/\w+\.[0-9a-f]{12}\.\w+$')
+            route = self.routes.resolve('GET', url)
+            self.assertIsNotNone(route, url)
+            self.assertTrue(os.path.isfile(route.file_path))
+            self.assertEqual(route.cache_control,
+                             main.IMMUTABLE_CACHE_CONTROL)
+
+
+if __name__ == '__main__':
+    unittest.main()
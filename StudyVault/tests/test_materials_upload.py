@@ -0,0 +1,92 @@
+"""Завантаження матеріалів multipart на keep-alive з'єднанні"""
+
+import http.client
+import threading
+import unittest
+
+from bson import ObjectId
+
+import main
+
+
+class FakeMaterialStore:
+    """MaterialStore без GridFS: зберігає лише метадані"""
+
+    def __init__(self):
+        self.listeners = []
+        self.saved = []
+
+    def save(self, filename, pieces, content_type='', category=''):
+        length = sum(len(piece) for piece in pieces)
+        if callable(category):
+            category = category()
+        document = {'_id': ObjectId(), 'filename': filename, 'length': length,
+                    'metadata': {'sha256': '', 'category': category,
+                                 'contentType': content_type}}
+        self.saved.append(document)
+        return document, False
+
+
+def multipart_body(boundary, content, category):
+    """Форма з полем category після файлу та епілогом"""
+    return (f'--{boundary}\r\n'
+            'Content-Disposition: form-data; name="file"; '
+            'filename="notes.bin"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').encode() + \
+        content + \
+        (f'\r\n--{boundary}\r\n'
+         'Content-Disposition: form-data; name="category"\r\n\r\n'
+         f'{category}'
+         f'\r\n--{boundary}--\r\n'
+         'епілог після форми\r\n').encode()
+
+
+class MultipartUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = main.MATERIAL_CHUNK_SIZE
+        # Дрібні шматки: роздільник потрапляє на межу читання
+        main.MATERIAL_CHUNK_SIZE = 64
+        self.store = FakeMaterialStore()
+        self.server = main.StudyVaultHTTPServer(
+            ('127.0.0.1', 0), main.StudyVaultHTTPHandler,
+            materials=self.store)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.connection = http.client.HTTPConnection(
+            '127.0.0.1', self.server.server_address[1], timeout=5)
+
+    def tearDown(self):
+        main.MATERIAL_CHUNK_SIZE = self.chunk_size
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def upload(self, content):
+        boundary = 'studyvault-boundary'
+        self.connection.request(
+            'POST', '/api/materials/upload',
+            body=multipart_body(boundary, content, 'Математика'),
+            headers={'Content-Type':
+                     f'multipart/form-data; boundary={boundary}'})
+        response = self.connection.getresponse()
+        response.read()
+        return response
+
+    def test_two_uploads_on_one_connection(self):
+        first = self.upload(b'\x00\x01' * 500)
+        second = self.upload(b'second file')
+
+        self.assertEqual(first.status, 201)
+        self.assertEqual(second.status, 201)
+        self.assertEqual([d['length'] for d in self.store.saved], [1000, 11])
+
+    def test_field_after_file(self):
+        self.upload(b'content')
+
+        self.assertEqual(self.store.saved[0]['metadata']['category'],
+                         'Математика')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Повторний запис пакета в time-series колекцію"""
+
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from bson import ObjectId
+
+import main
+import migrate_dates
+
+
+class FakeTimeseriesCollection:
+    """Як time-series колекція: _id не унікальний, дублікати не помилка"""
+
+    def __init__(self):
+        self.documents = []
+
+    def insert_many(self, documents, ordered=True):
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+        self.documents.extend(dict(d) for d in documents)
+        return mock.Mock(inserted_ids=[d['_id'] for d in documents])
+
+    def find(self, query, projection=None):
+        dates, ids = query['date'], set(query['_id']['$in'])
+        return [{'_id': d['_id']} for d in self.documents
+                if d['_id'] in ids and
+                dates['$gte'] <= main.to_utc_naive(d['date']) <= dates['$lte']]
+
+
+def message_batch(count):
+    started = datetime(2024, 8, 14, 18, tzinfo=timezone.utc)
+    return [{'_id': ObjectId(), 'date': started + timedelta(seconds=i),
+             'username': f'user{i % 3}', 'message': f'повідомлення {i}'}
+            for i in range(count)]
+
+
+class TimeseriesReplayTest(unittest.TestCase):
+
+    def test_spool_batch_replayed_twice(self):
+        collection = FakeTimeseriesCollection()
+        batch = message_batch(5)
+        saved = []
+
+        with mock.patch.object(main, 'MESSAGES_TIMESERIES', True):
+            self.assertTrue(main.insert_message_batch(
+                collection, [dict(d) for d in batch], [saved.extend]))
+            # Журнал після збою до checkpoint відправляє той самий пакет
+            self.assertTrue(main.insert_message_batch(
+                collection, [dict(d) for d in batch] + message_batch(1),
+                [saved.extend]))
+
+        self.assertEqual(len(collection.documents), 6)
+        self.assertEqual(len(saved), 6)
+
+    def test_resumed_migration_batch(self):
+        target = FakeTimeseriesCollection()
+        batch = message_batch(4)
+
+        migrate_dates.write_batch(None, target, [dict(d) for d in batch],
+                                  in_place=False, timeseries=True)
+        migrate_dates.write_batch(None, target, [dict(d) for d in batch],
+                                  in_place=False, timeseries=True)
+
+        self.assertEqual(sorted(d['_id'] for d in target.documents),
+                         sorted(d['_id'] for d in batch))
+
+
+if __name__ == '__main__':
+    unittest.main()